@@ -0,0 +1,65 @@
+""" Measures how many ITU requests per second the threaded connection can
+receive and acknowledge, with the receive thread waiting for each
+acknowledgement to be written, as it used to, and without waiting.
+
+Run from the root of the repository with
+``PYTHONPATH=. python benchmarks/bench_acknowledge.py``.
+"""
+import socket
+import time
+from threading import Thread
+
+from payment_terminal.drivers.bbs.connection import BBSMsgRouterConnection
+from payment_terminal.drivers.bbs.protocol import pack_frame
+from payment_terminal.drivers.bbs.session import BBSSession
+
+
+ACK = pack_frame(b'\x5b00\x5d')
+DISPLAY_TEXT = pack_frame(b'\x41100Insert card')
+
+
+class _WaitingConnection(BBSMsgRouterConnection):
+    def _respond(self, message, *, wait=True):
+        return super(_WaitingConnection, self)._respond(message, wait=wait)
+
+
+def bench(connection_class, count=20000):
+    local, remote = socket.socketpair()
+    connection = connection_class(local)
+    BBSSession(connection)
+
+    def send():
+        remote.sendall(DISPLAY_TEXT * count)
+
+    try:
+        start = time.perf_counter()
+        sender = Thread(target=send)
+        sender.start()
+
+        remaining = len(ACK) * count
+        while remaining:
+            chunk = remote.recv(min(remaining, 65536))
+            if not chunk:
+                raise EOFError()
+            remaining -= len(chunk)
+        elapsed = time.perf_counter() - start
+        sender.join()
+    finally:
+        # the plain session can't be cancelled
+        connection.set_current_session(None)
+        connection.shutdown()
+        remote.close()
+
+    return count / elapsed
+
+
+def main():
+    before = max(bench(_WaitingConnection) for _ in range(3))
+    after = max(bench(BBSMsgRouterConnection) for _ in range(3))
+    print("waiting for write: %8.0f frames/s" % before)
+    print("queued:            %8.0f frames/s" % after)
+    print("speedup:           %8.2fx" % (after / before))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+""" Compares dispatching ITU frames with a single lookup on the type byte
+against the previous approach of decoding a generic header first.
+
+Run from the root of the repository with
+``PYTHONPATH=. python benchmarks/bench_dispatch.py``.
+"""
+import timeit
+
+from payment_terminal.drivers.bbs import messages as m
+from payment_terminal.drivers.bbs.fields import EnumField
+
+
+class _HeaderMessage(m.BBSMessage):
+    type = EnumField({
+        subtype._fields['type'].value: subtype
+        for subtype in m._ITU_MESSAGE_TYPES
+    })
+
+
+def unpack_two_pass(data):
+    header = _HeaderMessage.unpack(data)
+    return header.type.unpack(data)
+
+
+FRAMES = [
+    b'\x41100Insert card',
+    b'\x41000PIN',
+    b'\x43060',
+    b'\x42\x20\x22\x2aFirst\x0eSecond\x0c',
+]
+
+
+def bench(unpack, number=20000):
+    def run():
+        for frame in FRAMES:
+            unpack(frame)
+    return min(timeit.repeat(run, number=number, repeat=5)) / number
+
+
+def main():
+    before = bench(unpack_two_pass)
+    after = bench(m.unpack_itu_message)
+    per_frame = 1e6 / len(FRAMES)
+    print("two pass:      %.2f us/frame" % (before * per_frame))
+    print("single lookup: %.2f us/frame" % (after * per_frame))
+    print("speedup:       %.2fx" % (before / after))
+
+
+if __name__ == '__main__':
+    main()
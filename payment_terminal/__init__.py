@@ -1,7 +1,10 @@
+from concurrent import futures
 from urllib.parse import urlparse
 
 from payment_terminal.exceptions import NotSupportedError
+from payment_terminal.callbacks import CallbackExecutor
 from payment_terminal.drivers import bbs, dummy
+from payment_terminal.pool import TerminalPool
 
 
 _BUILTIN_DRIVERS = {
@@ -17,15 +20,73 @@ def register_driver(uri_scheme, factory):
     _drivers[uri_scheme] = factory
 
 
-def open_terminal(uri):
+def _find_driver(drivers, uri):
+    """ Returns the factory registered in ``drivers`` for the scheme of
+    ``uri``.  Shared by the blocking and asyncio registries.
+    """
     scheme = urlparse(uri).scheme
     if not scheme or scheme == uri:
         raise ValueError("Malformed terminal uri")
     try:
-        driver = _drivers[scheme]
+        return drivers[scheme]
     except KeyError as e:
         raise NotSupportedError("Unrecognised terminal uri") from e
-    else:
-        return driver(uri)
 
-__all__ = ['register_driver', 'open_terminal']
+
+def open_terminal(uri):
+    return _find_driver(_drivers, uri)(uri)
+
+
+def _shutdown_late(future):
+    # the caller has given up on this terminal, so nothing else will
+    if not future.cancelled() and future.exception() is None:
+        future.result().shutdown()
+
+
+def open_terminals(uris, *, timeout=None, max_workers=32):
+    """Opens terminals for many uris at once.
+
+    Up to ``max_workers`` terminals are opened concurrently, so one
+    unresponsive terminal does not hold up the others.  Per-uri connect
+    timeouts are up to the driver, for example the ``connect_timeout`` option
+    of ``bbs+tcp`` uris.
+
+    :param timeout:
+        Seconds to wait for all terminals to open.  Terminals that are still
+        opening when it expires are reported as a ``TimeoutError`` and shut
+        down once they have finished opening.
+
+    :returns:
+        A dictionary mapping each uri to either the opened terminal, or the
+        exception raised trying to open it
+    """
+    uris = set(uris)
+    results = {}
+
+    executor = futures.ThreadPoolExecutor(max(min(max_workers, len(uris)), 1))
+    try:
+        opening = {executor.submit(open_terminal, uri): uri for uri in uris}
+
+        done, not_done = futures.wait(opening, timeout)
+
+        for future in done:
+            try:
+                results[opening[future]] = future.result()
+            except Exception as e:
+                results[opening[future]] = e
+
+        for future in not_done:
+            results[opening[future]] = TimeoutError(
+                "timed out opening terminal"
+            )
+            future.add_done_callback(_shutdown_late)
+            future.cancel()
+    finally:
+        executor.shutdown(wait=False)
+
+    return results
+
+__all__ = [
+    'register_driver', 'open_terminal', 'open_terminals', 'TerminalPool',
+    'CallbackExecutor',
+]
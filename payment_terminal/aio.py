@@ -0,0 +1,27 @@
+from payment_terminal import _find_driver
+from payment_terminal.drivers.bbs import aio as bbs_aio
+
+
+_BUILTIN_DRIVERS = {
+    'bbs+tcp': bbs_aio.open_tcp,
+}
+
+_drivers = {}
+_drivers.update(_BUILTIN_DRIVERS)
+
+
+def register_driver(uri_scheme, factory):
+    """ Registers a coroutine function that opens an asyncio terminal for
+    uris with the given scheme.
+    """
+    _drivers[uri_scheme] = factory
+
+
+async def open_terminal(uri):
+    """ Asyncio equivalent of :py:func:`payment_terminal.open_terminal`.
+    Terminals returned by it have coroutine ``start_payment`` and
+    ``shutdown`` methods, and return awaitable sessions.
+    """
+    return await _find_driver(_drivers, uri)(uri)
+
+__all__ = ['register_driver', 'open_terminal']
@@ -4,9 +4,12 @@ class Session(object):
 
 class Payment(object):
     def __init__(
-            self, amount, *, card_pan=None, card_end_date=None,
-            provider_scheme=None, provider_auth_code=None):
+            self, amount, *, amount_minor=None, card_pan=None,
+            card_end_date=None, provider_scheme=None,
+            provider_auth_code=None):
         self.amount = amount
+        # the amount as an integer number of minor currency units, if known
+        self.amount_minor = amount_minor
         self.card_pan = card_pan
         self.card_end_date = card_end_date
         self.provider_scheme = provider_scheme
@@ -73,7 +76,7 @@ class PaymentSession(Session):
 class Terminal(object):
     def start_payment(
             self, amount, *, before_commit=None,
-            on_print=None, on_display=None):
+            on_print=None, on_display=None, coalesce_display=False):
         """
         :param amount:
             The amount of money to request
@@ -86,7 +89,10 @@ class Terminal(object):
             will be re-raised by the ``PaymentSession.result`` method.
 
         :param on_print:
-            function to be called when a print message is received
+            function to be called when a print message is received.  Should
+            accept an iterable of print commands as its only argument.  The
+            commands may be decoded as they are consumed, so the iterable can
+            only be used once.
 
         :param on_display:
             function to be called when a display message is received.
@@ -94,6 +100,13 @@ class Terminal(object):
             keyword arguments: ``prompt_customer`` and ``expects_input``.
             TODO
 
+        :param coalesce_display:
+            If ``True`` and ``on_display`` falls behind, only the latest
+            display update is passed to it.  Updates are never merged across
+            a change to ``prompt_customer`` or ``expects_input``.  The
+            terminal is answered without waiting for ``on_display`` either
+            way.
+
         :returns: a new active ``PaymentSession`` object
         """
         pass
@@ -101,5 +114,11 @@ class Terminal(object):
     def get_current_session(self):
         pass
 
+    def is_connected(self):
+        """Return `False` if the connection to the terminal has been lost and
+        the terminal can no longer be used.
+        """
+        return True
+
     def shutdown(self):
         pass
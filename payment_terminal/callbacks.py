@@ -0,0 +1,183 @@
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+
+import logging
+log = logging.getLogger('payment_terminal')
+
+
+class CallbackExecutor(object):
+    """ Runs user supplied callbacks, such as ``on_print``, ``on_display`` and
+    ``before_commit``, away from the threads that talk to the terminal, so
+    that a slow callback can't hold up traffic.
+
+    Callbacks are run on ``executor``, which may be any
+    :py:class:`concurrent.futures.Executor`.  If it is not given, the
+    callback executor owns a thread pool of ``max_workers`` threads.
+    Callbacks submitted through the same :py:meth:`serial` queue run one at a
+    time, in the order that they were submitted.  Each payment session has
+    its own queue.
+
+    The time spent running callbacks is recorded, and callbacks that take
+    longer than ``slow_callback_duration`` seconds are logged.
+    """
+    def __init__(
+            self, executor=None, *, max_workers=4,
+            slow_callback_duration=1.0):
+        super(CallbackExecutor, self).__init__()
+
+        self._owns_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers)
+        self._executor = executor
+
+        self.slow_callback_duration = slow_callback_duration
+
+        self._lock = Lock()
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.merged = 0
+
+    def serial(self):
+        """ Returns a new :py:class:`CallbackQueue` that runs its callbacks
+        on this executor.
+        """
+        return CallbackQueue(self)
+
+    def _run(self, fn, args, kwargs):
+        start = time.monotonic()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self.calls += 1
+                self.total_time += elapsed
+                self.max_time = max(self.max_time, elapsed)
+            if (
+                    self.slow_callback_duration is not None and
+                    elapsed >= self.slow_callback_duration):
+                log.warning("callback %r took %.3f seconds", fn, elapsed)
+
+    def _record_merge(self):
+        with self._lock:
+            self.merged += 1
+
+    def stats(self):
+        """ Returns a dictionary with the number of callbacks that have run
+        (``calls``), the mean and maximum number of seconds that they took
+        (``mean_time`` and ``max_time``), and the number of callbacks that
+        were merged into a later one by :py:meth:`CallbackQueue.coalesce`
+        (``merged``).
+        """
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'mean_time': (
+                    self.total_time / self.calls if self.calls else 0.0
+                ),
+                'max_time': self.max_time,
+                'merged': self.merged,
+            }
+
+    def shutdown(self):
+        """ Stops the thread pool, if the callback executor owns one, without
+        waiting for it.  Callbacks that have already been submitted will still
+        be run.
+        """
+        if self._owns_executor:
+            self._executor.shutdown(wait=False)
+
+
+class CallbackQueue(object):
+    """ Runs callbacks on a :py:class:`CallbackExecutor` one at a time, in
+    the order that they were submitted.
+
+    Errors raised by callbacks are logged, as nothing may be waiting for
+    their result.
+    """
+    def __init__(self, callback_executor):
+        super(CallbackQueue, self).__init__()
+        self._callback_executor = callback_executor
+
+        self._lock = Lock()
+        # `[future, fn, args, kwargs, key]` lists waiting to be run
+        self._pending = deque()
+        # set while a task draining `_pending` is scheduled on the executor
+        self._running = False
+
+        # number of callbacks replaced by `coalesce`
+        self.merged = 0
+
+    def submit(self, fn, *args, **kwargs):
+        """ Schedules ``fn(*args, **kwargs)`` to run after every callback
+        already submitted to this queue.
+
+        :returns:
+            A :py:class:`concurrent.futures.Future` for the result
+        """
+        return self._submit(None, fn, args, kwargs)
+
+    def coalesce(self, key, fn, *args, **kwargs):
+        """ Like :py:meth:`submit`, but if the last callback in the queue was
+        also submitted with :py:meth:`coalesce`, with the same ``fn`` and
+        ``key``, and hasn't started yet, it is called with these arguments
+        instead.  Callbacks are only merged while the queue is behind, and
+        never across callbacks with a different key.
+
+        :returns:
+            A :py:class:`concurrent.futures.Future` for the result, which may
+            be shared with merged callbacks
+        """
+        if key is None:
+            raise ValueError("key must not be None")
+        return self._submit(key, fn, args, kwargs)
+
+    def _submit(self, key, fn, args, kwargs):
+        with self._lock:
+            if key is not None and self._pending:
+                last = self._pending[-1]
+                if (
+                        last[1] == fn and last[4] == key and
+                        not last[0].cancelled()):
+                    last[2:4] = args, kwargs
+                    self.merged += 1
+                    self._callback_executor._record_merge()
+                    return last[0]
+
+            future = Future()
+            self._pending.append([future, fn, args, kwargs, key])
+            if self._running:
+                return future
+            self._running = True
+
+        try:
+            self._callback_executor._executor.submit(self._drain)
+        except Exception as e:
+            with self._lock:
+                self._running = False
+                pending, self._pending = self._pending, deque()
+            for item in pending:
+                item[0].set_exception(e)
+            raise
+        return future
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._running = False
+                    return
+                future, fn, args, kwargs, key = self._pending.popleft()
+
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = self._callback_executor._run(fn, args, kwargs)
+            except Exception as e:
+                log.exception("error in callback")
+                future.set_exception(e)
+            else:
+                future.set_result(result)
@@ -1,9 +1,11 @@
 import socket
-from urllib.parse import urlparse
+from urllib.parse import urlparse, parse_qs
 
 from payment_terminal.base import Terminal
+from payment_terminal.callbacks import CallbackExecutor
 
 from .connection import BBSMsgRouterConnection
+from .hub import BBSConnectionHub
 from .payment_session import BBSPaymentSession
 
 import logging
@@ -11,31 +13,155 @@ log = logging.getLogger('payment_terminal')
 
 
 class BBSMsgRouterTerminal(Terminal):
-    def __init__(self, port):
-        self._connection = BBSMsgRouterConnection(port)
+    """ A terminal connected through the bbs msg router.
+
+    Payment callbacks are run on ``callback_executor``, which may be any
+    :py:class:`concurrent.futures.Executor`, so that they never hold up the
+    connection.  A :py:class:`~payment_terminal.callbacks.CallbackExecutor`
+    can also be passed to share it between terminals, in which case it is
+    left running when the terminal is shut down.  By default the terminal
+    uses a small thread pool of its own.
+    """
+    def __init__(self, port=None, *, connection=None, callback_executor=None):
+        if connection is None:
+            connection = BBSMsgRouterConnection(port)
+        self._connection = connection
+
+        self._owns_callback_executor = not isinstance(
+            callback_executor, CallbackExecutor
+        )
+        if self._owns_callback_executor:
+            callback_executor = CallbackExecutor(callback_executor)
+        self._callback_executor = callback_executor
 
     def start_payment(
             self, amount, *, before_commit=None,
-            on_print=None, on_display=None):
+            on_print=None, on_display=None, coalesce_display=False):
         """
         :returns: a new active ``PaymentSession`` object
         """
         return BBSPaymentSession(
             self._connection, amount, before_commit=before_commit,
-            on_print=on_print, on_display=on_display
+            on_print=on_print, on_display=on_display,
+            callbacks=self._callback_executor.serial(),
+            coalesce_display=coalesce_display,
         )
 
+    def is_connected(self):
+        return not self._connection.closed
+
+    def callback_stats(self):
+        """ Returns the number of payment callbacks run and how long they
+        took, as described by :py:meth:`CallbackExecutor.stats`.  The counts
+        include every terminal sharing the callback executor.
+        """
+        return self._callback_executor.stats()
+
     def shutdown(self):
         self._connection.shutdown()
+        if self._owns_callback_executor:
+            self._callback_executor.shutdown()
 
 
-def open_tcp(uri):
+def _parse_bool(value):
+    if value.lower() in ('1', 'true', 'yes', 'on'):
+        return True
+    if value.lower() in ('0', 'false', 'no', 'off'):
+        return False
+    raise ValueError("expected a boolean: %r" % value)
+
+
+def _parse_timeout(value):
+    if value.lower() in ('', 'none'):
+        return None
+    timeout = float(value)
+    if timeout <= 0:
+        raise ValueError("timeout must be positive: %r" % value)
+    return timeout
+
+
+# Options that can be passed as query parameters in a ``bbs+tcp`` uri
+_TCP_OPTIONS = {
+    'connect_timeout': _parse_timeout,
+    'read_timeout': _parse_timeout,
+    'request_timeout': _parse_timeout,
+    'nodelay': _parse_bool,
+    'keepalive': _parse_bool,
+}
+
+
+def _parse_tcp_options(query):
+    options = dict.fromkeys(_TCP_OPTIONS)
+    options.update(nodelay=False, keepalive=False)
+
+    for name, values in parse_qs(query, keep_blank_values=True).items():
+        try:
+            parse = _TCP_OPTIONS[name]
+        except KeyError:
+            raise ValueError("unrecognised option: %r" % name) from None
+        options[name] = parse(values[-1])
+
+    return options
+
+
+def _set_socket_options(s, options):
+    if options['nodelay']:
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if options['keepalive']:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+
+def _connect_tcp(uri):
+    """ Opens a socket to the bbs msg router described by ``uri``, with the
+    options from its query string applied.
+
+    :returns:
+        A ``(socket, options)`` pair
+    """
     uri_parts = urlparse(uri)
+    options = _parse_tcp_options(uri_parts.query)
+
+    s = socket.create_connection(
+        (uri_parts.hostname, uri_parts.port),
+        timeout=options['connect_timeout'],
+    )
+    try:
+        _set_socket_options(s, options)
+        s.settimeout(options['read_timeout'])
+    except BaseException:
+        s.close()
+        raise
+    return s, options
+
+
+def open_tcp(uri):
+    """ Connects to a bbs msg router listening on a TCP port.
+
+    The following options can be passed as query parameters, for example
+    ``bbs+tcp://10.0.0.5:9100?connect_timeout=5&nodelay=1``:
 
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.connect((uri_parts.hostname, uri_parts.port))
-    port = s.makefile(mode='r+b', buffering=True)
+    ``connect_timeout``
+        Seconds to wait for the connection to be established.
+    ``read_timeout``
+        Seconds the ITU may stay silent before the connection is considered
+        lost and shut down.  Only used by the threaded driver.
+    ``request_timeout``
+        Seconds to wait for the ITU to respond to each request.
+    ``nodelay``
+        Set ``TCP_NODELAY`` on the socket.
+    ``keepalive``
+        Enable TCP keepalive probes on the socket.
 
-    return BBSMsgRouterTerminal(port)
+    By default there are no timeouts and no socket options are set.
+    """
+    s, options = _connect_tcp(uri)
+    try:
+        # the connection reads from and writes to the socket directly
+        return BBSMsgRouterTerminal(connection=BBSMsgRouterConnection(
+            s, request_timeout=options['request_timeout'],
+        ))
+    except BaseException:
+        s.close()
+        raise
 
-__all__ = ['BBSMsgRouterTerminal', 'open_tcp']
+__all__ = ['BBSMsgRouterTerminal', 'BBSConnectionHub', 'open_tcp']
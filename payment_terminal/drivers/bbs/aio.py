@@ -0,0 +1,486 @@
+import asyncio
+import inspect
+from collections import deque
+from urllib.parse import urlparse
+
+from payment_terminal.base import Session, Payment
+from payment_terminal.exceptions import (
+    SessionCompletedError, SessionCancelledError, CancelFailedError,
+    ConnectionError,
+)
+
+from . import _parse_tcp_options, _set_socket_options
+from .connection import TerminalError, ResponseInterruptedError
+from .fields import decimal_to_minor
+from .payment_session import RUNNING, CANCELLING, REVERSING, FINISHED, BROKEN
+from .protocol import (
+    BBSProtocol, RequestReceived, FramingError, RequestTimeoutError,
+    OutOfSyncError, _NACK,
+    transfer_amount_request, abort_request, reversal_request,
+)
+from .session import BBSSession
+
+import logging
+log = logging.getLogger('payment_terminal')
+
+
+async def _maybe_await(value):
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+class AsyncBBSMsgRouterConnection(asyncio.Protocol):
+    """ An asyncio driver for :py:class:`protocol.BBSProtocol`.
+
+    Requests from the ITU are passed on to the current session one at a time,
+    in the order that they were received.  Session callbacks may return
+    awaitables, in which case the response to the ITU is sent once they
+    complete.
+
+    `request_...` methods send a single request to the message router and
+    return a future that yields the response.  If the ITU does not respond
+    within ``request_timeout`` seconds, the future fails with
+    :py:class:`RequestTimeoutError` and the connection is closed.
+    """
+    def __init__(
+            self, *, loop=None, lazy_decoding=False, message_cache=None,
+            request_timeout=None):
+        super(AsyncBBSMsgRouterConnection, self).__init__()
+
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self._loop = loop
+
+        self._protocol = BBSProtocol(
+            lazy_decoding=lazy_decoding, message_cache=message_cache,
+        )
+        self._transport = None
+        self._current_session = None
+
+        self._request_timeout = request_timeout
+        # a single timer for the earliest deadline known to the protocol
+        self._expiry = None
+        self._expiry_deadline = None
+
+        # requests from the ITU waiting to be handled, and whether a task is
+        # currently working through them
+        self._requests = deque()
+        self._handling = False
+
+        self._closed = loop.create_future()
+
+    def set_current_session(self, session):
+        if self._current_session is not None:
+            self._current_session.unbind()
+        self._current_session = session
+
+    def get_current_session(self):
+        return self._current_session
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def data_received(self, data):
+        try:
+            events = self._protocol.receive_data(data)
+        except Exception:
+            log.exception("error receiving data")
+            self.close()
+            return
+
+        for event in events:
+            if isinstance(event, RequestReceived):
+                self._requests.append(event)
+            elif not event.request.done():
+                event.request.set_result(event.message)
+        self._schedule_expiry()
+
+        if self._requests and not self._handling:
+            self._handling = True
+            self._loop.create_task(self._handle_requests())
+
+    def eof_received(self):
+        try:
+            self._protocol.receive_data(b'')
+        except FramingError:
+            log.exception("connection closed part way through a frame")
+
+    def connection_lost(self, exc):
+        if exc is not None:
+            log.error("connection lost", exc_info=exc)
+
+        for request in self._protocol.close():
+            if not request.done():
+                request.set_exception(ResponseInterruptedError())
+        self._schedule_expiry()
+
+        if self._current_session is not None:
+            self._current_session.unbind()
+
+        if not self._closed.done():
+            self._closed.set_result(None)
+
+    async def _handle_requests(self):
+        try:
+            while self._requests:
+                event = self._requests.popleft()
+                try:
+                    response = await _maybe_await(
+                        event.dispatch(self._current_session)
+                    )
+                    if response is not None:
+                        response = response.pack()
+
+                except TerminalError:
+                    # exception is intended for the ITU and shouldn't cause
+                    # the driver to shut down
+                    log.warning(
+                        "error handling message from terminal",
+                        exc_info=True
+                    )
+                    response = _NACK
+
+                except Exception:
+                    log.exception("critical error while handling message")
+                    self.close()
+                    return
+
+                if self._protocol.closed:
+                    return
+                self._protocol.send_response(response)
+                self._flush()
+        finally:
+            self._handling = False
+
+    def _flush(self):
+        data = self._protocol.data_to_send()
+        if data:
+            self._transport.write(data)
+
+    def _schedule_expiry(self):
+        deadline = self._protocol.next_deadline()
+        if deadline == self._expiry_deadline:
+            return
+        if self._expiry is not None:
+            self._expiry.cancel()
+            self._expiry = None
+
+        self._expiry_deadline = deadline
+        if deadline is not None:
+            self._expiry = self._loop.call_at(deadline, self._expire_requests)
+
+    def _expire_requests(self):
+        self._expiry = self._expiry_deadline = None
+        timed_out, interrupted = self._protocol.expire(self._loop.time())
+
+        for request in timed_out:
+            if not request.done():
+                request.set_exception(RequestTimeoutError())
+        for request in interrupted:
+            if not request.done():
+                request.set_exception(ResponseInterruptedError())
+
+        if timed_out:
+            log.warning("request to terminal timed out, closing connection")
+            self.close()
+        else:
+            self._schedule_expiry()
+
+    def _request(self, data, timeout):
+        request = self._loop.create_future()
+        if self._protocol.closed:
+            request.set_exception(ResponseInterruptedError())
+            return request
+
+        if timeout is None:
+            timeout = self._request_timeout
+        deadline = None
+        if timeout is not None:
+            deadline = self._loop.time() + timeout
+
+        try:
+            self._protocol.send_request(data, request, deadline=deadline)
+        except OutOfSyncError as e:
+            request.set_exception(e)
+            return request
+        self._flush()
+        self._schedule_expiry()
+        return request
+
+    def request_transfer_amount(self, amount, *, timeout=None):
+        """ Start a payment Bank Mode session.
+
+        :param int amount:
+            The amount to request, as an integer number of minor units
+        :param timeout:
+            Seconds to wait for a response.  Defaults to the connection's
+            ``request_timeout``.
+        """
+        return self._request(transfer_amount_request(amount), timeout)
+
+    def request_abort(self, *, timeout=None):
+        """ Request that the ITU exit Bank Mode.  A successful response does
+        not indicate that a request was cancelled.
+        """
+        return self._request(abort_request(), timeout)
+
+    def request_reversal(self, amount, *, timeout=None):
+        """ Request that the ITU reverse the most recent payment.
+
+        :param int amount:
+            The amount of the payment to reverse, as an integer number of
+            minor units
+        """
+        return self._request(reversal_request(amount), timeout)
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+
+    async def wait_closed(self):
+        await asyncio.shield(self._closed)
+
+
+class AsyncBBSPaymentSession(BBSSession, Session):
+    """ A payment session that integrates with asyncio.
+
+    Awaiting the session waits for the payment to complete and returns the
+    :py:class:`Payment` result, as does awaiting :py:meth:`result`.
+    ``before_commit``, ``on_print`` and ``on_display`` may be plain functions
+    or coroutine functions.  The ITU is not answered until they return.
+    """
+    def __init__(
+            self, connection, amount, *, before_commit=None,
+            on_print=None, on_display=None, loop=None):
+        super(AsyncBBSPaymentSession, self).__init__(connection)
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self._loop = loop
+        self._future = loop.create_future()
+
+        self._state = RUNNING
+
+        self.amount = amount
+        self.amount_minor = decimal_to_minor(amount)
+
+        self._commit_callback = before_commit
+        self._print_callback = on_print
+        self._display_callback = on_display
+
+    async def _start(self):
+        try:
+            await self._connection.request_transfer_amount(self.amount_minor)
+        except Exception:
+            # the session never started, so nothing will wait for its result
+            self._finish(exception=SessionCancelledError())
+            self._future.exception()
+            raise
+
+    def _finish(self, result=None, exception=None):
+        if self._state != BROKEN:
+            self._state = FINISHED
+        if self._future.done():
+            return
+        if exception is not None:
+            self._future.set_exception(exception)
+        else:
+            self._future.set_result(result)
+
+    def _start_reversal(self):
+        self._state = REVERSING
+
+        def on_response(request):
+            if request.cancelled() or request.exception() is not None:
+                # XXX This is really really bad
+                self._state = BROKEN
+                self._finish(exception=CancelFailedError())
+
+        # sent once the Local Mode request that triggered it has been
+        # answered
+        self._loop.call_soon(
+            lambda: self._connection.request_reversal(
+                self.amount_minor
+            ).add_done_callback(on_response)
+        )
+
+    def on_req_display_text(
+            self, text, *, prompt_customer=False, expects_input=False):
+        if self._display_callback is not None:
+            return self._display_callback(
+                text, prompt_customer=prompt_customer,
+                expects_input=expects_input,
+            )
+
+    def on_req_print_text(self, commands):
+        if self._print_callback is not None:
+            return self._print_callback(commands)
+
+    async def on_req_local_mode(self, result, **kwargs):
+        """
+        .. note:: Internal use only
+        """
+        if self._state == RUNNING:
+            if result == 'success':
+                # TODO populate properly
+                result_object = Payment(
+                    self.amount, amount_minor=self.amount_minor
+                )
+                commit = True
+                if self._commit_callback is not None:
+                    try:
+                        commit = await _maybe_await(
+                            self._commit_callback(result_object)
+                        )
+                    except Exception:
+                        log.exception("error in commit callback")
+                        commit = False
+
+                if commit:
+                    self._finish(result_object)
+                else:
+                    self._start_reversal()
+            else:
+                # TODO interpret errors from ITU
+                self._finish(exception=SessionCancelledError("itu error"))
+
+        elif self._state == CANCELLING:
+            if result == 'success':
+                self._start_reversal()
+            else:
+                self._finish(exception=SessionCancelledError())
+
+        elif self._state == REVERSING:
+            if result == 'success':
+                self._finish(exception=SessionCancelledError())
+            else:
+                # XXX
+                self._state = BROKEN
+                self._finish(exception=CancelFailedError())
+
+        else:
+            raise Exception("invalid state")
+
+    def _start_cancel(self):
+        if self._state == RUNNING:
+            self._state = CANCELLING
+            # don't wait for the response, the result of the cancellation is
+            # reported by the next Local Mode request
+            self._connection.request_abort()
+
+    async def cancel(self):
+        """ Tries to cancel the payment, and waits until the payment has
+        finished.
+
+        :raises CancelFailedError:
+            If the payment completed anyway
+        """
+        self._start_cancel()
+        try:
+            await self.result()
+        except SessionCancelledError:
+            # this is what we want
+            return
+        else:
+            raise CancelFailedError()
+
+    async def result(self):
+        return await asyncio.shield(self._future)
+
+    def __await__(self):
+        return self.result().__await__()
+
+    def done(self):
+        return self._future.done()
+
+    def cancelled(self):
+        return self._state == FINISHED and isinstance(
+            self._future.exception(), SessionCancelledError
+        )
+
+    def running(self):
+        return self._state == RUNNING
+
+    def add_done_callback(self, fn):
+        """ Registers a function to be called, with the session as its only
+        argument, once the payment has failed or completed.
+        """
+        self._future.add_done_callback(lambda future: fn(self))
+
+    def unbind(self):
+        if self._state == RUNNING and not self._connection._protocol.closed:
+            self._start_cancel()
+        elif not self._future.done():
+            self._finish(exception=ConnectionError("connection closed"))
+
+
+class AsyncBBSMsgRouterTerminal(object):
+    def __init__(self, connection, *, loop=None):
+        super(AsyncBBSMsgRouterTerminal, self).__init__()
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self._loop = loop
+        self._connection = connection
+
+    async def start_payment(
+            self, amount, *, before_commit=None,
+            on_print=None, on_display=None):
+        """ Starts a new payment and waits for the ITU to accept it.
+
+        :returns: a new active ``AsyncBBSPaymentSession`` object
+        """
+        session = AsyncBBSPaymentSession(
+            self._connection, amount, before_commit=before_commit,
+            on_print=on_print, on_display=on_display, loop=self._loop,
+        )
+        await session._start()
+        return session
+
+    def get_current_session(self):
+        return self._connection.get_current_session()
+
+    async def shutdown(self):
+        session = self._connection.get_current_session()
+        if session is not None and not session.done():
+            try:
+                await session.cancel()
+            except SessionCompletedError:
+                # Can't cancel as session has completed successfully
+                pass
+            except Exception:
+                log.exception("could not cancel session")
+
+        self._connection.close()
+        await self._connection.wait_closed()
+
+
+async def open_tcp(uri, *, loop=None):
+    """ Connects to a bbs msg router listening on a TCP port.
+
+    Accepts the same query parameters as the blocking
+    :py:func:`payment_terminal.drivers.bbs.open_tcp`, except that
+    ``read_timeout`` has no effect.
+
+    :returns: a new ``AsyncBBSMsgRouterTerminal``
+    """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    uri_parts = urlparse(uri)
+    options = _parse_tcp_options(uri_parts.query)
+
+    transport, connection = await asyncio.wait_for(
+        loop.create_connection(
+            lambda: AsyncBBSMsgRouterConnection(
+                loop=loop, request_timeout=options['request_timeout'],
+            ),
+            uri_parts.hostname, uri_parts.port,
+        ),
+        options['connect_timeout'],
+    )
+    try:
+        _set_socket_options(transport.get_extra_info('socket'), options)
+    except BaseException:
+        transport.close()
+        raise
+
+    return AsyncBBSMsgRouterTerminal(connection, loop=loop)
@@ -1,32 +1,151 @@
-import struct
 import queue
-from threading import Thread, Lock
+import socket
+import time
+from collections import deque
+from threading import Thread, Lock, Condition
 from concurrent.futures import Future
 
-from payment_terminal.exceptions import SessionCompletedError, ConnectionError
-from . import messages
+from payment_terminal.exceptions import ConnectionError
+from .protocol import (
+    BBSProtocol, RequestReceived, pack_frame, _HEADER, _NACK,
+    EndOfStreamError, TruncatedHeaderError, TruncatedBodyError,
+    RequestTimeoutError,
+    transfer_amount_request, abort_request, reversal_request,
+)
 
 import logging
 log = logging.getLogger('payment_terminal')
 
 
 def read_frame(port):
+    """ Reads a single frame from ``port``, reading no further than the end of
+    the frame.  Prefer :py:class:`FrameReader` for reading a stream of frames.
+    """
     header = port.read(2)
     if len(header) == 0:
-        raise Exception("end of file")
+        raise EndOfStreamError()
     if len(header) == 1:
-        raise Exception("header truncated")
+        raise TruncatedHeaderError()
 
-    size, = struct.unpack('>H', header)
+    size, = _HEADER.unpack(header)
     frame = port.read(size)
     if len(frame) < size:
-        raise Exception("unexpected end of file")
+        raise TruncatedBodyError(
+            "expected %i bytes, got %i" % (size, len(frame))
+        )
     return frame
 
 
+class FrameReader(object):
+    """ Reads length prefixed frames from a port into a single reusable
+    buffer.
+
+    Data is read in whatever chunks the port provides, using ``readinto1``
+    or ``recv_into`` if available, so that a single read will often pick up
+    several frames.  Frames that are already buffered are returned without
+    touching the port.  Ports that only provide ``read`` are read no further
+    than the end of the current frame.
+
+    Frames are returned as ``memoryview`` slices of the buffer.  They are
+    only valid until the next call to :py:meth:`read_frame` and must be
+    copied if they need to be kept.
+    """
+    def __init__(self, port):
+        super(FrameReader, self).__init__()
+
+        self._port = port
+
+        # big enough for the header and largest possible body of one frame
+        self._buffer = bytearray(_HEADER.size + 0xffff)
+        self._view = memoryview(self._buffer)
+        # buffered data that has not yet been returned as part of a frame
+        self._start = 0
+        self._end = 0
+
+        # `read` blocks until it has read as much as it was asked for, so
+        # must not be asked for anything past the end of the current frame
+        self._read_ahead = True
+        if hasattr(port, 'readinto1'):
+            self._readinto = port.readinto1
+        elif hasattr(port, 'recv_into'):
+            self._readinto = port.recv_into
+        else:
+            self._readinto = self._read_copy
+            self._read_ahead = False
+
+    def _read_copy(self, view):
+        data = self._port.read(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    def _fill(self, size):
+        """ Reads from the port until at least ``size`` bytes are buffered,
+        and returns the number of bytes that are.
+        """
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._start + size > len(self._buffer):
+            # move the partial frame back to the start of the buffer
+            pending = self._end - self._start
+            self._buffer[:pending] = self._buffer[self._start:self._end]
+            self._start, self._end = 0, pending
+
+        while self._end - self._start < size:
+            if self._read_ahead:
+                limit = len(self._buffer)
+            else:
+                limit = self._start + size
+
+            count = self._readinto(self._view[self._end:limit])
+            if not count:
+                break
+            self._end += count
+
+        return self._end - self._start
+
+    def read_frame(self):
+        """ Returns the body of the next frame.
+
+        :raises EndOfStreamError:
+            If the port is closed before the start of the frame
+        :raises TruncatedHeaderError:
+            If the port is closed part way through the header
+        :raises TruncatedBodyError:
+            If the port is closed part way through the body
+        """
+        buffered = self._end - self._start
+        if buffered < _HEADER.size:
+            buffered = self._fill(_HEADER.size)
+            if buffered == 0:
+                raise EndOfStreamError()
+            if buffered < _HEADER.size:
+                raise TruncatedHeaderError()
+
+        size, = _HEADER.unpack_from(self._buffer, self._start)
+        if buffered < _HEADER.size + size:
+            buffered = self._fill(_HEADER.size + size)
+            if buffered < _HEADER.size + size:
+                raise TruncatedBodyError("expected %i bytes, got %i" % (
+                    size, buffered - _HEADER.size
+                ))
+
+        start = self._start + _HEADER.size
+        self._start = start + size
+        return self._view[start:self._start]
+
+
 def write_frame(port, data):
-    port.write(struct.pack('>H', len(data)))
-    port.write(data)
+    write_frames(port, (data,))
+
+
+def write_frames(port, frames):
+    """ Writes any number of frames to ``port`` with a single call to
+    ``write`` followed by a single ``flush``.
+
+    :raises ValueError:
+        If a frame is too large to be sent.  Nothing will have been written.
+    """
+    port.write(b''.join([pack_frame(data) for data in frames]))
     port.flush()
 
 
@@ -42,10 +161,133 @@ class ResponseInterruptedError(ConnectionError):
     pass
 
 
+class SendQueueFullError(ConnectionError):
+    """ A request could not be queued because the send queue was full
+    """
+    pass
+
+
+# Policies for when the normal lane of the send queue is full
+BLOCK = 'block'
+FAIL = 'fail'
+
+
+class _SendQueue(object):
+    """ Queue of messages waiting for the send thread, split into two lanes.
+
+    Messages in the control lane, which carries responses to the ITU, aborts
+    and reversals, are always taken before those in the normal lane.  The
+    control lane is never bounded, so acknowledgements are never held up by
+    other traffic.  The normal lane holds at most ``maxsize`` messages, or any
+    number if ``maxsize`` is 0.  When it is full, :py:meth:`put` either waits
+    for room or, with the ``FAIL`` policy, raises
+    :py:class:`SendQueueFullError`.
+
+    Also records the greatest depth reached and how long messages waited
+    before being taken by the send thread.
+    """
+    def __init__(self, maxsize=0, policy=BLOCK):
+        super(_SendQueue, self).__init__()
+        if policy not in (BLOCK, FAIL):
+            raise ValueError("unknown queue policy: %r" % policy)
+
+        self._maxsize = maxsize
+        self._policy = policy
+
+        self._condition = Condition()
+        # `(time queued, message)` pairs
+        self._control = deque()
+        self._normal = deque()
+        self._closed = False
+
+        self.max_depth = 0
+        self.sent = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def put(self, message, *, control=False):
+        """ Queues a message.  Messages put after the queue has been closed
+        are cancelled.
+        """
+        with self._condition:
+            if not control and self._maxsize:
+                while len(self._normal) >= self._maxsize and not self._closed:
+                    if self._policy == FAIL:
+                        raise SendQueueFullError()
+                    self._condition.wait()
+
+            if self._closed:
+                if message is not None:
+                    message.cancel()
+                return
+
+            lane = self._control if control else self._normal
+            lane.append((time.monotonic(), message))
+            self.max_depth = max(
+                self.max_depth, len(self._control) + len(self._normal)
+            )
+            self._condition.notify_all()
+
+    def _ready(self):
+        return bool(self._control or self._normal)
+
+    def _pop(self):
+        if self._control:
+            queued_at, message = self._control.popleft()
+        else:
+            queued_at, message = self._normal.popleft()
+            # there is now room for a blocked `put`
+            self._condition.notify_all()
+
+        if message is not None:
+            wait = time.monotonic() - queued_at
+            self.sent += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+        return message
+
+    def get(self, timeout=None):
+        """ Takes the next message, waiting up to ``timeout`` seconds.
+
+        :raises queue.Empty:
+            If no message arrived in time
+        """
+        with self._condition:
+            if not self._condition.wait_for(self._ready, timeout):
+                raise queue.Empty()
+            return self._pop()
+
+    def get_nowait(self):
+        with self._condition:
+            if not self._ready():
+                raise queue.Empty()
+            return self._pop()
+
+    def close(self):
+        """ Stops accepting messages and wakes up anything waiting for room.
+        Messages that are already queued can still be taken.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'control_depth': len(self._control),
+                'normal_depth': len(self._normal),
+                'max_depth': self.max_depth,
+                'sent': self.sent,
+                'mean_wait': self.total_wait / self.sent if self.sent else 0.0,
+                'max_wait': self.max_wait,
+            }
+
+
 class _Message(Future):
-    def __init__(self, data):
+    def __init__(self, data, deadline=None):
         super(_Message, self).__init__()
         self.data = data
+        self.deadline = deadline
 
 
 class _Response(_Message):
@@ -56,52 +298,24 @@ class _Request(_Message):
     expects_response = True
 
 
-class BBSMsgRouterConnection(object):
-    """ Represents a connection to the bbs msg router.
-
-    Responsible for serializing outgoing messages and dispatching incoming
-    messages.
-
-    `_on_...` methods represent callbacks for received messages.  The mapping
-    from message type to callback is defined in the `_REQUEST_CODES` attribute.
-    Most of these will just unpack the message and call the corresponding
-    method on the current session.
+class _BBSConnectionBase(object):
+    """ Behaviour shared by drivers that run sessions synchronously.
 
-    `request_...` methods wrap building and submitting message structs
-    corresponding to a single request to the message router.  They will
-    normally return a future that yields the response.
+    Subclasses must provide ``_request``, which should queue a packed request
+    with a deadline on the :py:func:`time.monotonic` clock and return a future
+    that yields the response, and ``_respond``, which should queue a packed
+    response, or ``None`` for a plain acknowledgement, without waiting for it
+    to be written.  Responses must be sent in the order that they are
+    queued.  They must also set ``_protocol`` and ``_protocol_lock``, and call
+    :py:meth:`_expire_requests` once the protocol's next deadline has passed.
     """
-    def __init__(self, port):
-        super(BBSMsgRouterConnection, self).__init__()
-
-        self._REQUEST_CODES = {
-            messages.DisplayTextMessage: self._on_req_display_text,
-            messages.PrintTextMessage: self._on_req_print_text,
-            messages.ResetTimerMessage: self._on_req_reset_timer,
-            messages.LocalModeMessage: self._on_req_local_mode,
-            messages.KeyboardInputRequestMessage: self._on_req_keyboard_input,
-            messages.SendDataMessage: self._on_req_send_data,
-            messages.DeviceAttributeRequestMessage: self._on_req_device_attr,
-            messages.StatusMessage: self._on_req_status,
-        }
-
-        self._port = port
+    def __init__(self, *, request_timeout=None):
+        super(_BBSConnectionBase, self).__init__()
 
         self._lock = Lock()
-
-        self._shutdown = False
         self._current_session = None
 
-        # A queue of Message futures to be sent from the send thread
-        self._send_queue = queue.Queue()
-        # A queue of futures expecting a response from the card reader
-        self._response_queue = queue.Queue()
-
-        self._send_thread = Thread(target=self._send_loop, daemon=True)
-        self._send_thread.start()
-
-        self._receive_thread = Thread(target=self._receive_loop, daemon=True)
-        self._receive_thread.start()
+        self._request_timeout = request_timeout
 
     def set_current_session(self, session):
         with self._lock:
@@ -113,29 +327,56 @@ class BBSMsgRouterConnection(object):
         with self._lock:
             return self._current_session
 
-    def _request(self, message):
-        """ Send a request to the card reader
-
-        :param message:
-            bytestring to send to the ITU
-
-        :return: a Future that will yield the response
+    @property
+    def closed(self):
+        """ ``True`` once the connection to the ITU has been lost or shut
+        down.
         """
-        request = _Request(message)
-        self._send_queue.put(request)
-        return request
+        return (
+            self._shutdown or self._protocol.closed or
+            self._protocol.out_of_sync
+        )
 
-    def request_transfer_amount(self):
+    def _cancel_current_session(self):
+        # should be called with `_lock` held, after the connection has been
+        # marked as shut down, so must not wait for the ITU
+        if self._current_session is not None:
+            try:
+                self._current_session.unbind()
+            except Exception:
+                log.exception("could not cancel session")
+                # not ideal but we still want to shut down
+                pass
+
+    def _deadline(self, timeout):
+        if timeout is None:
+            timeout = self._request_timeout
+        if timeout is None:
+            return None
+        return time.monotonic() + timeout
+
+    def _request(self, message, deadline=None, *, control=False):
+        raise NotImplementedError()
+
+    def request_transfer_amount(self, amount, *, timeout=None):
         """ Start a payment Bank Mode session.
 
         Maps directly to a single H51 request to the ITU
 
+        :param int amount:
+            The amount to request, as an integer number of minor units
+        :param timeout:
+            Seconds to wait for a response before failing the request with
+            :py:class:`RequestTimeoutError`.  Defaults to the connection's
+            ``request_timeout``.
+
         .. note:: Should only be called by the current session.
         """
-        message = messages.TransferAmountMessage()
-        return self._request(message.pack())
+        return self._request(
+            transfer_amount_request(amount), self._deadline(timeout)
+        )
 
-    def request_abort(self):
+    def request_abort(self, *, timeout=None):
         """ Request that the ITU exit Bank Mode.  A successful response does
         not indicate that a request was cancelled.  Session should wait for
         the Local Mode request to determine the result.
@@ -144,124 +385,64 @@ class BBSMsgRouterConnection(object):
 
         .. note:: Should only be called by the current session.
         """
-        message = messages.AdministrationMessage(adm_code='cancel')
-        return self._request(message.pack())
+        return self._request(
+            abort_request(), self._deadline(timeout), control=True
+        )
 
-    def request_reversal(self, amount):
+    def request_reversal(self, amount, *, timeout=None):
         """ Request that the ITU reverse the most recent payment.
 
         Maps directly to a single H51 request to the ITU
 
+        :param int amount:
+            The amount of the payment to reverse, as an integer number of
+            minor units
+
         .. note:: Should only be called by the current session.
         """
-        message = messages.TransferAmountMessage(
-            transfer_type='reversal',
-            amount=amount,
+        return self._request(
+            reversal_request(amount), self._deadline(timeout), control=True
         )
-        return self._request(message.pack())
 
-    def _respond(self, message, *, async=False):
-        """ Respond to a request from the card reader
-
-        :param bytes message:
-            bytestring to send to the ITU
-        :param bool async:
-            If ``True``, :py:meth:`_respond` will block until the response has
-            been sent.
-            If ``False`` it will return a future that will yield ``None`` on
-            completion
-        :return:
-            If ``async`` is ``False``, a :py:class:`concurrent.futures.Future`
-            that will yield ``None`` once the response has been sent.
-            Otherwise nothing.
+    def _expire_requests(self):
+        """ Fails requests that have passed their deadline.  Once a request
+        has timed out, responses can no longer be paired with requests, so
+        the connection is shut down.
         """
-        response = _Response(message)
-        self._send_queue.put(response)
-        if async:
-            return response
-        else:
-            response.result()
+        with self._protocol_lock:
+            timed_out, interrupted = self._protocol.expire(time.monotonic())
 
-    def _send_loop(self):
-        """ Thread responsible for output to the card reader.
+        for request in timed_out:
+            if not request.done():
+                request.set_exception(RequestTimeoutError())
+        for request in interrupted:
+            if not request.done():
+                request.set_exception(ResponseInterruptedError())
 
-        The send thread reads messages from send queue and writes them to port.
-        Futures for messages expecting a response are pushed onto the response
-        queue in order that the requests were sent.
-        """
-        try:
-            while not self._shutdown:
-                message = self._send_queue.get()
-                if message is None:
-                    # shutdown will push None onto the send queue to stop send
-                    # loop from blocking on get forever
-                    return
-                log.debug("sending message: %r", message)
-                if message.set_running_or_notify_cancel():
-                    write_frame(self._port, message.data)
-
-                    if message.expects_response:
-                        self._response_queue.put(message)
-                    else:
-                        message.set_result(None)
-        except Exception:
-            if not self._shutdown:
-                log.exception("error sending data")
-                self._shutdown_async()
-
-    def _on_req_display_text(self, message):
-        return self.get_current_session().on_req_display_text(
-            message.text,
-            prompt_customer=message.prompt_customer,
-            expects_input=message.expects_input
-        )
-
-    def _on_req_print_text(self, message):
-        # TODO might make sense to handle printing in the connection rather
-        # than in the session
-        return self.get_current_session.on_req_print_text(message.commands)
-
-    def _on_req_reset_timer(self, message):
-        # TODO (possibly) reinterpret errors
-        return self.get_current_session().on_req_reset_timer(message.seconds)
-
-    def _on_req_local_mode(self, message):
-        # TODO
-        return self.get_current_session().on_req_local_mode(message.result)
-
-    def _on_req_keyboard_input(self, message):
-        # TODO
-        raise NotImplementedError()
-
-    def _on_req_send_data(self, message):
-        # TODO
-        raise NotImplementedError()
+        if timed_out:
+            log.warning("request to terminal timed out, closing connection")
+            self._shutdown_async()
 
-    def _on_req_device_attr(self, message):
-        # TODO
+    def _shutdown_async(self):
         raise NotImplementedError()
 
-    def _on_req_status(self, message):
-        # TODO
+    def _respond(self, message):
         raise NotImplementedError()
 
-    def _handle_request(self, message):
-        # TODO XXX hacky XXX
-        handler = self._REQUEST_CODES[message.__class__]
-
+    def _handle_request(self, event):
         try:
-            response = handler(message)
-            if response is None:
-                response = messages.ResponseMessage()
+            response = event.dispatch(self.get_current_session())
+            if response is not None:
+                response = response.pack()
 
-        except TerminalError as e:
+        except TerminalError:
             # exception is intended for the ITU and shouldn't cause
             # the driver to shut down
             log.warning(
                 "error handling message from terminal",
                 exc_info=True
             )
-            response = self._ack_exception(e)
+            response = _NACK
 
         except Exception:
             # log and break
@@ -270,14 +451,198 @@ class BBSMsgRouterConnection(object):
 
         self._respond(response)
 
-    def _handle_response(self, message):
+
+class BBSMsgRouterConnection(_BBSConnectionBase):
+    """ Represents a connection to the bbs msg router.
+
+    A threaded driver for :py:class:`protocol.BBSProtocol`, which is
+    responsible for framing, decoding incoming messages and pairing responses
+    with requests.  The connection owns the port, a thread that writes queued
+    messages to it and a thread that reads frames from it and dispatches the
+    resulting events.  Requests from the ITU are passed on to the current
+    session.
+
+    `request_...` methods wrap building and submitting message structs
+    corresponding to a single request to the message router.  They will
+    normally return a future that yields the response.
+
+    If `lazy_decoding` is set, fields of received messages are only decoded
+    when first accessed by a handler.
+
+    `message_cache` can be set to a :py:class:`messages.MessageCache`, which
+    may be shared between connections, to avoid decoding repeated frames.
+
+    `port` may be a file-like object or a connected socket.
+
+    `request_timeout` is the default number of seconds to wait for the ITU to
+    respond to a request.  Deadlines are tracked by the send thread.
+
+    Responses, aborts and reversals are sent ahead of any other queued
+    requests.  If `max_queued` is set, at most that many other requests may
+    wait to be sent.  Once that many are waiting, `queue_policy` decides
+    whether new requests wait for room (``'block'``) or fail immediately with
+    :py:class:`SendQueueFullError` (``'fail'``).
+    """
+    def __init__(
+            self, port, *, lazy_decoding=False, message_cache=None,
+            request_timeout=None, max_queued=0, queue_policy=BLOCK):
+        super(BBSMsgRouterConnection, self).__init__(
+            request_timeout=request_timeout,
+        )
+
+        self._port = port
+        self._is_socket = isinstance(port, socket.socket)
+        self._reader = FrameReader(port)
+
+        self._protocol = BBSProtocol(
+            lazy_decoding=lazy_decoding, message_cache=message_cache,
+        )
+        # guards the protocol, which is shared by the send and receive threads
+        self._protocol_lock = Lock()
+
+        self._shutdown = False
+
+        # A queue of Message futures to be sent from the send thread
+        self._send_queue = _SendQueue(max_queued, queue_policy)
+
+        self._send_thread = Thread(target=self._send_loop, daemon=True)
+        self._send_thread.start()
+
+        self._receive_thread = Thread(target=self._receive_loop, daemon=True)
+        self._receive_thread.start()
+
+    def _request(self, message, deadline=None, *, control=False):
+        """ Send a request to the card reader
+
+        :param message:
+            bytestring to send to the ITU
+        :param deadline:
+            optional :py:func:`time.monotonic` time after which the request
+            will fail with :py:class:`RequestTimeoutError`
+        :param control:
+            if set, the request is sent ahead of other queued requests
+
+        :return: a Future that will yield the response
+        """
+        request = _Request(message, deadline)
         try:
-            request = self._response_queue.get_nowait()
-        except queue.Empty:
-            log.error("response has no corresponding request")
-            raise
+            self._send_queue.put(request, control=control)
+        except SendQueueFullError as e:
+            request.set_exception(e)
+        return request
+
+    def _respond(self, message, *, wait=False):
+        """ Respond to the oldest unanswered request from the card reader
+
+        Responses are queued in the order that requests are received, ahead
+        of any other queued messages, and by default the caller does not
+        wait for them to be written.  Errors writing a response shut down the
+        connection from the send thread.
+
+        :param bytes message:
+            bytestring to send to the ITU, or ``None`` to send a plain
+            acknowledgement
+        :param bool wait:
+            If ``True``, :py:meth:`_respond` will block until the response
+            has been sent.
+        :return:
+            A :py:class:`concurrent.futures.Future` that will yield ``None``
+            once the response has been sent.
+        """
+        response = _Response(message)
+        self._send_queue.put(response, control=True)
+        if wait:
+            response.result()
+        return response
+
+    def _send_loop(self):
+        """ Thread responsible for output to the card reader.
+
+        The send thread reads messages from send queue and passes them to the
+        protocol.  Everything already waiting in the queue is sent together,
+        with a single write.  Before each batch, and while waiting for
+        messages, it also expires requests that have passed their deadline.
+        """
+        try:
+            while not self._shutdown:
+                with self._protocol_lock:
+                    deadline = self._protocol.next_deadline()
+                timeout = None
+                if deadline is not None:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        # checked on every pass, as under steady traffic the
+                        # queue may never stay empty long enough for `get`
+                        # to time out
+                        self._expire_requests()
+                        continue
+
+                try:
+                    batch = [self._send_queue.get(timeout=timeout)]
+                except queue.Empty:
+                    self._expire_requests()
+                    continue
+                while True:
+                    try:
+                        batch.append(self._send_queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                pending = []
+                stop = False
+                for index, message in enumerate(batch):
+                    if message is None:
+                        # shutdown will push None onto the send queue to stop
+                        # send loop from blocking on get forever.  Anything
+                        # after it would otherwise never be cancelled
+                        for message in batch[index + 1:]:
+                            if message is not None:
+                                message.cancel()
+                        stop = True
+                        break
+                    if message.set_running_or_notify_cancel():
+                        pending.append(message)
+
+                if pending:
+                    log.debug("sending messages: %r", pending)
+                    try:
+                        with self._protocol_lock:
+                            for message in pending:
+                                if message.expects_response:
+                                    self._protocol.send_request(
+                                        message.data, message,
+                                        deadline=message.deadline,
+                                    )
+                                else:
+                                    self._protocol.send_response(message.data)
+                            data = self._protocol.data_to_send()
+
+                        self._write(data)
+                    except Exception as e:
+                        for message in pending:
+                            message.set_exception(e)
+                        raise
+
+                    for message in pending:
+                        if not message.expects_response:
+                            message.set_result(None)
+
+                if stop:
+                    return
+        except Exception:
+            if not self._shutdown:
+                log.exception("error sending data")
+                self._shutdown_async()
+
+    def _write(self, data):
+        if self._is_socket:
+            self._port.sendall(data)
+        else:
+            self._port.write(data)
+            self._port.flush()
 
-        request.set_result(message)
+    def _handle_response(self, event):
+        event.request.set_result(event.message)
 
     def _receive_loop(self):
         """ Thread responsible for receiving input from the card reader.
@@ -287,14 +652,18 @@ class BBSMsgRouterConnection(object):
         """
         try:
             while not self._shutdown:
-                frame = read_frame(self._port)
-                log.debug("message recieved: %r", frame)
-                message = messages.unpack_itu_message(frame)
-
-                if message.is_response:
-                    self._handle_response(message)
+                frame = self._reader.read_frame()
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug("message recieved: %r", bytes(frame))
+                with self._protocol_lock:
+                    event = self._protocol.receive_frame(frame)
+
+                if event is None:
+                    continue
+                if isinstance(event, RequestReceived):
+                    self._handle_request(event)
                 else:
-                    self._handle_request(message)
+                    self._handle_response(event)
         except Exception:
             if not self._shutdown:
                 log.exception("error receiving data")
@@ -309,41 +678,49 @@ class BBSMsgRouterConnection(object):
             if not self._shutdown:
                 log.debug("shutting down")
                 self._shutdown = True
-                if self._current_session is not None:
-                    try:
-                        self._current_session.cancel()
-                    except SessionCompletedError:
-                        # Can't cancel as session has completed successfully
-                        # This is fine.
-                        pass
-                    except Exception:
-                        log.exception("could not cancel session")
-                        # not ideal but we still want to shut down
-                        pass
+                self._cancel_current_session()
 
                 # send loop will block trying to fetch items from it's queue
                 # forever unless we push something onto it
-                self._send_queue.put(None)
-                # response queue could hang if the send and receive sides have
-                # got out of sync.  Shouldn't happen but best to make sure
-                self._response_queue.put(None)
+                self._send_queue.put(None, control=True)
 
+                if self._is_socket:
+                    # closing a socket does not wake up a thread that is
+                    # blocked reading from it
+                    try:
+                        self._port.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
                 self._port.close()
 
                 self._send_thread.join()
                 self._receive_thread.join()
 
-                while not self._send_queue.empty():
-                    message = self._send_queue.get()
+                self._send_queue.close()
+                while True:
+                    try:
+                        message = self._send_queue.get_nowait()
+                    except queue.Empty:
+                        break
                     if message is not None:
                         message.cancel()
 
-                while not self._response_queue.empty():
-                    message = self._response_queue.get()
-                    if message is not None:
+                with self._protocol_lock:
+                    interrupted = self._protocol.close()
+                for message in interrupted:
+                    if not message.done():
                         message.set_exception(ResponseInterruptedError())
                 log.debug("successfully shut down")
 
+    def send_queue_stats(self):
+        """ Returns a dictionary describing the send queue: the number of
+        messages waiting in each lane (``control_depth`` and
+        ``normal_depth``), the greatest number ever waiting (``max_depth``),
+        the number of messages sent (``sent``), and the mean and maximum
+        number of seconds that they waited (``mean_wait`` and ``max_wait``).
+        """
+        return self._send_queue.stats()
+
     def _shutdown_async(self):
         """ Shutdown without blocking.
         """
@@ -1,8 +1,49 @@
+import re
+from calendar import timegm
+from datetime import datetime, timezone
 from decimal import Decimal
+from functools import lru_cache
+from operator import index
 
 
 _UNDEFINED = object()
 
+# marks bytes that do not correspond to a value in enum lookup tables
+_INVALID = object()
+
+# struct codes for reading short fields as big endian unsigned integers
+_INTEGER_CODES = {1: 'B', 2: 'H', 4: 'I'}
+
+
+def _read_int(buffer, start, end):
+    """ Reads ``buffer[start:end]`` as a big endian unsigned integer without
+    slicing it.
+    """
+    value = 0
+    for i in range(start, end):
+        value = value << 8 | buffer[i]
+    return value
+
+
+def decimal_to_minor(amount, places=2):
+    """ Converts an amount in major currency units to an integer number of
+    minor units.
+
+    :raises ValueError:
+        If the amount can not be represented exactly in minor units
+    """
+    minor = Decimal(amount).scaleb(places)
+    if minor != minor.to_integral_value():
+        raise ValueError("amount has more than %i decimal places" % places)
+    return int(minor)
+
+
+def minor_to_decimal(minor, places=2):
+    """ Converts an integer number of minor currency units to a ``Decimal``
+    amount in major units.
+    """
+    return Decimal(minor).scaleb(-places)
+
 
 class BBSField(object):
     def __init__(self, size=None, default=_UNDEFINED):
@@ -24,6 +65,23 @@ class BBSField(object):
         """
         raise NotImplementedError()
 
+    def pack_into(self, buffer, offset, value):
+        """ Packs a value into a writable buffer in place, overwriting the
+        ``size`` bytes starting at ``offset``.  Only supported by fixed size
+        fields.
+
+        :raises ValueError:
+            If ``value`` is invalid
+        """
+        if self.size is None:
+            raise NotImplementedError()
+
+        data = self.pack(value)
+        if len(data) != self.size:
+            raise ValueError("packed value does not match field size")
+
+        buffer[offset:offset + self.size] = data
+
     def unpack(self, data):
         """ Reads the value of a field from a bytes object
 
@@ -33,11 +91,84 @@ class BBSField(object):
         :returns:
             A tuple of the parsed value and the number of bytes consumed
 
+        :raises ValueError:
+            If data does not match expected format
+        """
+        return self.unpack_from(data, 0)
+
+    def unpack_from(self, buffer, offset=0):
+        """ Reads the value of a field from a buffer, starting at ``offset``.
+
+        The buffer is never sliced beyond the bytes belonging to the field, so
+        unpacking a message field by field does not repeatedly copy the tail
+        of the frame.
+
+        :param buffer:
+            A ``bytes``, ``bytearray`` or ``memoryview`` object from which to
+            unpack the field.  Everything up to the end of the buffer is
+            considered to be available to the field
+
+        :param offset:
+            Index of the first byte of the field in ``buffer``
+
+        :returns:
+            A tuple of the parsed value and the offset of the first byte
+            following the field
+
+        :raises ValueError:
+            If data does not match expected format
+        """
+        if self.size is None:
+            raise NotImplementedError()
+
+        end = offset + self.size
+        if end > len(buffer):
+            raise ValueError("not enough data")
+
+        return self.decode(bytes(buffer[offset:end])), end
+
+    def decode(self, data):
+        """ Converts the binary representation of a fixed size field back into
+        its value.  The inverse of ``pack``.
+
+        :param data:
+            A bytes object of exactly ``size`` bytes
+
+        :returns:
+            The parsed value
+
         :raises ValueError:
             If data does not match expected format
         """
         raise NotImplementedError()
 
+    @property
+    def struct_code(self):
+        """ The ``struct`` format code used to read a fixed size field as
+        part of the prefix of a message.  Values read with it are converted
+        by ``decode_struct`` and written by ``pack_struct``.
+        """
+        return '%is' % self.size
+
+    def decode_struct(self, raw):
+        return self.decode(raw)
+
+    def pack_struct(self, value):
+        return self.pack(value)
+
+    def skip(self, buffer, offset=0):
+        """ Finds the end of a field without decoding its value
+
+        :returns:
+            The offset of the first byte following the field
+
+        :raises ValueError:
+            If the end of the field could not be found
+        """
+        if self.size is not None:
+            return offset + self.size
+        return self.unpack_from(buffer, offset)[1]
+
 
 class DelimitedField(BBSField):
     def __init__(self, inner, *, delimiter=b'\n', optional=False, **kwargs):
@@ -55,6 +186,9 @@ class DelimitedField(BBSField):
         self._delimiter = delimiter
         self._optional = optional
 
+        # unlike `bytes.find`, regular expressions can search a memoryview
+        self._search = re.compile(re.escape(delimiter)).search
+
     def pack(self, value):
         if value is None and self._optional:
             inner = b''
@@ -62,17 +196,36 @@ class DelimitedField(BBSField):
             inner = self._inner.pack(value)
         return inner + self._delimiter
 
-    def unpack(self, data):
-        end = data.find(self._delimiter)
-        if end == -1:
+    def unpack_from(self, buffer, offset=0):
+        match = self._search(buffer, offset)
+        if match is None:
             raise ValueError("could not find delimiter")
+        end = match.start()
+
+        if self._optional and end == offset:
+            return None, match.end()
 
-        value, size = self._inner.unpack(data[:end])
+        # bound the inner field by the delimiter without copying
+        value, inner_end = self._inner.unpack_from(
+            memoryview(buffer)[:end], offset
+        )
 
-        if size != end:
+        if inner_end != end:
             raise ValueError("inner field did not consume delimited data")
 
-        return value, size + len(self._delimiter)
+        return value, match.end()
+
+    def decode(self, data):
+        end = len(data) - len(self._delimiter)
+        if data.find(self._delimiter) != end:
+            raise ValueError("could not find delimiter")
+        return self._inner.decode(data[:end])
+
+    def skip(self, buffer, offset=0):
+        match = self._search(buffer, offset)
+        if match is None:
+            raise ValueError("could not find delimiter")
+        return match.end()
 
 
 class TextField(BBSField):
@@ -88,64 +241,115 @@ class TextField(BBSField):
 
         return data
 
-    def unpack(self, data):
+    def unpack_from(self, buffer, offset=0):
         if self.size is not None:
-            data = data[:self.size]
-            if len(data) != self.size:
+            end = offset + self.size
+            if end > len(buffer):
                 raise ValueError("read data does not match expected size")
+        else:
+            end = len(buffer)
+
+        return str(memoryview(buffer)[offset:end], 'ascii'), end
+
+    def decode(self, data):
+        return data.decode('ascii')
 
-        return data.decode('ascii'), len(data)
+    def skip(self, buffer, offset=0):
+        if self.size is None:
+            return len(buffer)
+        return offset + self.size
+
+
+# Print control characters and the commands they represent.  Text is written
+# by the `write` command, which takes the string to print as its argument.
+_CUT_PARTIAL = 0x0e
+_CUT_THROUGH = 0x0c
+
+_PRINT_OPCODES = {
+    'cut-partial': bytes([_CUT_PARTIAL]),
+    'cut-through': bytes([_CUT_THROUGH]),
+}
+
+# matches either a run of text or a single control character
+_PRINT_TOKENS = re.compile(b'[^\x0c\x0e]+|[\x0c\x0e]').finditer
+_PRINT_CONTROL = re.compile(b'[\x0c\x0e]').search
+_NON_ASCII = re.compile(b'[\x80-\xff]').search
 
 
 class FormattedTextField(BBSField):
+    """ Text for the receipt printer, represented as a list of commands.
+    Each command is either ``('write', text)``, ``'cut-partial'`` or
+    ``'cut-through'``.
+
+    Receipts and reports can be long, so both directions are also available
+    as generators: :py:meth:`iter_pack` yields encoded chunks and
+    :py:meth:`iter_unpack` yields commands as they are read from the buffer.
+    """
     # TODO inherit from TextField
     def pack(self, commands):
-        text = bytearray()
-
-        def op_write(text):
-            return text.encode('ascii')
+        return b''.join(self.iter_pack(commands))
 
+    def iter_pack(self, commands):
         for command in commands:
             if isinstance(command, str):
-                command_name, args = command, []
+                command_name, args = command, ()
             else:
                 command_name = command[0]
                 args = command[1:]
 
-            command = {
-                'write': op_write,
-                'cut-partial': b'\x0e',
-                'cut-through': b'\f',
-            }[command_name]
-
-            if isinstance(command, bytes):
-                text += command
+            if command_name == 'write':
+                text, = args
+                data = text.encode('ascii')
+                if _PRINT_CONTROL(data):
+                    raise ValueError("text contains print control characters")
+                yield data
             else:
-                text += command(*args)
+                yield _PRINT_OPCODES[command_name]
 
-        return bytes(text)
-
-    def unpack(self, data):
-        text = data.decode('ascii')
+    def unpack_from(self, buffer, offset=0):
+        return list(self.iter_unpack(buffer, offset)), len(buffer)
 
-        commands = []
+    def iter_unpack(self, buffer, offset=0):
+        """ Yields print commands read from ``buffer`` starting at
+        ``offset``.  Text is decoded one run at a time from a view on the
+        buffer, without first copying the whole block.
 
-        for message in text.split('\f'):
-            # ignore trailing message and doubled up form feeds
-            if not len(message):
-                continue
-
-            partitions = (p for p in message.split('\x0e') if len(p))
-
-            # cut between partitions but not at beginning and end
-            commands.append(('write', next(partitions)))
-            for partition in partitions:
-                commands.append('cut-partial')
-                commands.append(('write', partition))
-
-            commands.append('cut-through')
+        Doubled up and leading control characters are ignored: partial cuts
+        are only emitted between two runs of text, and full cuts only after
+        text has been written.
+        """
+        view = memoryview(buffer)
+        written = False
+        cut = False
+
+        for match in _PRINT_TOKENS(buffer, offset):
+            start, end = match.span()
+            code = buffer[start]
+            if code == _CUT_THROUGH:
+                if written:
+                    yield 'cut-through'
+                written = cut = False
+            elif code == _CUT_PARTIAL:
+                cut = written
+            else:
+                if cut:
+                    yield 'cut-partial'
+                    cut = False
+                yield ('write', str(view[start:end], 'ascii'))
+                written = True
+
+    def check(self, buffer, offset=0):
+        """ Raises :py:exc:`ValueError` if the text starting at ``offset``
+        could not be decoded by :py:meth:`iter_unpack`, without decoding it.
+        """
+        match = _NON_ASCII(buffer, offset)
+        if match is not None:
+            raise ValueError(
+                "invalid text byte at offset %d" % match.start()
+            )
 
-            return commands, len(data)
+    def skip(self, buffer, offset=0):
+        return len(buffer)
 
 
 class IntegerField(BBSField):
@@ -159,42 +363,54 @@ class IntegerField(BBSField):
 
         return string.encode('ascii')
 
-    def unpack(self, data):
-        subdata = data[:self.size]
-        if len(subdata) != self.size:
-            raise ValueError("not enough data")
-
-        string = subdata.decode('ascii')
-
-        return int(string), self.size
+    def decode(self, data):
+        return int(data)
 
 
 class PriceField(BBSField):
-    def __init__(self, size=11, **kwargs):
+    """ An amount of money, transmitted as a count of minor currency units
+    right adjusted with spaces.  A field filled entirely with spaces
+    represents a missing amount, and is packed from and unpacked to ``None``.
+
+    Values are integer numbers of minor units if ``minor_units`` is set.
+    Otherwise they are ``Decimal`` amounts in major units, converted exactly
+    using ``places`` decimal places.
+    """
+    def __init__(self, size=11, *, minor_units=False, places=2, **kwargs):
         super(PriceField, self).__init__(size=size, **kwargs)
+        self._minor_units = minor_units
+        self._places = places
 
-    def pack(self, decimal):
-        string = str(decimal)
+    def pack(self, value):
+        if value is None:
+            return b' ' * self.size
 
-        if self.size is not None:
-            string = " " * (self.size - len(string)) + string
+        if self._minor_units:
+            # refuse to silently truncate decimals or floats
+            minor = index(value)
+        else:
+            minor = decimal_to_minor(value, self._places)
 
-            if len(string) != self.size:
-                raise ValueError("probably too much money")
+        if minor < 0:
+            raise ValueError("amount must not be negative")
 
-        return string.encode('ascii')
+        data = b'%*d' % (self.size, minor)
+        if len(data) != self.size:
+            raise ValueError("probably too much money")
 
-    def unpack(self, data):
-        subdata = data[:self.size]
-        if len(subdata) != self.size:
-            raise ValueError("not enough data")
+        return data
 
-        string = subdata.decode('ascii')
+    def decode(self, data):
+        digits = data.lstrip(b' ')
+        if not digits:
+            return None
 
-        if not string.isnumeric():
+        if not digits.isdigit():
             raise ValueError("price data is not a positive integer")
 
-        return Decimal(string) / 10000, self.size
+        if self._minor_units:
+            return int(digits)
+        return minor_to_decimal(int(digits), self._places)
 
 
 class EnumField(BBSField):
@@ -215,15 +431,67 @@ class EnumField(BBSField):
         self._from_enum = values
         self._to_enum = {value: key for key, value in values.items()}
 
+        # Decoding never needs to allocate a bytes object to use as a key.
+        # Short enums are indexed by the integer value of their bytes, and
+        # single byte enums by a table with an entry for every possible byte.
+        self._from_int = {
+            int.from_bytes(key, 'big'): value for key, value in values.items()
+        }
+        self._table = None
+        if size == 1:
+            self._table = tuple(
+                self._from_int.get(byte, _INVALID) for byte in range(256)
+            )
+
+        if size in _INTEGER_CODES:
+            self._from_struct = self._from_int
+            self._to_struct = {
+                value: int.from_bytes(key, 'big')
+                for value, key in self._to_enum.items()
+            }
+        else:
+            self._from_struct = self._from_enum
+            self._to_struct = self._to_enum
+
     def pack(self, value):
         return self._to_enum[value]
 
-    def unpack(self, data):
-        subdata = data[:self.size]
-        if len(subdata) != self.size:
+    def unpack_from(self, buffer, offset=0):
+        end = offset + self.size
+        if end > len(buffer):
             raise ValueError("not enough data")
 
-        return self._from_enum[subdata], self.size
+        if self._table is not None:
+            value = self._table[buffer[offset]]
+        else:
+            value = self._from_int.get(
+                _read_int(buffer, offset, end), _INVALID
+            )
+
+        if value is _INVALID:
+            raise ValueError(
+                "invalid enum value: %r" % bytes(buffer[offset:end])
+            )
+
+        return value, end
+
+    def decode(self, data):
+        return self.unpack_from(data, 0)[0]
+
+    @property
+    def struct_code(self):
+        return _INTEGER_CODES.get(self.size, '%is' % self.size)
+
+    def decode_struct(self, raw):
+        value = self._from_struct.get(raw, _INVALID)
+        if value is _INVALID:
+            if isinstance(raw, int):
+                raw = raw.to_bytes(self.size, 'big')
+            raise ValueError("invalid enum value: %r" % raw)
+        return value
+
+    def pack_struct(self, value):
+        return self._to_struct[value]
 
 
 class ConstantField(BBSField):
@@ -235,22 +503,124 @@ class ConstantField(BBSField):
         self.value = value
         self.default = value
 
+        self._int = int.from_bytes(value, 'big')
+        if self.size in _INTEGER_CODES:
+            self._struct_value = self._int
+        else:
+            self._struct_value = value
+
     def pack(self, value):
         if value != self.value:
             raise ValueError("passed value does not match expected")
         return self.value
 
-    def unpack(self, data):
-        subdata = data[:self.size]
-        if len(subdata) != self.size:
+    def unpack_from(self, buffer, offset=0):
+        end = offset + self.size
+        if end > len(buffer):
             raise ValueError("not enough data")
 
-        if subdata != self.value:
+        if _read_int(buffer, offset, end) != self._int:
+            raise ValueError("expected %r, got %r" % (
+                self.value, bytes(buffer[offset:end])
+            ))
+
+        return None, end
+
+    def decode(self, data):
+        if data != self.value:
             raise ValueError("expected %r, got %r" % (self.value, data))
 
-        return None, self.size
+        return None
+
+    @property
+    def struct_code(self):
+        return _INTEGER_CODES.get(self.size, '%is' % self.size)
+
+    def decode_struct(self, raw):
+        if raw != self._struct_value:
+            if isinstance(raw, int):
+                raw = raw.to_bytes(self.size, 'big')
+            raise ValueError("expected %r, got %r" % (self.value, raw))
+
+        return None
+
+    def pack_struct(self, value):
+        self.pack(value)
+        return self._struct_value
 
 
 class DateTimeField(BBSField):
-    # TODO
-    pass
+    """ A timestamp transmitted as ASCII digits, either in the 14 byte
+    ``YYYYMMDDHHMMSS`` format sent by the ITU, or in the 10 byte
+    ``YYMMDDHHMM`` format sent by the ECR.  A field filled with zeros is not
+    used, and is packed from and unpacked to ``None``.
+
+    Values are naive ``datetime`` objects in the local time of the terminal,
+    or integer seconds since the epoch if ``epoch`` is set.  Timestamps
+    without a timezone are treated as UTC when converting to and from the
+    epoch.
+
+    Consecutive frames in a session usually share the same timestamp, so the
+    most recently decoded values are cached.
+    """
+    def __init__(self, size=14, *, epoch=False, cache_size=16, **kwargs):
+        if size not in (14, 10):
+            raise ValueError("unsupported timestamp size: %r" % size)
+
+        super(DateTimeField, self).__init__(size=size, **kwargs)
+
+        self._epoch = epoch
+        self._zeros = b'0' * size
+        self.decode = lru_cache(maxsize=cache_size)(self._decode)
+
+    def pack(self, value):
+        if value is None:
+            return self._zeros
+
+        if self._epoch:
+            value = datetime.fromtimestamp(index(value), timezone.utc)
+
+        if self.size == 14:
+            data = b'%04d%02d%02d%02d%02d%02d' % (
+                value.year, value.month, value.day,
+                value.hour, value.minute, value.second,
+            )
+        else:
+            data = b'%02d%02d%02d%02d%02d' % (
+                value.year % 100, value.month, value.day,
+                value.hour, value.minute,
+            )
+
+        if len(data) != self.size:
+            raise ValueError("timestamp out of range")
+
+        return data
+
+    def _decode(self, data):
+        if data == self._zeros:
+            return None
+
+        # `int` also accepts signs, whitespace and underscores
+        if not data.isdigit():
+            raise ValueError("timestamp data is not numeric: %r" % data)
+
+        # split the digits arithmetically rather than slicing the data
+        value = int(data)
+        if self.size == 14:
+            value, second = divmod(value, 100)
+        else:
+            second = 0
+        value, minute = divmod(value, 100)
+        value, hour = divmod(value, 100)
+        value, day = divmod(value, 100)
+        year, month = divmod(value, 100)
+        if self.size == 10:
+            # the ECR format only has two digit years
+            year += 2000
+
+        # datetime validates the ranges of each component
+        timestamp = datetime(year, month, day, hour, minute, second)
+
+        if self._epoch:
+            return timegm((year, month, day, hour, minute, second))
+        return timestamp
@@ -0,0 +1,421 @@
+import heapq
+import itertools
+import selectors
+import socket
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Thread, Lock, Event, current_thread
+
+from payment_terminal.callbacks import CallbackExecutor
+
+from .connection import _BBSConnectionBase, ResponseInterruptedError
+from .protocol import BBSProtocol, RequestReceived, OutOfSyncError
+
+import logging
+log = logging.getLogger('payment_terminal')
+
+
+class _HubConnection(_BBSConnectionBase):
+    """ A connection to a bbs msg router that is driven by a
+    :py:class:`BBSConnectionHub`.
+
+    Has the same interface as :py:class:`BBSMsgRouterConnection`, but owns no
+    threads.  All reads and writes happen on the hub's I/O thread, and
+    requests from the ITU are passed to the current session from the hub's
+    worker pool, one at a time and in the order that they were received.
+    """
+    def __init__(
+            self, hub, sock, *, lazy_decoding=False, message_cache=None,
+            request_timeout=None):
+        super(_HubConnection, self).__init__(request_timeout=request_timeout)
+
+        self._hub = hub
+        self._sock = sock
+        self._sock.setblocking(False)
+
+        self._protocol = BBSProtocol(
+            lazy_decoding=lazy_decoding, message_cache=message_cache,
+        )
+        # guards the protocol and everything below it, which are shared by
+        # the I/O thread, the worker pool and the session
+        self._protocol_lock = Lock()
+        # bytes waiting for the I/O thread to write them to the socket
+        self._outgoing = bytearray()
+        # requests from the ITU waiting to be handled, and whether a worker
+        # is currently working through them
+        self._requests = deque()
+        self._handling = False
+
+        self._shutdown = False
+        self._closed = Event()
+
+        # only accessed from the I/O thread
+        self._receive_buffer = bytearray(0x10000)
+        self._receive_view = memoryview(self._receive_buffer)
+
+    def _request(self, message, deadline=None, *, control=False):
+        # everything is written as soon as the socket is ready, so there is
+        # no queue for control messages to skip
+        request = Future()
+        request.set_running_or_notify_cancel()
+
+        with self._protocol_lock:
+            if self._protocol.closed:
+                request.set_exception(ResponseInterruptedError())
+                return request
+            try:
+                self._protocol.send_request(
+                    message, request, deadline=deadline
+                )
+            except OutOfSyncError as e:
+                request.set_exception(e)
+                return request
+            self._outgoing += self._protocol.data_to_send()
+
+        if deadline is not None:
+            self._hub._schedule(deadline, self)
+        self._hub._wake(self)
+        return request
+
+    def _respond(self, message):
+        with self._protocol_lock:
+            if self._protocol.closed:
+                return
+            self._protocol.send_response(message)
+            self._outgoing += self._protocol.data_to_send()
+
+        self._hub._wake(self)
+
+    def _handle_requests(self):
+        """ Runs on the worker pool.
+        """
+        while True:
+            with self._protocol_lock:
+                if not self._requests or self._protocol.closed:
+                    self._handling = False
+                    return
+                event = self._requests.popleft()
+
+            try:
+                self._handle_request(event)
+            except Exception:
+                with self._protocol_lock:
+                    self._handling = False
+                self._shutdown_async()
+                return
+
+    def _on_readable(self):
+        """ Runs on the I/O thread.
+        """
+        try:
+            count = self._sock.recv_into(self._receive_buffer)
+        except (BlockingIOError, InterruptedError):
+            return
+
+        with self._protocol_lock:
+            events = self._protocol.receive_data(
+                self._receive_view[:count]
+            )
+            if count == 0:
+                raise EOFError()
+
+            schedule = False
+            for event in events:
+                if isinstance(event, RequestReceived):
+                    self._requests.append(event)
+                    if not self._handling:
+                        self._handling = schedule = True
+
+        for event in events:
+            if not isinstance(event, RequestReceived):
+                event.request.set_result(event.message)
+
+        if schedule:
+            self._hub._executor.submit(self._handle_requests)
+
+    def _on_writable(self):
+        """ Runs on the I/O thread.  Returns ``True`` if there is still data
+        waiting to be written.
+        """
+        with self._protocol_lock:
+            if not self._outgoing:
+                return False
+            try:
+                sent = self._sock.send(self._outgoing)
+            except (BlockingIOError, InterruptedError):
+                return True
+            del self._outgoing[:sent]
+            return bool(self._outgoing)
+
+    def _on_closed(self):
+        """ Runs on the I/O thread once the socket has been closed.
+        """
+        with self._protocol_lock:
+            interrupted = self._protocol.close()
+            self._requests.clear()
+
+        for request in interrupted:
+            if not request.done():
+                request.set_exception(ResponseInterruptedError())
+
+        self._closed.set()
+
+    def shutdown(self):
+        """ Closes connection to the ITU and cancels all requests.
+        Threadsafe and can be called multiple times safely.
+        Will block until everything has been cleaned up, unless called from
+        the hub's I/O thread.
+        """
+        with self._lock:
+            if not self._shutdown:
+                log.debug("shutting down")
+                self._shutdown = True
+                self._cancel_current_session()
+                self._hub._wake(self)
+
+        if current_thread() is not self._hub._thread:
+            self._closed.wait()
+
+    def _shutdown_async(self):
+        """ Shutdown without blocking.
+        """
+        self._hub._executor.submit(self.shutdown)
+
+
+class BBSConnectionHub(object):
+    """ Runs any number of connections to bbs msg routers from a single I/O
+    thread.
+
+    Sockets are registered with a selector and all framing, reads and writes
+    happen on the hub's thread.  Requests from the ITU, and therefore all
+    session callbacks, are run on a shared pool of worker threads, with the
+    requests for each connection handled one at a time, in order.
+
+    Request deadlines for every connection are kept in a single heap, which
+    bounds how long the I/O thread waits in the selector.
+
+    Terminals opened through a hub behave exactly like terminals opened by
+    :py:func:`open_tcp`.  To use a hub for every terminal opened by
+    :py:func:`payment_terminal.open_terminal`, register its ``open_tcp``
+    method as the driver for ``bbs+tcp``.
+
+    :param int max_workers:
+        The size of the worker pool.  Ignored if ``executor`` is passed.
+    :param executor:
+        An optional :py:class:`concurrent.futures.Executor` to run session
+        callbacks on.
+    :param callback_executor:
+        The :py:class:`~payment_terminal.callbacks.CallbackExecutor`, or an
+        executor to create one with, that runs payment callbacks for every
+        terminal opened by :py:meth:`open_tcp`.  By default the hub creates
+        one with a thread pool of its own.
+    """
+    def __init__(
+            self, *, max_workers=4, executor=None, callback_executor=None):
+        super(BBSConnectionHub, self).__init__()
+
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers)
+        self._executor = executor
+
+        # shared by all terminals, rather than each starting its own pool
+        self._owns_callback_executor = not isinstance(
+            callback_executor, CallbackExecutor
+        )
+        if self._owns_callback_executor:
+            callback_executor = CallbackExecutor(callback_executor)
+        self._callback_executor = callback_executor
+
+        self._selector = selectors.DefaultSelector()
+
+        # connections that have been added, have new data to write or are
+        # shutting down, to be picked up by the I/O thread
+        self._lock = Lock()
+        self._connections = set()
+        self._dirty = set()
+        self._closing = False
+        # heap of `(deadline, tie breaker, connection)` for requests from all
+        # connections.  Entries are left in place once requests are answered
+        self._deadlines = []
+        self._tie_breaker = itertools.count()
+
+        # writing to the wakeup socket interrupts the selector
+        self._wakeup_receive, self._wakeup_send = socket.socketpair()
+        self._wakeup_receive.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        self._selector.register(
+            self._wakeup_receive, selectors.EVENT_READ, None
+        )
+
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def connect(self, sock, **kwargs):
+        """ Takes ownership of a connected socket and returns a connection
+        object for it.  Keyword arguments are the same as for
+        :py:class:`BBSMsgRouterConnection`.
+        """
+        connection = _HubConnection(self, sock, **kwargs)
+        with self._lock:
+            self._connections.add(connection)
+        self._wake(connection)
+        return connection
+
+    def open_tcp(self, uri, **kwargs):
+        """ Equivalent to :py:func:`open_tcp`, but for a terminal that is run
+        by the hub.
+        """
+        from . import BBSMsgRouterTerminal, _connect_tcp
+
+        # reads are never blocking, so ``read_timeout`` has no effect
+        sock, options = _connect_tcp(uri)
+        kwargs.setdefault('request_timeout', options['request_timeout'])
+        return BBSMsgRouterTerminal(
+            connection=self.connect(sock, **kwargs),
+            callback_executor=self._callback_executor,
+        )
+
+    def _wake(self, connection):
+        with self._lock:
+            wake = not self._dirty
+            self._dirty.add(connection)
+
+        if wake:
+            self._interrupt()
+
+    def _schedule(self, deadline, connection):
+        with self._lock:
+            earliest = not self._deadlines or deadline < self._deadlines[0][0]
+            heapq.heappush(
+                self._deadlines,
+                (deadline, next(self._tie_breaker), connection)
+            )
+
+        if earliest:
+            self._interrupt()
+
+    def _expired(self):
+        """ Pops connections with requests that have passed their deadline,
+        and returns them along with the number of seconds until the next
+        deadline.
+        """
+        now = time.monotonic()
+        expired = set()
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, _, connection = heapq.heappop(self._deadlines)
+                expired.add(connection)
+
+            timeout = None
+            if self._deadlines:
+                timeout = self._deadlines[0][0] - now
+        return expired, timeout
+
+    def _interrupt(self):
+        try:
+            self._wakeup_send.send(b'\0')
+        except (BlockingIOError, InterruptedError):
+            # the selector will already wake up
+            pass
+
+    def _close(self, connection):
+        """ Closes the socket of a connection and fails any requests waiting
+        for a response.  Runs on the I/O thread.
+        """
+        try:
+            self._selector.unregister(connection._sock)
+        except KeyError:
+            pass
+        connection._sock.close()
+        connection._on_closed()
+
+        with self._lock:
+            self._connections.discard(connection)
+
+    def _update(self, connection):
+        """ Brings the registration of a connection up to date with its
+        state.  Runs on the I/O thread.
+        """
+        if connection._shutdown:
+            self._close(connection)
+            return
+
+        try:
+            key = self._selector.get_key(connection._sock)
+        except KeyError:
+            key = None
+
+        events = selectors.EVENT_READ
+        if connection._on_writable():
+            events |= selectors.EVENT_WRITE
+
+        if key is None:
+            self._selector.register(connection._sock, events, connection)
+        elif key.events != events:
+            self._selector.modify(connection._sock, events, connection)
+
+    def _run(self):
+        timeout = None
+        while True:
+            for key, mask in self._selector.select(timeout):
+                connection = key.data
+                if connection is None:
+                    try:
+                        self._wakeup_receive.recv(4096)
+                    except (BlockingIOError, InterruptedError):
+                        pass
+                    continue
+
+                try:
+                    if mask & selectors.EVENT_READ:
+                        connection._on_readable()
+                    if mask & selectors.EVENT_WRITE:
+                        self._update(connection)
+                except Exception as e:
+                    if not isinstance(e, EOFError):
+                        log.exception("error in connection")
+                    self._close(connection)
+                    # the session still needs to be told
+                    connection._shutdown_async()
+
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+                closing = self._closing
+
+            for connection in dirty:
+                if connection._closed.is_set():
+                    continue
+                try:
+                    self._update(connection)
+                except Exception:
+                    log.exception("error in connection")
+                    self._close(connection)
+                    connection._shutdown_async()
+
+            if closing:
+                return
+
+            expired, timeout = self._expired()
+            for connection in expired:
+                connection._expire_requests()
+
+    def shutdown(self):
+        """ Shuts down every connection and stops the hub.
+        """
+        with self._lock:
+            connections = list(self._connections)
+        for connection in connections:
+            connection.shutdown()
+
+        with self._lock:
+            self._closing = True
+        self._interrupt()
+        self._thread.join()
+
+        self._selector.close()
+        self._wakeup_receive.close()
+        self._wakeup_send.close()
+
+        if self._owns_callback_executor:
+            self._callback_executor.shutdown()
@@ -1,7 +1,9 @@
+import struct
 from collections import OrderedDict
+from threading import Lock
 
 from .fields import (
-    BBSField, DelimitedField,
+    _UNDEFINED, _INVALID, BBSField, DelimitedField,
     ConstantField, EnumField,
     IntegerField, PriceField,
     TextField, FormattedTextField,
@@ -12,6 +14,210 @@ import logging
 log = logging.getLogger('payment_terminal')
 
 
+class UnknownMessageError(ValueError):
+    """ Raised when a frame does not match any known message type or sub
+    function.
+    """
+    pass
+
+
+def _layout(fields):
+    """ Computes the offsets of all fields that can be located without reading
+    the message.
+
+    :returns:
+        A tuple containing the offset of each field, or ``None`` for fields
+        following a variable size field, the size of the fixed size prefix of
+        the message and the number of fields in that prefix.
+    """
+    offsets = []
+    offset = 0
+    prefix_count = None
+    for i, field in enumerate(fields.values()):
+        offsets.append(offset)
+        if prefix_count is None:
+            if field.size is None:
+                prefix_size, prefix_count = offset, i
+                offset = None
+            else:
+                offset += field.size
+
+    if prefix_count is None:
+        prefix_size, prefix_count = offset, len(offsets)
+
+    return tuple(offsets), prefix_size, prefix_count
+
+
+def _prefix_struct(fields, prefix_count):
+    """ Returns a ``struct.Struct`` that splits the fixed size prefix of a
+    message into the raw value of each field in a single call, or ``None`` if
+    the message does not start with a fixed size field.  Short enums and
+    constants are read as big endian integers, everything else as bytes.
+    """
+    if not prefix_count:
+        return None
+
+    prefix = list(fields.values())[:prefix_count]
+    return struct.Struct('>' + ''.join(field.struct_code for field in prefix))
+
+
+def _compile(cls, name, source, namespace):
+    """ Compiles the source of a single function and returns the function
+    object.  ``namespace`` provides the globals that the generated code can
+    refer to.
+    """
+    code = compile(source, '<%s.%s>' % (cls.__name__, name), 'exec')
+    exec(code, namespace)
+    return namespace[name]
+
+
+def _compile_initialiser(cls):
+    """ Generates a function that sets every field of a new instance of
+    ``cls`` from keyword arguments.  Missing arguments are taken from the
+    precomputed ``_defaults`` tuple when the function is defined rather than
+    looked up on the field for each new message.
+    """
+    namespace = {'_defaults': cls._defaults}
+    args = []
+    assignments = []
+
+    for i, name in enumerate(cls._fields):
+        if cls._defaults[i] is _UNDEFINED:
+            args.append(name)
+        else:
+            args.append("%s=_defaults[%i]" % (name, i))
+        assignments.append("    self.%s = %s" % (name, name))
+
+    if args:
+        lines = ["def init_fields(self, *, %s):" % ", ".join(args)]
+        lines += assignments
+    else:
+        lines = ["def init_fields(self):", "    pass"]
+
+    return _compile(cls, 'init_fields', '\n'.join(lines), namespace)
+
+
+def _compile_packer(cls):
+    """ Generates a function that packs an instance of ``cls`` with a single
+    straight line expression.  Enum tables and constant values are bound into
+    the function's namespace so no per-field dispatch happens at runtime.
+    """
+    namespace = {}
+    checks = []
+    parts = []
+
+    # if every field has a fixed size the message can be assembled by the
+    # prefix struct in a single call, in which case fields are packed to the
+    # raw values expected by their struct codes
+    use_struct = cls._fields and cls._prefix_count == len(cls._fields)
+
+    for i, (name, field) in enumerate(cls._fields.items()):
+        if isinstance(field, ConstantField):
+            namespace['_value_%i' % i] = field.value
+            namespace['_const_%i' % i] = (
+                field._struct_value if use_struct else field.value
+            )
+            checks += [
+                "    if self.%s != _value_%i:" % (name, i),
+                "        raise ValueError("
+                "'passed value does not match expected')",
+            ]
+            parts.append("_const_%i" % i)
+        elif isinstance(field, EnumField):
+            namespace['_to_enum_%i' % i] = (
+                field._to_struct if use_struct else field._to_enum
+            )
+            parts.append("_to_enum_%i[self.%s]" % (i, name))
+        else:
+            namespace['_pack_%i' % i] = (
+                field.pack_struct if use_struct else field.pack
+            )
+            parts.append("_pack_%i(self.%s)" % (i, name))
+
+    lines = ["def pack(self):"] + checks
+    if use_struct:
+        # fixed size fields always pack to exactly `size` bytes so struct will
+        # never need to pad or truncate
+        namespace['_struct_pack'] = cls._struct.pack
+        lines.append("    return _struct_pack(%s)" % ", ".join(parts))
+    else:
+        lines.append("    return b''.join((%s))" % ''.join(
+            part + ", " for part in parts
+        ))
+
+    return _compile(cls, 'pack', '\n'.join(lines), namespace)
+
+
+def _compile_unpacker(cls):
+    """ Generates a function that reads all fields of ``cls`` from a bytes
+    like object and returns them as a new instance.  The instance is
+    populated directly, bypassing ``__init__``.
+
+    The fixed size prefix of the message is split into the raw value of each
+    field by a single call to the precomputed prefix struct, after one length
+    check.  Raw values are then converted by the decode method of each field,
+    or for enums and constants by an integer comparison or a lookup in a table
+    indexed by the value of the raw byte.  Invalid values are passed back to
+    the field to raise an appropriate error.  Fields following the first
+    variable size field are located and unpacked at runtime.
+    """
+    fields = cls._fields
+    namespace = {'_cls': cls, '_new': object.__new__, '_invalid': _INVALID}
+    lines = ["def unpack(data):"]
+
+    names = list(fields)
+    prefix_count = cls._prefix_count
+    if prefix_count:
+        namespace['_struct_unpack_from'] = cls._struct.unpack_from
+        lines += [
+            "    if len(data) < %i:" % cls._struct.size,
+            "        raise ValueError('not enough data')",
+            "    %s, = _struct_unpack_from(data)" % ", ".join(
+                "_r%i" % i for i in range(prefix_count)
+            ),
+        ]
+
+    for i, name in enumerate(names[:prefix_count]):
+        field = fields[name]
+        namespace['_decode_%i' % i] = field.decode_struct
+        if isinstance(field, ConstantField):
+            namespace['_const_%i' % i] = field._struct_value
+            lines += [
+                "    if _r%i != _const_%i:" % (i, i),
+                "        _decode_%i(_r%i)" % (i, i),
+                "    _v%i = None" % i,
+            ]
+        elif isinstance(field, EnumField):
+            if field._table is not None:
+                namespace['_table_%i' % i] = field._table
+                lines.append("    _v%i = _table_%i[_r%i]" % (i, i, i))
+            else:
+                namespace['_from_enum_%i' % i] = field._from_struct.get
+                lines.append(
+                    "    _v%i = _from_enum_%i(_r%i, _invalid)" % (i, i, i)
+                )
+            lines += [
+                "    if _v%i is _invalid:" % i,
+                "        _decode_%i(_r%i)" % (i, i),
+            ]
+        else:
+            lines.append("    _v%i = _decode_%i(_r%i)" % (i, i, i))
+
+    if prefix_count < len(names):
+        lines.append("    offset = %i" % cls._prefix_size)
+    for i, name in enumerate(names[prefix_count:], prefix_count):
+        namespace['_unpack_%i' % i] = fields[name].unpack_from
+        lines.append("    _v%i, offset = _unpack_%i(data, offset)" % (i, i))
+
+    lines.append("    message = _new(_cls)")
+    lines += [
+        "    message.%s = _v%i" % (name, i) for i, name in enumerate(names)
+    ]
+    lines.append("    return message")
+
+    return _compile(cls, 'unpack', '\n'.join(lines), namespace)
+
+
 class BBSMessageMeta(type):
     def __new__(mcs, cls, bases, d):
         fields = OrderedDict()
@@ -22,13 +228,43 @@ class BBSMessageMeta(type):
                 fields.update(base._fields)
                 break
 
-        # read fields from class body
-        for name, field in d.items():
+        inherited_slots = {
+            slot
+            for base in bases for klass in base.__mro__
+            for slot in getattr(klass, '__slots__', ())
+        }
+        slots = list(d.get('__slots__', ()))
+
+        # read fields from class body.  Fields are moved out of the class
+        # namespace and into `_fields` so that their names can be used for the
+        # slots holding the values of each instance
+        for name, field in list(d.items()):
             if isinstance(field, BBSField):
                 fields[name] = field
+                del d[name]
+                if name not in inherited_slots:
+                    slots.append(name)
 
+        d['__slots__'] = tuple(slots)
         d['_fields'] = fields
-        return type.__new__(mcs, cls, bases, d)
+        d['_defaults'] = tuple(
+            getattr(field, 'default', _UNDEFINED)
+            for field in fields.values()
+        )
+        d['_offsets'], d['_prefix_size'], d['_prefix_count'] = _layout(fields)
+        d['_struct'] = _prefix_struct(fields, d['_prefix_count'])
+
+        self = type.__new__(mcs, cls, bases, d)
+
+        self._init_fields = staticmethod(_compile_initialiser(self))
+        self._packer = staticmethod(_compile_packer(self))
+        self._unpacker = staticmethod(_compile_unpacker(self))
+
+        # the class that a message should be treated as.  Overridden by
+        # variants, such as lazy messages, that subclass a real message class
+        self._message_class = self
+
+        return self
 
     @classmethod
     def __prepare__(mcs, cls, bases):
@@ -39,36 +275,47 @@ class BBSMessageMeta(type):
 
 
 class BBSMessageBase(object):
+    __slots__ = ()
+
     def __init__(self, **kwargs):
-        for name, field in self._fields.items():
-            if name in kwargs:
-                value = kwargs[name]
-            elif hasattr(field, 'default'):
-                value = field.default
-            else:
-                raise TypeError('missing required argument: %r' % name)
-            setattr(self, name, value)
+        self._init_fields(self, **kwargs)
 
     def pack(self):
-        return b''.join(
-            field.pack(getattr(self, name))
-            for name, field in self._fields.items()
-        )
+        return self._packer(self)
 
     @classmethod
     def unpack_fields(cls, data):
-        fields = OrderedDict()
-
-        offset = 0
-        for name, field in cls._fields.items():
-            fields[name], size = field.unpack(data[offset:])
-            offset += size
-
-        return fields
+        message = cls.unpack(data)
+        return OrderedDict(
+            (name, getattr(message, name)) for name in cls._fields
+        )
 
     @classmethod
     def unpack(cls, data):
-        return cls(**cls.unpack_fields(data))
+        return cls._unpacker(data)
+
+    @classmethod
+    def unpack_lazy(cls, data):
+        """ Checks the length of the frame and the constant fields at its
+        start, and returns a message that only decodes each remaining field
+        the first time it is read.  The frame is copied into an immutable
+        bytes object if it is not one already.
+        """
+        lazy_cls = cls.__dict__.get('_lazy_class')
+        if lazy_cls is None:
+            lazy_cls = _make_lazy_class(cls)
+
+        if len(data) < cls._prefix_size:
+            raise ValueError("not enough data")
+
+        for offset, field in zip(cls._offsets, cls._fields.values()):
+            if offset is not None and isinstance(field, ConstantField):
+                field.unpack_from(data, offset)
+
+        message = object.__new__(lazy_cls)
+        message._data = bytes(data)
+        message._starts = list(cls._offsets)
+        return message
 
     def __repr__(self):
         parts = [self.__class__.__name__]
@@ -80,12 +327,149 @@ class BBSMessageBase(object):
         return "<%s>" % " ".join(parts)
 
 
+class _LazyMessage(object):
+    """ Mixin for message classes that defer decoding of each field until it
+    is first read.  Decoded values are stored in the field's slot, so only the
+    first read of each field goes through ``__getattr__``.
+    """
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        try:
+            index = self._field_index[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+        field = self._field_list[index]
+        value, _ = field.unpack_from(self._data, self._field_offset(index))
+        setattr(self, name, value)
+        return value
+
+    def _field_offset(self, index):
+        # walk forward from the last field with a known offset, skipping
+        # over fields without decoding them
+        starts = self._starts
+        known = index
+        while starts[known] is None:
+            known -= 1
+        while known < index:
+            field = self._field_list[known]
+            starts[known + 1] = field.skip(self._data, starts[known])
+            known += 1
+        return starts[index]
+
+
+_variant_classes_lock = Lock()
+
+
+def _make_lazy_class(cls):
+    with _variant_classes_lock:
+        if '_lazy_class' not in cls.__dict__:
+            lazy_cls = type(cls)(cls.__name__, (_LazyMessage, cls), {
+                '__module__': cls.__module__,
+                '__slots__': ('_data', '_starts'),
+            })
+            lazy_cls._message_class = cls
+            lazy_cls._field_index = {
+                name: index for index, name in enumerate(cls._fields)
+            }
+            lazy_cls._field_list = tuple(cls._fields.values())
+            cls._lazy_class = lazy_cls
+        return cls._lazy_class
+
+
+class _FrozenMessage(object):
+    """ Mixin for message classes whose instances are shared and so must not
+    be modified.
+    """
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError("shared messages can not be modified")
+
+    def __delattr__(self, name):
+        raise AttributeError("shared messages can not be modified")
+
+
+def _make_frozen_class(cls):
+    with _variant_classes_lock:
+        if '_frozen_class' not in cls.__dict__:
+            frozen_cls = type(cls)(cls.__name__, (_FrozenMessage, cls), {
+                '__module__': cls.__module__,
+                '__slots__': (),
+            })
+            frozen_cls._message_class = cls
+            cls._frozen_class = frozen_cls
+        return cls._frozen_class
+
+
+def _freeze(message):
+    """ Converts a fully decoded message into an immutable instance of a
+    variant of its class, in place.
+    """
+    cls = type(message)
+    frozen_cls = cls.__dict__.get('_frozen_class')
+    if frozen_cls is None:
+        frozen_cls = _make_frozen_class(cls)
+
+    # the frozen class only adds methods so instances have the same layout
+    object.__setattr__(message, '__class__', frozen_cls)
+    return message
+
+
+class MessageTemplate(object):
+    """ A message that is packed once, in advance, and can then be packed
+    again with different values for some of its fields.
+
+    Fields of a fixed size that are at a fixed offset are written into a copy
+    of the pre-packed data in place.  Passing any other field falls back to
+    building and packing a complete new message.
+    """
+    def __init__(self, message_cls, **kwargs):
+        self._message_cls = message_cls
+        self._kwargs = kwargs
+
+        self._data = message_cls(**kwargs).pack()
+
+        self._patches = {}
+        for offset, (name, field) in zip(
+                message_cls._offsets, message_cls._fields.items()):
+            if offset is not None and field.size is not None:
+                self._patches[name] = (field.pack_into, offset)
+
+    def pack(self, **kwargs):
+        """ Returns the packed message, with the fields passed as keyword
+        arguments replaced.
+        """
+        if not kwargs:
+            return self._data
+
+        try:
+            patches = [
+                (self._patches[name], value) for name, value in kwargs.items()
+            ]
+        except KeyError:
+            values = dict(self._kwargs)
+            values.update(kwargs)
+            return self._message_cls(**values).pack()
+
+        data = bytearray(self._data)
+        for (pack_into, offset), value in patches:
+            pack_into(data, offset, value)
+        return bytes(data)
+
+
 class BBSMessage(BBSMessageBase, metaclass=BBSMessageMeta):
     is_response = False
 
+    # whether decoded messages of this type can be shared between frames.
+    # Must never be set for messages that carry card or transaction data.
+    cacheable = False
+
 
 class DisplayTextMessage(BBSMessage):
     type = ConstantField(b'\x41')
+    cacheable = True
 
     prompt_customer = EnumField({
         b'\x31': True,
@@ -121,9 +505,42 @@ class PrintTextMessage(BBSMessage):
 
     commands = FormattedTextField()
 
+    @classmethod
+    def unpack(cls, data):
+        # receipts can be long, so leave the commands to be decoded as they
+        # are consumed by `iter_commands`.  Everything else is decoded, and
+        # the text checked, now so that a bad frame is rejected before it is
+        # acknowledged
+        message = cls.unpack_lazy(data)
+        for name in ('sub_type', 'media', 'mode'):
+            getattr(message, name)
+        index = message._field_index['commands']
+        message._field_list[index].check(
+            message._data, message._field_offset(index)
+        )
+        return message
+
+    def iter_commands(self):
+        """ Returns an iterator over the print commands.  Unless
+        ``commands`` has already been read, each command is decoded from the
+        frame only when it is requested, so printing can start before the
+        whole block has been decoded.
+        """
+        if isinstance(self, _LazyMessage):
+            try:
+                commands = object.__getattribute__(self, 'commands')
+            except AttributeError:
+                index = self._field_index['commands']
+                return self._field_list[index].iter_unpack(
+                    self._data, self._field_offset(index)
+                )
+            return iter(commands)
+        return iter(self.commands)
+
 
 class ResetTimerMessage(BBSMessage):
     type = ConstantField(b'\x43')
+    cacheable = True
 
     seconds = IntegerField(3)
 
@@ -206,6 +623,7 @@ class LocalModeMessage(BBSMessage):
 
 class KeyboardInputRequestMessage(BBSMessage):
     type = ConstantField(b'\x46')
+    cacheable = True
 
     # Indicates if the entered chars should be echoed on the ECR display or not
     echo = EnumField({
@@ -235,23 +653,29 @@ class KeyboardInputMessage(BBSMessage):
         super(KeyboardInputMessage, self).__init__(text=text, **kwargs)
 
     @classmethod
-    def unpack_fields(cls, data):
+    def unpack(cls, data):
         # currently special cased because of fixed size `delimiter` field
         # following variable length `text` field.
         # TODO yuck yuck yuck
-        fields = OrderedDict()
+        fields = cls._fields
+
+        _, offset = fields['type'].unpack_from(data, 0)
 
-        fields['type'], size = cls.type.unpack(data)
+        end = len(data) - fields['delimiter'].size
+        text, _ = fields['text'].unpack_from(memoryview(data)[:end], offset)
 
-        text_data = data[size:-cls.delimiter.size]
-        fields['text'], size = cls.text.unpack(text_data)
+        delimiter, _ = fields['delimiter'].unpack_from(data, end)
 
-        delimiter_data = data[-cls.delimiter.size:]
-        fields['delimiter'], size = cls.delimiter.unpack(delimiter_data)
+        return cls(text, delimiter=delimiter)
+
+    @classmethod
+    def unpack_lazy(cls, data):
+        # fields can not be located independently so decode everything
+        return cls.unpack(data)
 
 
 class SendDataMessageBase(BBSMessage):
-    type = ConstantField(b'\x46')
+    type = ConstantField(b'\x49')
 
     code = TextField(2)
     is_last_block = EnumField({
@@ -280,27 +704,66 @@ class SendReconciliationDataAmountsMessage(SendDataMessageBase):
     # TODO
 
 
+def _build_index(message_types, key, *, lazy=False):
+    """ Builds a dictionary mapping the integer value of the ``key`` field of
+    each message type to the function used to unpack it, or to unpack it
+    lazily if ``lazy`` is set.
+
+    Frames can then be dispatched with a single dictionary lookup on their raw
+    bytes, without first being decoded as a generic header.
+    """
+    index = {}
+    for message_type in message_types:
+        value = int.from_bytes(message_type._fields[key].value, 'big')
+        if value in index:
+            raise ValueError("duplicate %s for %s" % (
+                key, message_type.__name__
+            ))
+        if lazy:
+            index[value] = message_type.unpack_lazy
+        else:
+            index[value] = message_type.unpack
+    return index
+
+
+_SEND_DATA_TYPES = [
+    SendReportsDataHeaderMessage,
+    SendReconciliationDataAmountsMessage,
+    # TODO
+]
+
+_SEND_DATA_DECODERS = _build_index(_SEND_DATA_TYPES, 'code')
+_SEND_DATA_LAZY_DECODERS = _build_index(_SEND_DATA_TYPES, 'code', lazy=True)
+
+
 class SendDataMessage(SendDataMessageBase):
-    code = EnumField({
-        subfunction.code.value: subfunction
-        for subfunction in [
-            SendReportsDataHeaderMessage,
-            SendReconciliationDataAmountsMessage,
-            # TODO
-        ]
-    })
+    @classmethod
+    def _dispatch(cls, index, data):
+        if len(data) < 3:
+            raise ValueError("not enough data")
+
+        try:
+            decode = index[data[1] << 8 | data[2]]
+        except KeyError:
+            raise UnknownMessageError(
+                "unknown send data code: %r" % bytes(data[1:3])
+            ) from None
+
+        return decode(data)
 
     @classmethod
     def unpack(cls, data):
-        self = super(SendDataMessage, cls).unpack(data)
+        return cls._dispatch(_SEND_DATA_DECODERS, data)
 
-        return self.code.unpack(data)
+    @classmethod
+    def unpack_lazy(cls, data):
+        return cls._dispatch(_SEND_DATA_LAZY_DECODERS, data)
 
 
 class TransferAmountMessage(BBSMessage):
     type = ConstantField(b'\x51')
 
-    timestamp = DateTimeField()  # not used
+    timestamp = DateTimeField(10, default=None)  # not used
     id_no = TextField(6)  # not used
     # Normally set to "0000". If set in Pre-Auth, the number is a reference to
     # a previous Preauth. If set in Adjustment transaction, the field shall be
@@ -331,19 +794,19 @@ class TransferAmountMessage(BBSMessage):
         b'\x3c': 'merchandise_reversal',
         b'\x3d': 'merchandise_correction',
     })
-    amount = PriceField(11)
+    amount = PriceField(11, minor_units=True)
     # Not used, but tested by the ITU because of error prevention)
     unused_type = EnumField({
         b'\x30': None,
     })
     # Only used if transfer_type == 'purchase_with_ashback' (H33), else it will
     # be filled with H20.
-    cashback_amount = PriceField(11)
+    cashback_amount = PriceField(11, minor_units=True)
     is_top_up = EnumField({
-        b'\x30': True,
-        b'\x31': False,
+        b'\x30': False,
+        b'\x31': True,
     })
-    art_amount = PriceField(11)
+    art_amount = PriceField(11, minor_units=True)
 
     data = DelimitedField(TextField(), delimiter=b';')
 
@@ -366,7 +829,7 @@ class TransferCardDataMessage(BBSMessage):
 class AdministrationMessage(BBSMessage):
     type = ConstantField(b'\x53')
 
-    timestamp = DateTimeField()
+    timestamp = DateTimeField(10, default=None)  # not used
     id_no = TextField(6)
     seq_no = TextField(4)
     opt = TextField(4)
@@ -404,6 +867,7 @@ class AdministrationMessage(BBSMessage):
 
 class DeviceAttributeRequestMessage(BBSMessage):
     type = ConstantField(b'\x60')
+    cacheable = True
 
 
 class DeviceAttributeMessage(BBSMessage):
@@ -445,6 +909,20 @@ class ResponseMessage(BBSMessage):
     endcode = ConstantField(b'\x5d')
 
 
+def _dispatch(index, data):
+    if not len(data):
+        raise ValueError("not enough data")
+
+    try:
+        decode = index[data[0]]
+    except KeyError:
+        raise UnknownMessageError(
+            "unknown message type: %r" % bytes(data[:1])
+        ) from None
+
+    return decode(data)
+
+
 _ITU_MESSAGE_TYPES = {
     DisplayTextMessage,
     PrintTextMessage,
@@ -454,19 +932,95 @@ _ITU_MESSAGE_TYPES = {
     SendDataMessage,
     DeviceAttributeRequestMessage,
     StatusMessage,
+    ResponseMessage,
 }
 
+_ITU_DECODERS = _build_index(_ITU_MESSAGE_TYPES, 'type')
+_ITU_LAZY_DECODERS = _build_index(_ITU_MESSAGE_TYPES, 'type', lazy=True)
+_ITU_CACHEABLE_TYPES = frozenset(
+    int.from_bytes(message_type._fields['type'].value, 'big')
+    for message_type in _ITU_MESSAGE_TYPES if message_type.cacheable
+)
 
-class ITUMessage(BBSMessage):
-    type = EnumField({
-        subtype.type.value: subtype
-        for subtype in _ITU_MESSAGE_TYPES
-    })
 
+def unpack_itu_message(data, *, lazy=False, cache=None):
+    """ Unpacks a frame received from the ITU as an instance of the
+    appropriate message class.
 
-def unpack_itu_message(data):
-    header = ITUMessage.unpack(data)
-    return header.type.unpack(data)
+    :param lazy:
+        If ``True``, only the length and type of the frame are checked up
+        front and each field is decoded when first accessed.  Useful for
+        messages where only one or two fields are ever read.
+
+    :param cache:
+        An optional :py:class:`MessageCache`.  Frames of cacheable message
+        types are looked up in the cache first and returned as shared,
+        immutable, fully decoded messages.  Takes precedence over ``lazy``
+        for those frames.
+    """
+    if cache is not None:
+        return cache.unpack_itu_message(data, lazy=lazy)
+    if lazy:
+        return _dispatch(_ITU_LAZY_DECODERS, data)
+    return _dispatch(_ITU_DECODERS, data)
+
+
+class MessageCache(object):
+    """ A bounded LRU cache of messages decoded from ITU frames, keyed by the
+    raw bytes of the frame.
+
+    The ITU repeats the same display and timer frames many times during each
+    payment, so a single cache can usefully be shared by every connection.
+    All methods are threadsafe.
+
+    Only message types with ``cacheable`` set are stored.  Cached messages
+    are shared between all callers and so can not be modified.
+
+    :param maxsize:
+        The maximum number of frames to keep
+    """
+    def __init__(self, maxsize=256):
+        super(MessageCache, self).__init__()
+
+        self._maxsize = maxsize
+        self._messages = OrderedDict()
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def unpack_itu_message(self, data, *, lazy=False):
+        # other frames are never stored, and do not count as hits or misses
+        if not len(data) or data[0] not in _ITU_CACHEABLE_TYPES:
+            return unpack_itu_message(data, lazy=lazy)
+
+        key = bytes(data)
+
+        with self._lock:
+            message = self._messages.get(key)
+            if message is not None:
+                self._messages.move_to_end(key)
+                self.hits += 1
+                return message
+            self.misses += 1
+
+        message = _freeze(_dispatch(_ITU_DECODERS, key))
+
+        with self._lock:
+            self._messages[key] = message
+            if len(self._messages) > self._maxsize:
+                self._messages.popitem(last=False)
+
+        return message
+
+    def clear(self):
+        with self._lock:
+            self._messages.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._messages)
 
 
 _ECR_MESSAGE_TYPES = {
@@ -475,16 +1029,14 @@ _ECR_MESSAGE_TYPES = {
     TransferAmountMessage,
     AdministrationMessage,
     DeviceAttributeMessage,
+    ResponseMessage,
 }
 
-
-class ECRMessage(BBSMessage):
-    type = EnumField({
-        subtype.type.value: subtype
-        for subtype in _ECR_MESSAGE_TYPES
-    })
+_ECR_DECODERS = _build_index(_ECR_MESSAGE_TYPES, 'type')
+_ECR_LAZY_DECODERS = _build_index(_ECR_MESSAGE_TYPES, 'type', lazy=True)
 
 
-def unpack_ecr_message(data):
-    header = ECRMessage.unpack(data)
-    return header.type.unpack(data)
+def unpack_ecr_message(data, *, lazy=False):
+    if lazy:
+        return _dispatch(_ECR_LAZY_DECODERS, data)
+    return _dispatch(_ECR_DECODERS, data)
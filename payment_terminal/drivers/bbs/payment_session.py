@@ -1,11 +1,15 @@
 import concurrent.futures
-from threading import Lock
+import time
+from threading import RLock
 
 from payment_terminal.base import PaymentSession, Payment
 from payment_terminal.exceptions import (
-    SessionCompletedError, SessionCancelledError, CancelFailedError,
+    SessionCancelledError, CancelFailedError,
+    SessionTimeoutError, ConnectionError,
 )
+from payment_terminal.timers import default_timer_wheel
 
+from .fields import decimal_to_minor
 from .session import BBSSession
 
 import logging
@@ -13,76 +17,218 @@ log = logging.getLogger('payment_terminal')
 
 
 RUNNING = 'RUNNING'
+COMMITTING = 'COMMITTING'
 CANCELLING = 'CANCELLING'
 REVERSING = 'REVERSING'
 FINISHED = 'FINISHED'
 BROKEN = 'BROKEN'
+TIMED_OUT = 'TIMED_OUT'
 
 
 class BBSPaymentSession(BBSSession, PaymentSession):
+    """ A payment session driven by requests from the ITU.
+
+    ``before_commit``, ``on_print`` and ``on_display`` are run on
+    ``callbacks``, a :py:class:`~payment_terminal.callbacks.CallbackQueue`,
+    and requests from the ITU are answered without waiting for them.  If
+    ``callbacks`` is not set they are called directly by the connection.
+
+    If ``coalesce_display`` is set, display updates that are still waiting
+    for ``on_display`` when a newer one arrives are replaced by it, unless
+    ``prompt_customer`` or ``expects_input`` differ.
+
+    Deadlines are kept on ``timers``, a
+    :py:class:`~payment_terminal.timers.TimerWheel` that defaults to the one
+    shared by the whole process.  Once the ITU has sent a Reset Timer
+    request, the session fails with :py:class:`SessionTimeoutError` if it
+    isn't finished, or reset again, within the number of seconds requested.
+    A cancellation that the ITU hasn't confirmed within ``cancel_timeout``
+    seconds fails the session in the same way.  A running payment is aborted
+    when it times out, and if the ITU reports it as successful anyway it is
+    reversed.  A reversal that isn't confirmed in time fails with
+    :py:class:`CancelFailedError`.
+    """
     def __init__(
             self, connection, amount, *, before_commit=None,
-            on_print=None, on_display=None):
+            on_print=None, on_display=None, callbacks=None,
+            coalesce_display=False, timers=None, cancel_timeout=60):
         super(BBSPaymentSession, self).__init__(connection)
         self._future = concurrent.futures.Future()
-        self._lock = Lock()
+        # reentrant so that `_commit` can be called from `on_req_local_mode`
+        # when callbacks are run inline
+        self._lock = RLock()
 
         self._state = RUNNING
 
+        if timers is None:
+            timers = default_timer_wheel()
+        self._timers = timers
+        self._cancel_timeout = cancel_timeout
+        # `time.monotonic` deadlines, and the timers that check them
+        self._watchdog_deadline = None
+        self._watchdog = None
+        self._state_deadline = None
+        self._state_timer = None
+
         self.amount = amount
+        # the ITU works in integer minor units.  Convert once up front so that
+        # amounts that can't be represented exactly are rejected immediately
+        self.amount_minor = decimal_to_minor(amount)
 
         self._commit_callback = before_commit
         self._print_callback = on_print
         self._display_callback = on_display
+        self._callbacks = callbacks
+        self._coalesce_display = coalesce_display
 
-        self._connection.request_transfer_amount(amount).result()
+        self._connection.request_transfer_amount(self.amount_minor).result()
 
-    def _start_reversal(self):
-        try:
-            self._state = REVERSING
-            self._connection.request_reversal(self.amount).result()
-        except Exception as e:
+    def _set_state(self, state):
+        # should be called with `_lock` held
+        self._state = state
+        if state in (CANCELLING, REVERSING):
+            self._state_deadline = time.monotonic() + self._cancel_timeout
+            self._state_timer = self._arm(
+                self._state_timer, self._cancel_timeout, self._on_state_timeout
+            )
+        else:
+            # once committing, the outcome no longer depends on the ITU
+            self._disarm()
+
+    def _arm(self, timer, seconds, callback):
+        if timer is None:
+            return self._timers.schedule(seconds, callback)
+        timer.restart(seconds)
+        return timer
+
+    def _disarm(self):
+        for timer in (self._watchdog, self._state_timer):
+            if timer is not None:
+                timer.cancel()
+
+    def _fail(self, state, exception):
+        # should be called with `_lock` held
+        self._set_state(state)
+        if not self._future.done():
+            self._future.set_exception(exception)
+
+    def _on_watchdog(self):
+        """ Called from the timer wheel's thread.
+        """
+        with self._lock:
+            if self._state in (COMMITTING, FINISHED, BROKEN, TIMED_OUT):
+                return
+            remaining = self._watchdog_deadline - time.monotonic()
+            if remaining > 0:
+                # re-armed while firing
+                self._watchdog.restart(remaining)
+                return
+            log.warning("ITU did not reset timer in time")
+            self._timeout()
+
+    def _on_state_timeout(self):
+        """ Called from the timer wheel's thread.
+        """
+        with self._lock:
+            if self._state not in (CANCELLING, REVERSING):
+                return
+            remaining = self._state_deadline - time.monotonic()
+            if remaining > 0:
+                self._state_timer.restart(remaining)
+                return
+            log.warning("session timed out while %s", self._state.lower())
+            self._timeout()
+
+    def _timeout(self):
+        # should be called with `_lock` held
+        if self._state == REVERSING:
             # XXX This is really really bad
-            raise CancelFailedError() from e
+            log.error("reversal was not confirmed, payment may be charged")
+            self._fail(BROKEN, CancelFailedError("reversal timed out"))
+            return
 
-    def _on_local_mode_running(self, result, **kwargs):
-        if result == 'success':
-            commit = True
+        if self._state == RUNNING:
+            # ask the ITU to give up.  If it completes the payment anyway, it
+            # is reversed by `_on_local_mode_timed_out`
+            self._connection.request_abort()
+        self._fail(TIMED_OUT, SessionTimeoutError())
 
-            # TODO populate properly
-            result_object = Payment(self.amount)
-            if self._commit_callback is not None:
-                # TODO can't decide on commit callback api
-                try:
-                    commit = self._commit_callback(result_object)
-                except Exception:
-                    log.exception("error in commit callback")
-                    commit = False
+    def _start_reversal(self):
+        # should be called with `_lock` held
+        self._set_state(REVERSING)
+
+        def on_response(request):
+            if request.cancelled() or request.exception() is not None:
+                with self._lock:
+                    # XXX This is really really bad
+                    self._fail(BROKEN, CancelFailedError())
 
+        # not waited for, as the response is read by the same thread that
+        # may be running this.  The ITU confirms the reversal with a Local
+        # Mode request
+        self._connection.request_reversal(
+            self.amount_minor
+        ).add_done_callback(on_response)
+
+    def _call(self, fn, *args, **kwargs):
+        if self._callbacks is None:
+            fn(*args, **kwargs)
+        else:
+            self._callbacks.submit(fn, *args, **kwargs)
+
+    def _commit(self, result_object):
+        commit = True
+        if self._commit_callback is not None:
+            # TODO can't decide on commit callback api
+            try:
+                commit = self._commit_callback(result_object)
+            except Exception:
+                log.exception("error in commit callback")
+                commit = False
+
+        with self._lock:
             if commit:
-                self._state = FINISHED
+                self._set_state(FINISHED)
                 self._future.set_result(result_object)
             else:
                 self._start_reversal()
+
+    def _on_local_mode_running(self, result, **kwargs):
+        if result == 'success':
+            # TODO populate properly
+            result_object = Payment(
+                self.amount, amount_minor=self.amount_minor
+            )
+            # the ITU only needs an acknowledgement.  If the payment isn't
+            # committed it is reversed with a separate request
+            self._set_state(COMMITTING)
+            self._call(self._commit, result_object)
         else:
             # TODO interpret errors from ITU
-            self._state = FINISHED
-            self._future.set_exception(SessionCancelledError("itu error"))
+            self._fail(FINISHED, SessionCancelledError("itu error"))
 
     def _on_local_mode_cancelling(self, result, **kwargs):
         if result == 'success':
             self._start_reversal()
         else:
-            self._state = FINISHED
-            self._future.set_exception(SessionCancelledError())
+            self._fail(FINISHED, SessionCancelledError())
 
     def _on_local_mode_reversing(self, result, **kwargs):
         if result == 'success':
-            self._state = FINISHED
-            self._future.set_exception(SessionCancelledError())
+            self._fail(FINISHED, SessionCancelledError())
         else:
             # XXX
-            self._state = BROKEN
+            log.error("ITU failed to reverse payment")
+            self._set_state(BROKEN)
+
+    def _on_local_mode_timed_out(self, result, **kwargs):
+        if result == 'success':
+            # the caller has already been told that the payment failed, so
+            # the money must be returned
+            log.warning("payment completed after timing out, reversing")
+            self._start_reversal()
+        else:
+            self._set_state(FINISHED)
 
     def on_req_local_mode(self, *args, **kwargs):
         """
@@ -95,19 +241,57 @@ class BBSPaymentSession(BBSSession, PaymentSession):
                 return self._on_local_mode_cancelling(*args, **kwargs)
             elif self._state == REVERSING:
                 return self._on_local_mode_reversing(*args, **kwargs)
+            elif self._state == TIMED_OUT:
+                return self._on_local_mode_timed_out(*args, **kwargs)
             else:
                 raise Exception("invalid state")
 
-    def on_display_text(self, text):
-        if self._display_callback is not None:
-            self._display_callback(text)
+    def on_req_display_text(
+            self, text, *, prompt_customer=False, expects_input=False):
+        if self._display_callback is None:
+            return
+        if self._coalesce_display and self._callbacks is not None:
+            self._callbacks.coalesce(
+                (prompt_customer, expects_input), self._display_callback,
+                text, prompt_customer=prompt_customer,
+                expects_input=expects_input,
+            )
+        else:
+            self._call(
+                self._display_callback, text,
+                prompt_customer=prompt_customer, expects_input=expects_input,
+            )
+
+    @property
+    def display_updates_merged(self):
+        """ The number of display updates that were replaced by a newer one
+        before being passed to ``on_display``.
+        """
+        if self._callbacks is None:
+            return 0
+        return self._callbacks.merged
 
-    def on_print_text(self, commands):
+    def on_req_print_text(self, commands):
         if self._print_callback is not None:
-            self._print_callback(commands)
+            self._call(self._print_callback, commands)
 
-    def on_reset_timer(self, timeout):
-        pass
+    def on_reset_timer(self, seconds):
+        with self._lock:
+            if self._state in (COMMITTING, FINISHED, BROKEN, TIMED_OUT):
+                return
+            self._watchdog_deadline = time.monotonic() + seconds
+            self._watchdog = self._arm(
+                self._watchdog, seconds, self._on_watchdog
+            )
+
+    def _start_cancel(self):
+        # should be called with `_lock` held
+        if self._state == RUNNING:
+            self._set_state(CANCELLING)
+            # don't wait for the response, the result of the cancellation is
+            # reported by the next Local Mode request.  Sent ahead of any
+            # other queued requests
+            self._connection.request_abort()
 
     def cancel(self):
         """
@@ -115,10 +299,7 @@ class BBSPaymentSession(BBSSession, PaymentSession):
             If session has already finished
         """
         with self._lock:
-            if self._state == RUNNING:
-                self._state = CANCELLING
-                # non-blocking, don't wait for result
-                self._connection.request_cancel()
+            self._start_cancel()
 
         # block until session finishes
         try:
@@ -145,7 +326,13 @@ class BBSPaymentSession(BBSSession, PaymentSession):
         return self._future.add_done_callback(fn)
 
     def unbind(self):
-        try:
-            self.cancel()
-        except SessionCompletedError:
-            pass
+        """ Called when the session is replaced or the connection is shut
+        down.  Must not wait for the ITU, as nothing more will be passed on
+        to the session.
+        """
+        with self._lock:
+            if self._state == RUNNING and not self._connection.closed:
+                self._start_cancel()
+            elif self._state not in (FINISHED, BROKEN, TIMED_OUT):
+                # whatever the ITU does next will never be seen
+                self._fail(FINISHED, ConnectionError("session unbound"))
@@ -0,0 +1,468 @@
+import heapq
+import itertools
+import struct
+from collections import deque
+
+from payment_terminal.exceptions import ConnectionError
+from . import messages
+
+import logging
+log = logging.getLogger('payment_terminal')
+
+
+class ProtocolError(ConnectionError):
+    """ The ITU sent something that does not fit the state of the
+    conversation
+    """
+    pass
+
+
+class OutOfSyncError(ProtocolError):
+    """ A request to the ITU timed out, so responses can no longer be paired
+    with the requests that they answer
+    """
+    pass
+
+
+class RequestTimeoutError(ConnectionError):
+    """ The ITU did not respond to a request before its deadline
+    """
+    pass
+
+
+class FramingError(ConnectionError):
+    """ Base class for errors reading frames from the ITU
+    """
+    pass
+
+
+class EndOfStreamError(FramingError):
+    """ The port was closed cleanly between two frames
+    """
+    pass
+
+
+class TruncatedHeaderError(FramingError):
+    """ The port was closed part way through the length header of a frame
+    """
+    pass
+
+
+class TruncatedBodyError(FramingError):
+    """ The port was closed before all of the bytes promised by the length
+    header of a frame had been received
+    """
+    pass
+
+
+_HEADER = struct.Struct('>H')
+
+
+def pack_frame(data):
+    """ Prefixes ``data`` with its length.
+
+    :raises ValueError:
+        If ``data`` is too large to fit in a single frame
+    """
+    if len(data) > 0xffff:
+        raise ValueError("frame too large: %i bytes" % len(data))
+    return _HEADER.pack(len(data)) + data
+
+
+# Messages sent on every payment are packed once and then patched with the
+# values for each request.
+_ACK = messages.ResponseMessage(code='success').pack()
+_NACK = messages.ResponseMessage(code='failure').pack()
+
+_TRANSFER_AMOUNT_TEMPLATE = messages.MessageTemplate(
+    messages.TransferAmountMessage,
+    id_no='000000', seq_no='0000', operator_id='0000',
+    transfer_type='eft_authorisation', amount=0,
+    cashback_amount=None, is_top_up=False, art_amount=None,
+    data='',
+)
+
+_ADMINISTRATION_TEMPLATE = messages.MessageTemplate(
+    messages.AdministrationMessage,
+    id_no='000000', seq_no='0000', opt='0000', adm_code='not_used',
+)
+
+
+def transfer_amount_request(amount, *, transfer_type='eft_authorisation'):
+    """ Packs an H51 request to start a Bank Mode session.
+
+    :param int amount:
+        The amount to request, as an integer number of minor units
+    """
+    return _TRANSFER_AMOUNT_TEMPLATE.pack(
+        transfer_type=transfer_type, amount=amount,
+    )
+
+
+def abort_request():
+    """ Packs an H53 request asking the ITU to exit Bank Mode.
+    """
+    return _ADMINISTRATION_TEMPLATE.pack(adm_code='cancel')
+
+
+def reversal_request(amount):
+    """ Packs an H51 request to reverse the most recent payment.
+
+    :param int amount:
+        The amount of the payment to reverse, as an integer number of minor
+        units
+    """
+    return transfer_amount_request(amount, transfer_type='reversal')
+
+
+def _on_req_display_text(session, message):
+    return session.on_req_display_text(
+        message.text,
+        prompt_customer=message.prompt_customer,
+        expects_input=message.expects_input
+    )
+
+
+def _on_req_print_text(session, message):
+    # TODO might make sense to handle printing in the connection rather
+    # than in the session
+    return session.on_req_print_text(message.iter_commands())
+
+
+def _on_req_reset_timer(session, message):
+    # TODO (possibly) reinterpret errors
+    return session.on_req_reset_timer(message.seconds)
+
+
+def _on_req_local_mode(session, message):
+    # TODO
+    return session.on_req_local_mode(message.result)
+
+
+# Maps each type of request that can be received from the ITU to a function
+# that passes it on to the current session.  Requests without an entry are
+# not yet supported.
+_SESSION_CALLBACKS = {
+    messages.DisplayTextMessage: _on_req_display_text,
+    messages.PrintTextMessage: _on_req_print_text,
+    messages.ResetTimerMessage: _on_req_reset_timer,
+    messages.LocalModeMessage: _on_req_local_mode,
+    # TODO
+    messages.KeyboardInputRequestMessage: None,
+    messages.SendDataMessage: None,
+    messages.DeviceAttributeRequestMessage: None,
+    messages.StatusMessage: None,
+}
+# send data frames are unpacked as one of several more specific types
+for _message_type in messages._SEND_DATA_TYPES:
+    _SESSION_CALLBACKS[_message_type] = (
+        _SESSION_CALLBACKS[messages.SendDataMessage]
+    )
+del _message_type
+
+
+class RequestReceived(object):
+    """ The ITU has sent a request.  Every request must be answered, in the
+    order that they were received, by a call to
+    :py:meth:`BBSProtocol.send_response`.
+    """
+    def __init__(self, message, callback):
+        super(RequestReceived, self).__init__()
+        self.message = message
+        self._callback = callback
+
+    def dispatch(self, session):
+        """ Passes the request on to the matching ``on_req_...`` method of
+        ``session``, and returns the result.
+
+        :raises NotImplementedError:
+            If requests of this type are not supported
+        """
+        if self._callback is None:
+            raise NotImplementedError()
+        return self._callback(session, self.message)
+
+    def __repr__(self):
+        return "<RequestReceived %r>" % (self.message,)
+
+
+class ResponseReceived(object):
+    """ The ITU has responded to a request previously passed to
+    :py:meth:`BBSProtocol.send_request`.
+    """
+    def __init__(self, request, message, sequence=None):
+        super(ResponseReceived, self).__init__()
+        self.request = request
+        self.message = message
+        self._sequence = sequence
+
+    def __repr__(self):
+        return "<ResponseReceived %r>" % (self.message,)
+
+
+class BBSProtocol(object):
+    """ State machine for a single connection to the bbs msg router.
+
+    Does no I/O of its own.  Bytes received from the ITU are passed to
+    :py:meth:`receive_data`, which returns a list of events.  Requests and
+    responses for the ITU are buffered by :py:meth:`send_request` and
+    :py:meth:`send_response` until collected by :py:meth:`data_to_send`.
+
+    Responses from the ITU are paired with requests in the order that the
+    requests were sent.  Requests from the ITU must be answered in the order
+    that they were received.
+
+    Requests may be given a deadline.  The protocol has no clock of its own:
+    drivers should call :py:meth:`expire` once the time returned by
+    :py:meth:`next_deadline` has passed.  If any request expires, the protocol
+    is marked as out of sync, as a late response would otherwise be paired
+    with the wrong request.
+
+    Not threadsafe.  Drivers that use a protocol object from more than one
+    thread are responsible for locking.
+
+    :param lazy_decoding:
+        If set, fields of received messages are only decoded when first
+        accessed.
+    :param message_cache:
+        An optional :py:class:`messages.MessageCache`, which may be shared
+        between connections, used to avoid decoding repeated frames.
+    """
+    def __init__(self, *, lazy_decoding=False, message_cache=None):
+        super(BBSProtocol, self).__init__()
+
+        self._lazy_decoding = lazy_decoding
+        self._message_cache = message_cache
+
+        self._receive_buffer = bytearray()
+        self._send_buffer = bytearray()
+
+        # `(sequence number, request)` pairs for requests that have been sent
+        # to the ITU but not yet answered, in the order that they were sent
+        self._pending_requests = deque()
+        self._sequence = itertools.count()
+        # heap of `(deadline, sequence number)` pairs.  Entries for requests
+        # that have since been answered are discarded lazily
+        self._deadlines = []
+        self._out_of_sync = False
+        # number of requests received from the ITU that are not yet answered
+        self._unanswered = 0
+
+        self._closed = False
+
+    def send_request(self, data, request=None, *, deadline=None):
+        """ Buffers a request for the ITU.
+
+        :param bytes data:
+            The packed request message
+        :param request:
+            Any object.  It will be passed back as the ``request`` attribute
+            of the :py:class:`ResponseReceived` event for the response.
+        :param deadline:
+            An optional time, on whatever clock the driver passes to
+            :py:meth:`expire`, by which the ITU must respond.
+        :returns:
+            ``request``
+        :raises OutOfSyncError:
+            If an earlier request has expired
+        """
+        self._check_open()
+        if self._out_of_sync:
+            raise OutOfSyncError()
+        sequence = next(self._sequence)
+        self._send_buffer += pack_frame(data)
+        self._pending_requests.append((sequence, request))
+        if deadline is not None:
+            heapq.heappush(self._deadlines, (deadline, sequence))
+        return request
+
+    def send_response(self, data=None):
+        """ Buffers the response to the oldest unanswered request from the
+        ITU.
+
+        :param bytes data:
+            The packed response message.  If ``None``, a plain successful
+            acknowledgement is sent.
+        :raises ProtocolError:
+            If there are no unanswered requests
+        """
+        self._check_open()
+        if not self._unanswered:
+            raise ProtocolError("no request to respond to")
+        if data is None:
+            data = _ACK
+        self._send_buffer += pack_frame(data)
+        self._unanswered -= 1
+
+    def send_failure(self):
+        """ Responds to the oldest unanswered request from the ITU with an
+        error.
+        """
+        self.send_response(_NACK)
+
+    def data_to_send(self):
+        """ Returns all bytes buffered for sending to the ITU, and clears the
+        buffer.
+        """
+        data = bytes(self._send_buffer)
+        del self._send_buffer[:]
+        return data
+
+    def receive_data(self, data):
+        """ Processes bytes received from the ITU.  Partial frames are
+        buffered until the rest of the frame arrives.  An empty ``data``
+        indicates that the port has been closed.
+
+        :returns:
+            A list of events for every complete frame received, except for
+            responses discarded because the protocol is out of sync
+        :raises FramingError:
+            If the port was closed part way through a frame
+        """
+        if not len(data):
+            self._receive_eof()
+            return []
+
+        self._check_open()
+        buffer = self._receive_buffer
+        buffer += data
+
+        events = []
+        offset = 0
+        view = memoryview(buffer)
+        try:
+            while len(buffer) - offset >= _HEADER.size:
+                size, = _HEADER.unpack_from(buffer, offset)
+                start = offset + _HEADER.size
+                if len(buffer) - start < size:
+                    break
+
+                frame = view[start:start + size]
+                try:
+                    event = self.receive_frame(frame)
+                finally:
+                    frame.release()
+                if event is not None:
+                    events.append(event)
+                offset = start + size
+        except BaseException:
+            # the events for earlier frames are lost along with the
+            # exception.  Put their requests back, so that they are failed
+            # when the connection is closed rather than never completing
+            for event in reversed(events):
+                if isinstance(event, ResponseReceived):
+                    self._pending_requests.appendleft(
+                        (event._sequence, event.request)
+                    )
+            raise
+        finally:
+            view.release()
+            del buffer[:offset]
+
+        return events
+
+    def receive_frame(self, frame):
+        """ Processes a single frame, without its length header, for drivers
+        that do their own framing.
+
+        :returns:
+            The event for the frame, or ``None`` if the frame was a response
+            that was discarded because the protocol is out of sync
+        """
+        self._check_open()
+        message = messages.unpack_itu_message(
+            frame, lazy=self._lazy_decoding, cache=self._message_cache,
+        )
+
+        if message.is_response:
+            if self._out_of_sync:
+                log.warning("discarding response: %r", message)
+                return None
+            if not self._pending_requests:
+                raise ProtocolError("response has no corresponding request")
+            sequence, request = self._pending_requests.popleft()
+            return ResponseReceived(request, message, sequence)
+
+        self._unanswered += 1
+        return RequestReceived(
+            message, _SESSION_CALLBACKS[message._message_class]
+        )
+
+    def _receive_eof(self):
+        self._closed = True
+        if len(self._receive_buffer) >= _HEADER.size:
+            raise TruncatedBodyError()
+        if len(self._receive_buffer):
+            raise TruncatedHeaderError()
+
+    def next_deadline(self):
+        """ Returns the earliest deadline of any request still waiting for a
+        response, or ``None``.
+        """
+        deadlines = self._deadlines
+        if self._pending_requests:
+            oldest, _ = self._pending_requests[0]
+            while deadlines and deadlines[0][1] < oldest:
+                heapq.heappop(deadlines)
+        else:
+            del deadlines[:]
+
+        if deadlines:
+            return deadlines[0][0]
+        return None
+
+    def expire(self, now):
+        """ Fails every request with a deadline at or before ``now``.  If any
+        have expired, marks the protocol as out of sync and also gives up on
+        the requests that were sent after them.
+
+        :returns:
+            A pair of lists.  The first holds requests that have passed their
+            deadline, and the second the other requests that will now never
+            receive a response, each in the order that they were sent
+        """
+        deadline = self.next_deadline()
+        if deadline is None or deadline > now:
+            return [], []
+
+        expired = set()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, sequence = heapq.heappop(self._deadlines)
+            expired.add(sequence)
+        del self._deadlines[:]
+
+        self._out_of_sync = True
+        timed_out, interrupted = [], []
+        for sequence, request in self._pending_requests:
+            if sequence in expired:
+                timed_out.append(request)
+            else:
+                interrupted.append(request)
+        self._pending_requests.clear()
+
+        return timed_out, interrupted
+
+    def close(self):
+        """ Marks the connection as closed.
+
+        :returns:
+            A list of requests that will now never receive a response, in the
+            order that they were sent
+        """
+        self._closed = True
+        requests = [request for _, request in self._pending_requests]
+        self._pending_requests.clear()
+        del self._deadlines[:]
+        return requests
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def out_of_sync(self):
+        return self._out_of_sync
+
+    def _check_open(self):
+        if self._closed:
+            raise ProtocolError("connection closed")
@@ -10,10 +10,19 @@ class BBSSession(object):
         # TODO
         pass
 
-    def on_req_reset_timer(self, data):
+    def on_req_print_text(self, commands):
         # TODO
         pass
 
+    def on_req_reset_timer(self, seconds):
+        self.on_reset_timer(seconds)
+
+    def on_reset_timer(self, seconds):
+        """ Called when the ITU asks for the session's timeout to be reset to
+        ``seconds``.  Should be implemented by subclasses that enforce it.
+        """
+        pass
+
     def on_req_local_mode(
             self, *, result, acc, issuer_id, pan, timestamp, ver_method,
             session_num, stan_auth, seq_no, tip):
@@ -3,11 +3,15 @@ from .test_messages import TestBBSMessages
 from .test_terminal import TestBBSTerminal
 from .test_connection import TestBBSConnection
 from .test_frames import TestBBSFrames
+from .test_protocol import TestBBSProtocol
 from .test_payment_session import TestBBSPaymentSession
+from .test_aio import TestBBSAsyncTerminal
+from .test_hub import TestBBSConnectionHub
 
 
 __all__ = [
     'TestBBSFields', 'TestBBSMessages',
     'TestBBSTerminal', 'TestBBSConnection',
-    'TestBBSFrames', 'TestBBSPaymentSession',
+    'TestBBSFrames', 'TestBBSProtocol', 'TestBBSPaymentSession',
+    'TestBBSAsyncTerminal', 'TestBBSConnectionHub',
 ]
@@ -0,0 +1,36 @@
+""" Frames and socket helpers shared by the driver tests.
+"""
+from payment_terminal.drivers.bbs.protocol import pack_frame as frame
+
+
+ACK = frame(b'\x5b00\x5d')
+DISPLAY_TEXT = frame(b'\x41100Insert card')
+LOCAL_MODE_SUCCESS = frame(
+    b'\x44\x20\x2003;20160229130509;0;123;000000012345;0042;;'
+)
+LOCAL_MODE_FAILURE = frame(
+    b'\x44\x21\x2003;20160229130509;0;123;000000012345;0042;;'
+)
+
+
+def read_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError()
+        data += chunk
+    return data
+
+
+def read_frame(sock):
+    """ Reads a single frame from ``sock`` and returns it with its header.
+    """
+    size = int.from_bytes(read_exactly(sock, 2), 'big')
+    return frame(read_exactly(sock, size))
+
+
+__all__ = [
+    'frame', 'ACK', 'DISPLAY_TEXT', 'LOCAL_MODE_SUCCESS',
+    'LOCAL_MODE_FAILURE', 'read_exactly', 'read_frame',
+]
@@ -0,0 +1,173 @@
+import asyncio
+import socket
+import unittest
+
+from payment_terminal.base import Payment
+from payment_terminal.exceptions import (
+    SessionCancelledError, ConnectionError,
+)
+from payment_terminal.drivers.bbs.aio import (
+    AsyncBBSMsgRouterConnection, AsyncBBSMsgRouterTerminal, open_tcp,
+)
+from payment_terminal.drivers.bbs.protocol import (
+    transfer_amount_request, abort_request, reversal_request,
+    RequestTimeoutError,
+)
+from payment_terminal.drivers.bbs.tests.helpers import (
+    frame, ACK, LOCAL_MODE_SUCCESS, LOCAL_MODE_FAILURE,
+)
+
+
+class MockTransport(asyncio.Transport):
+    def __init__(self, connection):
+        super(MockTransport, self).__init__()
+        self._connection = connection
+        self.written = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        self.written += data
+
+    def take(self):
+        data = bytes(self.written)
+        del self.written[:]
+        return data
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._connection.connection_lost(None)
+
+
+class TestBBSAsyncTerminal(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.connection = AsyncBBSMsgRouterConnection(loop=self.loop)
+        self.transport = MockTransport(self.connection)
+        self.connection.connection_made(self.transport)
+        self.terminal = AsyncBBSMsgRouterTerminal(
+            self.connection, loop=self.loop
+        )
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_soon(self, coroutine):
+        task = self.loop.create_task(coroutine)
+        self.settle()
+        return task
+
+    def settle(self):
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+
+    def receive(self, data):
+        self.connection.data_received(data)
+        self.settle()
+
+    def start_payment(self, amount, **kwargs):
+        task = self.run_soon(self.terminal.start_payment(amount, **kwargs))
+        self.assertEqual(
+            self.transport.take(),
+            frame(transfer_amount_request(int(amount * 100)))
+        )
+        self.assertFalse(task.done())
+
+        self.receive(ACK)
+        return task.result()
+
+    def test_payment(self):
+        displayed = []
+
+        async def on_display(text, **kwargs):
+            displayed.append(text)
+
+        committed = []
+
+        def before_commit(payment):
+            committed.append(payment)
+            return True
+
+        session = self.start_payment(
+            10, on_display=on_display, before_commit=before_commit,
+        )
+
+        self.receive(frame(b'\x41100Insert card'))
+        self.assertEqual(displayed, ["Insert card"])
+        self.assertEqual(self.transport.take(), ACK)
+
+        self.receive(LOCAL_MODE_SUCCESS)
+        self.assertEqual(self.transport.take(), ACK)
+        self.assertEqual(len(committed), 1)
+
+        result = self.loop.run_until_complete(session.result())
+        self.assertIsInstance(result, Payment)
+        self.assertEqual(result.amount_minor, 1000)
+        self.assertIs(self.loop.run_until_complete(session), result)
+
+    def test_cancel(self):
+        session = self.start_payment(10)
+
+        cancel = self.run_soon(session.cancel())
+        self.assertEqual(self.transport.take(), frame(abort_request()))
+        self.receive(ACK)
+        self.assertFalse(cancel.done())
+
+        self.receive(LOCAL_MODE_FAILURE)
+        self.assertEqual(self.transport.take(), ACK)
+        self.assertTrue(cancel.done())
+        self.assertIsNone(cancel.result())
+        self.assertTrue(session.cancelled())
+
+    def test_dont_commit(self):
+        session = self.start_payment(10, before_commit=lambda payment: False)
+
+        self.receive(LOCAL_MODE_SUCCESS)
+        # the reversal must only be sent after local mode is acknowledged
+        self.assertEqual(
+            self.transport.take(), ACK + frame(reversal_request(1000))
+        )
+        self.receive(ACK)
+        self.receive(LOCAL_MODE_SUCCESS)
+
+        self.assertRaises(
+            SessionCancelledError,
+            self.loop.run_until_complete, session.result()
+        )
+
+    def test_connection_lost(self):
+        task = self.run_soon(self.terminal.start_payment(10))
+        self.transport.close()
+        self.settle()
+        self.assertRaises(ConnectionError, task.result)
+
+    def test_open_tcp(self):
+        server = socket.socket()
+        self.addCleanup(server.close)
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        uri = 'bbs+tcp://%s:%i' % server.getsockname()
+
+        self.assertRaises(
+            ValueError, self.loop.run_until_complete,
+            open_tcp(uri + '?timeout=1', loop=self.loop)
+        )
+
+        terminal = self.loop.run_until_complete(open_tcp(
+            uri + '?connect_timeout=5&nodelay=1&keepalive=1', loop=self.loop
+        ))
+        connection = terminal._connection
+        sock = connection._transport.get_extra_info('socket')
+        self.assertTrue(
+            sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        )
+        self.assertTrue(
+            sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+        )
+
+        self.loop.run_until_complete(terminal.shutdown())
+
+    def test_request_timeout(self):
+        request = self.connection.request_abort(timeout=0.01)
+        self.settle()
+        self.assertRaises(RequestTimeoutError, request.result)
+        self.assertTrue(self.transport.closed)
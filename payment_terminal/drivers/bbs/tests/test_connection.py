@@ -1,7 +1,47 @@
+import socket
 import threading
+import time
 import unittest
 
-from payment_terminal.drivers.bbs.connection import BBSMsgRouterConnection
+from payment_terminal.drivers.bbs.connection import (
+    BBSMsgRouterConnection, SendQueueFullError, FAIL,
+)
+from payment_terminal.drivers.bbs.protocol import (
+    RequestTimeoutError, abort_request, transfer_amount_request,
+)
+from payment_terminal.drivers.bbs.session import BBSSession
+from payment_terminal.drivers.bbs.tests.helpers import (
+    frame, ACK, DISPLAY_TEXT, read_exactly,
+)
+
+
+class BlockingFile(object):
+    """ A port that holds up every write until `unblock` is called.
+    """
+    def __init__(self):
+        self.written = []
+        self.writing = threading.Event()
+        self._unblocked = threading.Event()
+        self._closed = threading.Event()
+
+    def unblock(self):
+        self._unblocked.set()
+
+    def read(self, *args, **kwargs):
+        self._closed.wait()
+        raise ValueError()
+
+    def write(self, data):
+        self.writing.set()
+        self._unblocked.wait(5)
+        self.written.append(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self._unblocked.set()
+        self._closed.set()
 
 
 class TestBBSConnection(unittest.TestCase):
@@ -19,3 +59,127 @@ class TestBBSConnection(unittest.TestCase):
 
         terminal = BBSMsgRouterConnection(CloseableFile())
         terminal.shutdown()
+
+    def test_request_timeout(self):
+        local, remote = socket.socketpair()
+        self.addCleanup(remote.close)
+
+        connection = BBSMsgRouterConnection(local, request_timeout=0.05)
+        self.addCleanup(connection.shutdown)
+
+        request = connection.request_abort()
+        self.assertRaises(RequestTimeoutError, request.result, 5)
+        self.assertTrue(connection.closed)
+
+    def test_request_timeout_under_load(self):
+        local, remote = socket.socketpair()
+        remote.settimeout(5)
+        self.addCleanup(remote.close)
+
+        connection = BBSMsgRouterConnection(local, request_timeout=0.05)
+        self.addCleanup(connection.shutdown)
+        BBSSession(connection)
+
+        # under steady traffic there is always something to send, so the send
+        # thread never waits long enough for the queue to time out
+        send_queue = connection._send_queue
+        queue_get = send_queue.get
+        send_queue.get = lambda timeout=None: queue_get()
+
+        request = connection.request_abort()
+        read_exactly(remote, len(frame(abort_request())))
+        time.sleep(0.1)
+
+        remote.sendall(DISPLAY_TEXT)
+        self.assertRaises(RequestTimeoutError, request.result, 5)
+        self.assertTrue(connection.closed)
+
+    def test_control_lane(self):
+        port = BlockingFile()
+        connection = BBSMsgRouterConnection(
+            port, max_queued=1, queue_policy=FAIL,
+        )
+        self.addCleanup(connection.shutdown)
+
+        # the send thread picks up the first request and stalls writing it
+        connection.request_transfer_amount(100)
+        self.assertTrue(port.writing.wait(5))
+
+        connection.request_transfer_amount(200)
+        rejected = connection.request_transfer_amount(300)
+        self.assertRaises(SendQueueFullError, rejected.result, 5)
+
+        # control messages are never rejected, and skip the queue
+        connection.request_abort()
+        stats = connection.send_queue_stats()
+        self.assertEqual(stats['normal_depth'], 1)
+        self.assertEqual(stats['control_depth'], 1)
+
+        port.unblock()
+        for _ in range(500):
+            if len(port.written) == 2:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(port.written, [
+            frame(transfer_amount_request(100)),
+            frame(abort_request()) + frame(transfer_amount_request(200)),
+        ])
+
+        stats = connection.send_queue_stats()
+        self.assertEqual(stats['sent'], 3)
+        self.assertEqual(stats['normal_depth'], 0)
+        self.assertEqual(stats['max_depth'], 2)
+        self.assertGreater(stats['max_wait'], 0)
+
+    def test_shutdown_wakes_blocked_request(self):
+        port = BlockingFile()
+        connection = BBSMsgRouterConnection(port, max_queued=1)
+
+        connection.request_transfer_amount(100)
+        self.assertTrue(port.writing.wait(5))
+        connection.request_transfer_amount(200)
+
+        # blocks until there is room in the queue
+        blocked = []
+        thread = threading.Thread(target=lambda: blocked.append(
+            connection.request_transfer_amount(300)
+        ))
+        thread.start()
+
+        connection.shutdown()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(blocked[0].cancelled())
+
+    def test_acknowledge(self):
+        local, remote = socket.socketpair()
+        remote.settimeout(5)
+        self.addCleanup(remote.close)
+
+        connection = BBSMsgRouterConnection(local)
+        self.addCleanup(connection.shutdown)
+        BBSSession(connection)
+
+        remote.sendall(DISPLAY_TEXT * 3)
+        self.assertEqual(read_exactly(remote, len(ACK) * 3), ACK * 3)
+        self.assertFalse(connection.closed)
+
+    def test_acknowledge_write_error(self):
+        local, remote = socket.socketpair()
+        self.addCleanup(remote.close)
+
+        connection = BBSMsgRouterConnection(local)
+        self.addCleanup(connection.shutdown)
+        BBSSession(connection)
+
+        # the receive thread doesn't wait for the acknowledgement to be
+        # written, so the failure has to be picked up by the send thread
+        local.shutdown(socket.SHUT_WR)
+        remote.sendall(DISPLAY_TEXT)
+
+        for _ in range(500):
+            if connection.closed:
+                break
+            time.sleep(0.01)
+        self.assertTrue(connection.closed)
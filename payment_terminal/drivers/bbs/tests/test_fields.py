@@ -1,4 +1,6 @@
 import unittest
+from datetime import datetime
+from decimal import Decimal
 
 import payment_terminal.drivers.bbs.fields as f
 
@@ -41,6 +43,24 @@ class TestBBSFields(unittest.TestCase):
             f.DelimitedField(f.TextField(3)).unpack, b'loooonnnngggg\n'
         )
 
+    def test_unpack_delimited_from(self):
+        field = f.DelimitedField(f.TextField(), delimiter=b';')
+        self.assertEqual(
+            field.unpack_from(b'xxhello;world;', 2), ("hello", 8)
+        )
+        self.assertEqual(
+            field.unpack_from(memoryview(b'xxhello;world;'), 8), ("world", 14)
+        )
+        self.assertEqual(
+            field.unpack_from(bytearray(b'hello;'), 0), ("hello", 6)
+        )
+        self.assertRaises(ValueError, field.unpack_from, b'hello;world', 6)
+
+        optional = f.DelimitedField(
+            f.TextField(4), delimiter=b';', optional=True
+        )
+        self.assertEqual(optional.unpack_from(b'x;', 1), (None, 2))
+
     def test_text_field(self):
         self.assertEqual(f.TextField().size, None)
         self.assertEqual(f.TextField(4).size, 4)
@@ -62,26 +82,186 @@ class TestBBSFields(unittest.TestCase):
 
         self.assertRaises(ValueError, f.TextField(120).unpack, b'short')
 
+    def test_unpack_text_from(self):
+        self.assertEqual(
+            f.TextField().unpack_from(b'xxhello', 2), ("hello", 7)
+        )
+        self.assertEqual(
+            f.TextField(3).unpack_from(memoryview(b'xxhello'), 2), ("hel", 5)
+        )
+        self.assertEqual(
+            f.TextField(3).unpack_from(bytearray(b'xxhello'), 4), ("llo", 7)
+        )
+        self.assertRaises(ValueError, f.TextField(3).unpack_from, b'xxhe', 2)
+
+    def test_unpack_fixed_from(self):
+        data = memoryview(bytearray(b'\x410120012345'))
+
+        self.assertEqual(
+            f.ConstantField(b'\x41').unpack_from(data, 0), (None, 1)
+        )
+        self.assertEqual(
+            f.EnumField({b'0': False, b'1': True}).unpack_from(data, 1),
+            (False, 2)
+        )
+        self.assertEqual(f.IntegerField(2).unpack_from(data, 2), (12, 4))
+        self.assertEqual(
+            f.PriceField(7).unpack_from(data, 4),
+            (Decimal('123.45'), 11)
+        )
+
+        self.assertRaises(
+            ValueError, f.ConstantField(b'\x42').unpack_from, data, 0
+        )
+        self.assertRaises(ValueError, f.IntegerField(4).unpack_from, data, 9)
+
+    def test_pack_into(self):
+        buffer = bytearray(b'xxxxxxxx')
+        f.IntegerField(3).pack_into(buffer, 2, 42)
+        f.TextField(3).pack_into(buffer, 5, "ab")
+        self.assertEqual(buffer, b'xx042ab ')
+
+        self.assertRaises(
+            ValueError, f.IntegerField(3).pack_into, buffer, 0, 1000
+        )
+        self.assertEqual(buffer, b'xx042ab ')
+
+        self.assertRaises(
+            NotImplementedError, f.TextField().pack_into, buffer, 0, "a"
+        )
+
     def test_formatted_text_field(self):
-        # TODO
-        pass
+        field = f.FormattedTextField()
+        commands = [
+            ('write', "First"),
+            'cut-partial',
+            ('write', "Second"),
+            'cut-through',
+            ('write', "Third"),
+            'cut-through',
+        ]
+        data = b'First\x0eSecond\x0cThird\x0c'
+
+        self.assertEqual(field.pack(commands), data)
+        self.assertEqual(
+            list(field.iter_pack(commands[:2])), [b'First', b'\x0e']
+        )
+        self.assertRaises(ValueError, field.pack, [('write', "a\x0cb")])
+
+        # every block should be decoded, not just the first
+        self.assertEqual(field.unpack(data), (commands, len(data)))
+        self.assertEqual(
+            field.unpack_from(b'xx' + data, 2), (commands, len(data) + 2)
+        )
+
+        # doubled up and leading control characters are ignored
+        self.assertEqual(
+            field.unpack(b'\x0c\x0eFirst\x0e\x0eSecond\x0c\x0c')[0],
+            commands[:4]
+        )
+
+        commands = field.iter_unpack(memoryview(data))
+        self.assertEqual(next(commands), ('write', "First"))
 
     def test_integer_field(self):
         # TODO
         pass
 
     def test_price_field(self):
-        # TODO
-        pass
+        self.assertEqual(f.PriceField().size, 11)
+
+        self.assertEqual(f.PriceField(6).pack(Decimal('12.34')), b'  1234')
+        self.assertEqual(f.PriceField(6).pack(10), b'  1000')
+        self.assertEqual(f.PriceField(6).pack(None), b'      ')
+        self.assertRaises(ValueError, f.PriceField(6).pack, Decimal('0.001'))
+        self.assertRaises(ValueError, f.PriceField(6).pack, 10000)
+        self.assertRaises(ValueError, f.PriceField(6).pack, -1)
+
+        self.assertEqual(
+            f.PriceField(6).unpack(b'  1234'), (Decimal('12.34'), 6)
+        )
+        self.assertEqual(
+            f.PriceField(6).unpack(b'001234'), (Decimal('12.34'), 6)
+        )
+        self.assertEqual(f.PriceField(6).unpack(b'      '), (None, 6))
+        self.assertRaises(ValueError, f.PriceField(6).unpack, b' 12.34')
+        self.assertRaises(ValueError, f.PriceField(6).unpack, b' -1234')
+
+    def test_price_field_minor_units(self):
+        field = f.PriceField(6, minor_units=True)
+
+        self.assertEqual(field.pack(1234), b'  1234')
+        self.assertEqual(field.unpack(b'  1234'), (1234, 6))
+        self.assertEqual(field.unpack(b'000000'), (0, 6))
+
+        # amounts in minor units must be integers
+        self.assertRaises(TypeError, field.pack, Decimal('12.34'))
+        self.assertRaises(TypeError, field.pack, 12.5)
+
+        self.assertEqual(f.decimal_to_minor(Decimal('12.34')), 1234)
+        self.assertEqual(f.minor_to_decimal(1234), Decimal('12.34'))
+        self.assertRaises(ValueError, f.decimal_to_minor, Decimal('1.005'))
 
     def test_enum_field(self):
-        # TODO
-        pass
+        field = f.EnumField({b'0': 'off', b'1': 'on'})
+        self.assertEqual(field.size, 1)
+        self.assertEqual(field.struct_code, 'B')
+        self.assertEqual(field.pack('on'), b'1')
+        self.assertEqual(field.unpack(b'0'), ('off', 1))
+        self.assertEqual(field.unpack_from(b'x1y', 1), ('on', 2))
+        self.assertEqual(field.decode_struct(0x31), 'on')
+        self.assertEqual(field.pack_struct('off'), 0x30)
+        self.assertRaises(ValueError, field.unpack, b'2')
+        self.assertRaises(ValueError, field.decode_struct, 0x32)
+        self.assertRaises(ValueError, field.unpack, b'')
+
+        field = f.EnumField({b'ab': 'first', b'cd': 'second'})
+        self.assertEqual(field.struct_code, 'H')
+        self.assertEqual(field.unpack(bytearray(b'cd')), ('second', 2))
+        self.assertEqual(field.decode(b'ab'), 'first')
+        self.assertRaises(ValueError, field.decode, b'ac')
+
+        field = f.EnumField({b'abc': 'first'})
+        self.assertEqual(field.struct_code, '3s')
+        self.assertEqual(field.decode_struct(b'abc'), 'first')
+        self.assertRaises(ValueError, field.decode_struct, b'abd')
 
     def test_constant_field(self):
-        # TODO
-        pass
+        field = f.ConstantField(b'\x5b')
+        self.assertEqual(field.struct_code, 'B')
+        self.assertEqual(field.pack(b'\x5b'), b'\x5b')
+        self.assertEqual(field.unpack(b'\x5b'), (None, 1))
+        self.assertEqual(field.decode_struct(0x5b), None)
+        self.assertEqual(field.pack_struct(b'\x5b'), 0x5b)
+        self.assertRaises(ValueError, field.pack, b'\x5c')
+        self.assertRaises(ValueError, field.unpack, b'\x5c')
+        self.assertRaises(ValueError, field.decode_struct, 0x5c)
 
     def test_datetime_field(self):
-        # TODO
-        pass
+        field = f.DateTimeField()
+        timestamp = datetime(2016, 2, 29, 13, 5, 9)
+        self.assertEqual(field.pack(timestamp), b'20160229130509')
+        self.assertEqual(field.unpack(b'20160229130509'), (timestamp, 14))
+        self.assertEqual(
+            field.unpack_from(b'x20160229130509', 1), (timestamp, 15)
+        )
+        self.assertEqual(field.pack(None), b'00000000000000')
+        self.assertEqual(field.decode(b'00000000000000'), None)
+
+        self.assertRaises(ValueError, field.decode, b'20160230130509')
+        self.assertRaises(ValueError, field.decode, b'2016022913050 ')
+        self.assertRaises(ValueError, field.decode, b'+2016022913050')
+
+    def test_datetime_field_short(self):
+        field = f.DateTimeField(10)
+        timestamp = datetime(2016, 2, 29, 13, 5)
+        self.assertEqual(field.pack(timestamp), b'1602291305')
+        self.assertEqual(field.decode(b'1602291305'), timestamp)
+        self.assertEqual(field.pack(None), b'0000000000')
+        self.assertRaises(ValueError, f.DateTimeField, 12)
+
+    def test_datetime_field_epoch(self):
+        field = f.DateTimeField(epoch=True)
+        self.assertEqual(field.decode(b'19700101000100'), 60)
+        self.assertEqual(field.pack(1456751109), b'20160229130509')
+        self.assertEqual(field.decode(b'20160229130509'), 1456751109)
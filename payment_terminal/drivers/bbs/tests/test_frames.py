@@ -1,7 +1,23 @@
 import io
 import unittest
 
-from payment_terminal.drivers.bbs.connection import read_frame, write_frame
+from payment_terminal.drivers.bbs.connection import (
+    read_frame, write_frame, write_frames, FrameReader,
+    EndOfStreamError, TruncatedHeaderError, TruncatedBodyError,
+)
+
+
+class ChunkedPort(object):
+    """ Returns at most ``chunk_size`` bytes from each read
+    """
+    def __init__(self, data, chunk_size):
+        self._data = io.BytesIO(data)
+        self._chunk_size = chunk_size
+        self.reads = 0
+
+    def readinto1(self, buffer):
+        self.reads += 1
+        return self._data.readinto(buffer[:self._chunk_size])
 
 
 class TestBBSFrames(unittest.TestCase):
@@ -16,18 +32,58 @@ class TestBBSFrames(unittest.TestCase):
 
     def test_read_end_of_file(self):
         port = io.BytesIO(b'')
-        # TODO more specific
-        self.assertRaises(Exception, read_frame, port)
+        self.assertRaises(EndOfStreamError, read_frame, port)
 
     def test_read_truncated_header(self):
         port = io.BytesIO(b'a')
-        # TODO more specific
-        self.assertRaises(Exception, read_frame, port)
+        self.assertRaises(TruncatedHeaderError, read_frame, port)
 
     def test_read_truncated_body(self):
         port = io.BytesIO(b'\x00\x09trunca')
-        # TODO more specific
-        self.assertRaises(Exception, read_frame, port)
+        self.assertRaises(TruncatedBodyError, read_frame, port)
+
+    def test_reader_read_two(self):
+        port = ChunkedPort(b'\x00\x0512345\x00\x06123456', 4096)
+        reader = FrameReader(port)
+        self.assertEqual(reader.read_frame(), b'12345')
+        self.assertEqual(reader.read_frame(), b'123456')
+        # both frames should have been picked up by a single read
+        self.assertEqual(port.reads, 1)
+        self.assertRaises(EndOfStreamError, reader.read_frame)
+
+    def test_reader_chunked(self):
+        frames = [b'x' * size for size in (1, 200, 0, 0xffff, 3)]
+        data = b''.join(
+            len(frame).to_bytes(2, 'big') + frame for frame in frames
+        )
+        for chunk_size in (1, 3, 1000, 0xffff):
+            reader = FrameReader(ChunkedPort(data, chunk_size))
+            for frame in frames:
+                self.assertEqual(reader.read_frame(), frame)
+            self.assertRaises(EndOfStreamError, reader.read_frame)
+
+    def test_reader_read_only(self):
+        class ReadOnlyPort(object):
+            def __init__(self, data):
+                self._data = io.BytesIO(data)
+
+            def read(self, size):
+                return self._data.read(size)
+
+        port = ReadOnlyPort(b'\x00\x0512345\x00\x06123456trailing')
+        reader = FrameReader(port)
+        self.assertEqual(reader.read_frame(), b'12345')
+        self.assertEqual(reader.read_frame(), b'123456')
+        # should not have read past the end of the last frame
+        self.assertEqual(port.read(8), b'trailing')
+
+    def test_reader_truncated(self):
+        reader = FrameReader(io.BytesIO(b'\x00\x0512345a'))
+        self.assertEqual(reader.read_frame(), b'12345')
+        self.assertRaises(TruncatedHeaderError, reader.read_frame)
+
+        reader = FrameReader(io.BytesIO(b'\x00\x09trunca'))
+        self.assertRaises(TruncatedBodyError, reader.read_frame)
 
     def test_write_one(self):
         port = io.BytesIO()
@@ -42,5 +98,30 @@ class TestBBSFrames(unittest.TestCase):
 
     def test_write_too_much(self):
         port = io.BytesIO()
-        # TODO more specific
-        self.assertRaises(Exception, write_frame, port, b'x' * 2**16)
+        self.assertRaises(ValueError, write_frame, port, b'x' * 2**16)
+
+    def test_write_many(self):
+        class CountingPort(io.BytesIO):
+            writes = 0
+            flushes = 0
+
+            def write(self, data):
+                self.writes += 1
+                return super(CountingPort, self).write(data)
+
+            def flush(self):
+                self.flushes += 1
+
+        port = CountingPort()
+        write_frames(port, [b'12345', b'', b'123456'])
+        self.assertEqual(
+            port.getvalue(), b'\x00\x0512345\x00\x00\x00\x06123456'
+        )
+        self.assertEqual((port.writes, port.flushes), (1, 1))
+
+        # nothing should be written if any frame is invalid
+        port = io.BytesIO()
+        self.assertRaises(
+            ValueError, write_frames, port, [b'12345', b'x' * 2**16]
+        )
+        self.assertEqual(port.getvalue(), b'')
@@ -0,0 +1,142 @@
+import socket
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from threading import current_thread
+
+from payment_terminal.base import Payment
+from payment_terminal.exceptions import ConnectionError
+from payment_terminal.drivers.bbs import BBSMsgRouterTerminal
+from payment_terminal.drivers.bbs.hub import BBSConnectionHub
+from payment_terminal.drivers.bbs.protocol import (
+    transfer_amount_request, RequestTimeoutError,
+)
+from payment_terminal.drivers.bbs.tests.helpers import (
+    frame, ACK, LOCAL_MODE_SUCCESS, read_frame,
+)
+
+
+class TestBBSConnectionHub(unittest.TestCase):
+    def setUp(self):
+        self.hub = BBSConnectionHub(max_workers=2)
+        self.executor = ThreadPoolExecutor(4)
+
+    def tearDown(self):
+        self.hub.shutdown()
+        self.executor.shutdown()
+
+    def open_terminal(self, **kwargs):
+        local, remote = socket.socketpair()
+        remote.settimeout(5)
+        self.addCleanup(remote.close)
+        terminal = BBSMsgRouterTerminal(
+            connection=self.hub.connect(local, **kwargs)
+        )
+        return terminal, remote
+
+    def start_payment(self, terminal, itu, amount, **kwargs):
+        session = self.executor.submit(
+            terminal.start_payment, amount, **kwargs
+        )
+        self.assertEqual(
+            read_frame(itu), frame(transfer_amount_request(amount * 100))
+        )
+        itu.sendall(ACK)
+        return session.result(timeout=5)
+
+    def test_payment(self):
+        terminal, itu = self.open_terminal()
+
+        committed = []
+
+        def before_commit(payment):
+            committed.append(current_thread())
+            return True
+
+        session = self.start_payment(
+            terminal, itu, 10, before_commit=before_commit
+        )
+
+        itu.sendall(frame(b'\x41100Insert card') + LOCAL_MODE_SUCCESS)
+        self.assertEqual(read_frame(itu), ACK)
+        self.assertEqual(read_frame(itu), ACK)
+
+        result = session.result(timeout=5)
+        self.assertIsInstance(result, Payment)
+        self.assertEqual(result.amount_minor, 1000)
+
+        # callbacks are run on the worker pool, never the I/O thread
+        self.assertEqual(len(committed), 1)
+        self.assertIsNot(committed[0], self.hub._thread)
+
+    def test_many_connections(self):
+        terminals = [self.open_terminal() for _ in range(5)]
+
+        sessions = [
+            self.start_payment(terminal, itu, amount)
+            for amount, (terminal, itu) in enumerate(terminals, 1)
+        ]
+
+        # answer in reverse order to make sure that nothing is serialised
+        # across connections
+        for terminal, itu in reversed(terminals):
+            itu.sendall(LOCAL_MODE_SUCCESS)
+            self.assertEqual(read_frame(itu), ACK)
+
+        for amount, session in enumerate(sessions, 1):
+            self.assertEqual(session.result(timeout=5).amount, amount)
+
+    def test_connection_lost(self):
+        terminal, itu = self.open_terminal()
+
+        session = self.executor.submit(terminal.start_payment, 10)
+        read_frame(itu)
+        itu.close()
+
+        self.assertRaises(ConnectionError, session.result, timeout=5)
+        terminal._connection._closed.wait(5)
+        self.assertTrue(terminal._connection._closed.is_set())
+        self.assertFalse(terminal.is_connected())
+
+    def test_shutdown(self):
+        terminal, itu = self.open_terminal()
+        self.assertTrue(terminal.is_connected())
+        terminal.shutdown()
+        self.assertEqual(itu.recv(1), b'')
+
+    def test_open_tcp_shares_callback_executor(self):
+        server = socket.socket()
+        self.addCleanup(server.close)
+        server.bind(('127.0.0.1', 0))
+        server.listen(2)
+        uri = 'bbs+tcp://%s:%i' % server.getsockname()
+
+        terminals = [self.hub.open_tcp(uri) for _ in range(2)]
+        for _ in terminals:
+            self.addCleanup(server.accept()[0].close)
+
+        first, second = terminals
+        self.assertIs(first._callback_executor, second._callback_executor)
+
+        # the shared executor outlives the terminals
+        first.shutdown()
+        second.shutdown()
+        self.assertEqual(
+            first._callback_executor.serial().submit(int).result(5), 0
+        )
+
+    def test_request_timeout(self):
+        slow, slow_itu = self.open_terminal(request_timeout=0.05)
+        fast, fast_itu = self.open_terminal(request_timeout=5)
+
+        slow_request = slow._connection.request_abort()
+        fast_request = fast._connection.request_abort()
+        read_frame(slow_itu)
+        read_frame(fast_itu)
+        fast_itu.sendall(ACK)
+
+        self.assertEqual(fast_request.result(5).code, 'success')
+        self.assertRaises(RequestTimeoutError, slow_request.result, 5)
+        self.assertTrue(fast.is_connected())
+
+        slow._connection._closed.wait(5)
+        self.assertFalse(slow.is_connected())
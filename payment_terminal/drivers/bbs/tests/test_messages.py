@@ -1,6 +1,9 @@
 import unittest
+from datetime import datetime
 
-from payment_terminal.drivers.bbs.fields import ConstantField
+from payment_terminal.drivers.bbs.fields import (
+    ConstantField, EnumField, IntegerField, DelimitedField, TextField,
+)
 import payment_terminal.drivers.bbs.messages as m
 
 
@@ -82,6 +85,31 @@ class TestBBSMessages(unittest.TestCase):
             b'\x42\x20\x22\x2aFirst\x0eSecond\x0c'
         )
 
+    def test_iter_print_text(self):
+        data = b'\x42\x20\x22\x2aFirst\x0eSecond\x0c'
+
+        commands = m.PrintTextMessage.unpack(data).iter_commands()
+        self.assertEqual(next(commands), ('write', "First"))
+        self.assertEqual(list(commands), [
+            'cut-partial', ('write', "Second"), 'cut-through',
+        ])
+
+        message = m.PrintTextMessage.unpack(data)
+        self.assertEqual(
+            list(message.iter_commands()), message.commands
+        )
+
+    def test_unpack_invalid_print_text(self):
+        with self.assertRaises(ValueError):
+            m.PrintTextMessage.unpack(b'\x42\x99\x20\x2a')
+        with self.assertRaises(ValueError):
+            m.PrintTextMessage.unpack(b'\x42\x20\x20\x2aFirst\xff')
+
+        # only checked when read if lazy decoding was asked for
+        message = m.PrintTextMessage.unpack_lazy(b'\x42\x99\x20\x2a')
+        with self.assertRaises(ValueError):
+            message.sub_type
+
     def test_unpack_print_text(self):
         message = m.PrintTextMessage.unpack(
             b'\x42\x20\x22\x2aFirst\x0eSecond\x0c'
@@ -115,3 +143,225 @@ class TestBBSMessages(unittest.TestCase):
             pass
         else:
             self.fail()
+
+    def test_unpack_local_mode(self):
+        data = (
+            b'\x44\x20\x2003;20160229130509;0;123;000000012345;0042;;'
+        )
+        message = m.LocalModeMessage.unpack(data)
+        self.assertEqual(message.result, 'success')
+        self.assertIsNone(message.pan)
+        self.assertEqual(
+            message.timestamp, datetime(2016, 2, 29, 13, 5, 9)
+        )
+        self.assertEqual(message.seq_no, 42)
+
+    def test_compiled_matches_fields(self):
+        class TestMessage(m.BBSMessage):
+            type = ConstantField(b'\x99')
+            flag = EnumField({b'1': True, b'0': False})
+            count = IntegerField(3)
+            name = DelimitedField(TextField(), delimiter=b';')
+            tag = EnumField({b'ab': 'ab', b'cd': 'cd'})
+            rest = TextField()
+
+        message = TestMessage(
+            flag=True, count=12, name="hello", tag='cd', rest="tail"
+        )
+
+        expected = b''.join(
+            field.pack(getattr(message, name))
+            for name, field in TestMessage._fields.items()
+        )
+        self.assertEqual(message.pack(), expected)
+        self.assertEqual(expected, b'\x991012hello;cdtail')
+
+        fields = TestMessage.unpack_fields(expected)
+        self.assertEqual(list(fields.keys()), list(TestMessage._fields))
+        self.assertEqual(
+            list(fields.values()), [None, True, 12, "hello", 'cd', "tail"]
+        )
+
+        self.assertRaises(ValueError, TestMessage.unpack_fields, b'\x9910')
+        self.assertRaises(
+            ValueError, TestMessage.unpack_fields, b'\x981012hello;cdtail'
+        )
+
+        message.type = b'\x98'
+        self.assertRaises(ValueError, message.pack)
+
+    def test_unpack_itu_message(self):
+        message = m.unpack_itu_message(b'\x41100Hello World')
+        self.assertIsInstance(message, m.DisplayTextMessage)
+        self.assertEqual(message.text, "Hello World")
+
+        message = m.unpack_itu_message(memoryview(b'\x43060'))
+        self.assertIsInstance(message, m.ResetTimerMessage)
+        self.assertEqual(message.seconds, 60)
+
+        self.assertRaises(
+            m.UnknownMessageError, m.unpack_itu_message, b'\x51000'
+        )
+        self.assertRaises(ValueError, m.unpack_itu_message, b'')
+
+    def test_unpack_send_data_message(self):
+        message = m.unpack_itu_message(b'\x49022000000001' b'0003')
+        self.assertIsInstance(message, m.SendReconciliationDataAmountsMessage)
+        self.assertEqual(message.issuer_id, "01")
+        self.assertEqual(message.num_transactions, 3)
+
+        self.assertRaises(
+            m.UnknownMessageError,
+            m.unpack_itu_message, b'\x49992000000001' b'0003'
+        )
+        self.assertRaises(ValueError, m.unpack_itu_message, b'\x490')
+
+    def test_unpack_ecr_message(self):
+        message = m.unpack_ecr_message(b'\x61')
+        self.assertIsInstance(message, m.DeviceAttributeMessage)
+
+        self.assertRaises(
+            m.UnknownMessageError, m.unpack_ecr_message, b'\x41100Hello'
+        )
+
+    def test_message_slots(self):
+        message = m.DisplayTextMessage("Hello")
+        self.assertFalse(hasattr(message, '__dict__'))
+        self.assertRaises(AttributeError, setattr, message, 'other', 1)
+
+        self.assertEqual(
+            m.DisplayTextMessage._defaults[:2], (b'\x41', True)
+        )
+        self.assertTrue(message.prompt_customer)
+        self.assertFalse(message.expects_input)
+
+        self.assertRaises(TypeError, m.ResponseMessage, unknown=1)
+        self.assertRaises(TypeError, m.KeyboardInputRequestMessage)
+
+        message = m.ResetTimerMessage.unpack(b'\x43060')
+        self.assertFalse(hasattr(message, '__dict__'))
+        self.assertEqual(
+            m.ResetTimerMessage.unpack_fields(b'\x43060'),
+            {'type': None, 'seconds': 60}
+        )
+
+    def test_unpack_lazy(self):
+        frame = bytearray(b'\x41010Insert card')
+        message = m.unpack_itu_message(frame, lazy=True)
+
+        self.assertIsInstance(message, m.DisplayTextMessage)
+        self.assertIs(message._message_class, m.DisplayTextMessage)
+
+        # frame should have been copied
+        frame[5:] = b'Overwritten'
+
+        self.assertEqual(message.text, "Insert card")
+        self.assertEqual(message.expects_input, True)
+
+        self.assertRaises(
+            ValueError, m.DisplayTextMessage.unpack_lazy, b'\x42010text'
+        )
+        self.assertRaises(
+            ValueError, m.DisplayTextMessage.unpack_lazy, b'\x4101'
+        )
+
+    def test_unpack_lazy_variable_fields(self):
+        class TestMessage(m.BBSMessage):
+            type = ConstantField(b'\x99')
+            first = DelimitedField(TextField(), delimiter=b';')
+            second = DelimitedField(IntegerField(3), delimiter=b';')
+            third = DelimitedField(TextField(), delimiter=b';')
+
+        message = TestMessage.unpack_lazy(b'\x99hello;012;world;')
+
+        # reading the last field should not require decoding the others
+        self.assertEqual(message.third, "world")
+        # bypass `__getattr__` to check that the slot is still empty
+        self.assertRaises(
+            AttributeError, TestMessage.first.__get__, message
+        )
+        self.assertEqual(message.second, 12)
+        self.assertEqual(message.first, "hello")
+
+        message = TestMessage.unpack_lazy(b'\x99hello;abc;world;')
+        self.assertEqual(message.first, "hello")
+        self.assertRaises(ValueError, getattr, message, 'second')
+
+    def test_message_cache(self):
+        cache = m.MessageCache(maxsize=2)
+
+        frame = b'\x41100Insert card'
+        first = m.unpack_itu_message(frame, cache=cache)
+        second = m.unpack_itu_message(bytearray(frame), cache=cache)
+        self.assertIs(first, second)
+        self.assertEqual(first.text, "Insert card")
+        self.assertIs(first._message_class, m.DisplayTextMessage)
+        self.assertIsInstance(first, m.DisplayTextMessage)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # shared messages must not be modified
+        self.assertRaises(AttributeError, setattr, first, 'text', "PIN")
+
+        # least recently used frames are evicted
+        m.unpack_itu_message(b'\x43060', cache=cache)
+        m.unpack_itu_message(b'\x43030', cache=cache)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNot(m.unpack_itu_message(frame, cache=cache), first)
+        self.assertEqual((cache.hits, cache.misses), (1, 4))
+
+        # messages carrying card data are never cached
+        frame = b'\x44\x20\x2003;20160229130509;0;123;000000012345;0042;;'
+        first = m.unpack_itu_message(frame, cache=cache)
+        self.assertIsNot(m.unpack_itu_message(frame, cache=cache), first)
+        self.assertEqual((cache.hits, cache.misses), (1, 4))
+
+    def test_fixed_size_struct(self):
+        self.assertEqual(m.ResetTimerMessage._struct.format, '>B3s')
+        self.assertEqual(m.ResponseMessage._prefix_count, 3)
+        self.assertEqual(m.DisplayTextMessage._prefix_count, 4)
+
+        self.assertEqual(
+            m.ResponseMessage(code='printer_busy').pack(), b'\x5b12\x5d'
+        )
+        message = m.ResponseMessage.unpack(bytearray(b'\x5b11\x5d'))
+        self.assertEqual(message.code, 'display_busy')
+
+        self.assertRaises(ValueError, m.ResponseMessage.unpack, b'\x5b11')
+        self.assertRaises(
+            ValueError, m.ResponseMessage.unpack, b'\x5b11\x5e'
+        )
+        # unknown enum values are reported as invalid data
+        self.assertRaises(
+            ValueError, m.ResponseMessage.unpack, b'\x5b99\x5d'
+        )
+        self.assertRaises(
+            ValueError, m.ResponseMessage(code='success', endcode=b'x').pack
+        )
+        self.assertRaises(ValueError, m.ResetTimerMessage(1000).pack)
+
+    def test_message_template(self):
+        class TestMessage(m.BBSMessage):
+            type = ConstantField(b'\x99')
+            flag = EnumField({b'1': True, b'0': False})
+            count = IntegerField(3)
+            name = DelimitedField(TextField(), delimiter=b';')
+            tag = EnumField({b'ab': 'ab', b'cd': 'cd'})
+
+        template = m.MessageTemplate(
+            TestMessage, flag=False, count=0, name="name", tag='ab'
+        )
+
+        self.assertEqual(template.pack(), b'\x990000name;ab')
+        self.assertEqual(
+            template.pack(flag=True, count=42), b'\x991042name;ab'
+        )
+        # template should not have been modified
+        self.assertEqual(template.pack(count=1), b'\x990001name;ab')
+
+        # fields that can't be patched in place fall back to full pack
+        self.assertEqual(
+            template.pack(name="other", tag='cd'), b'\x990000other;cd'
+        )
+
+        self.assertRaises(ValueError, template.pack, count=1000)
+        self.assertRaises(KeyError, template.pack, flag='maybe')
@@ -4,9 +4,10 @@ from concurrent.futures import Future
 import unittest
 
 from payment_terminal.exceptions import (
-    SessionCancelledError, CancelFailedError,
+    SessionCancelledError, CancelFailedError, SessionTimeoutError,
 )
 from payment_terminal.drivers.bbs.payment_session import BBSPaymentSession
+from payment_terminal.timers import TimerWheel
 
 
 def fulfilled_future(result=None):
@@ -61,7 +62,7 @@ class TestBBSPaymentSession(unittest.TestCase):
                 self.state_change('bank', 'local')
                 return fulfilled_future()
 
-            def request_cancel(self):
+            def request_abort(self):
                 self.state_change('local', 'cancelling')
                 return fulfilled_future()
 
@@ -80,7 +81,7 @@ class TestBBSPaymentSession(unittest.TestCase):
         t.start()
 
         # yield to cancel thread, cancel thread should have called
-        # `request_cancel` but should not return until local mode message has
+        # `request_abort` but should not return until local mode message has
         # been received
         sleep(0)  # XXX might not actually yield
         self.assertEqual(terminal.state, 'cancelling')
@@ -98,7 +99,7 @@ class TestBBSPaymentSession(unittest.TestCase):
                 self.state_change('bank', 'local')
                 return fulfilled_future()
 
-            def request_cancel(self):
+            def request_abort(self):
                 self.state_change('local', 'cancelling')
                 return fulfilled_future()
 
@@ -121,7 +122,7 @@ class TestBBSPaymentSession(unittest.TestCase):
         t.start()
 
         # yield to cancel thread, cancel thread should have called
-        # `request_cancel` but should not return until local mode message has
+        # `request_abort` but should not return until local mode message has
         sleep(0)  # XXX might not actually yield
         self.assertTrue(t.is_alive())
 
@@ -191,3 +192,100 @@ class TestBBSPaymentSession(unittest.TestCase):
         s.on_req_local_mode('success')
 
         self.assertRaises(SessionCancelledError, s.result)
+
+    def make_wheel(self):
+        wheel = TimerWheel(0.01)
+        self.addCleanup(wheel.shutdown)
+        return wheel
+
+    def test_reset_timer(self):
+        class TerminalMock(TerminalMockBase):
+            def request_transfer_amount(self, amount):
+                return fulfilled_future()
+
+        s = BBSPaymentSession(
+            TerminalMock(self), 10, timers=self.make_wheel()
+        )
+
+        # keeps the session alive for as long as it is reset in time
+        for _ in range(5):
+            s.on_req_reset_timer(0.05)
+            sleep(0.02)
+        s.on_req_local_mode('success')
+        s.result(timeout=5)
+
+    def test_reset_timer_timeout(self):
+        class TerminalMock(TerminalMockBase):
+            def request_transfer_amount(self, amount):
+                self.state_change('bank', 'local')
+                return fulfilled_future()
+
+            def request_abort(self):
+                self.state_change('local', 'aborting')
+                return fulfilled_future()
+
+            def request_reversal(self, amount):
+                self.state_change('success', 'reversing')
+                return fulfilled_future()
+
+        terminal = TerminalMock(self)
+        s = BBSPaymentSession(terminal, 10, timers=self.make_wheel())
+        with self.assertLogs('payment_terminal', 'WARNING'):
+            s.on_req_reset_timer(0.02)
+            self.assertRaises(SessionTimeoutError, s.result, 5)
+
+        # the ITU is told to give up on the payment
+        self.assertEqual(terminal.state, 'aborting')
+
+        # but completes it anyway, so it has to be reversed
+        terminal.state_change('aborting', 'success')
+        with self.assertLogs('payment_terminal', 'WARNING'):
+            s.on_req_local_mode('success')
+        self.assertEqual(terminal.state, 'reversing')
+
+        s.on_req_local_mode('success')
+        self.assertRaises(SessionTimeoutError, s.result)
+
+    def test_cancel_timeout(self):
+        class TerminalMock(TerminalMockBase):
+            def request_transfer_amount(self, amount):
+                self.state_change('bank', 'local')
+                return fulfilled_future()
+
+            def request_abort(self):
+                self.state_change('local', 'aborting')
+                return fulfilled_future()
+
+            def request_reversal(self, amount):
+                self.state_change('success', 'reversing')
+                return fulfilled_future()
+
+        terminal = TerminalMock(self)
+        s = BBSPaymentSession(
+            terminal, 10, timers=self.make_wheel(), cancel_timeout=0.02,
+        )
+        with self.assertLogs('payment_terminal', 'WARNING'):
+            self.assertRaises(SessionTimeoutError, s.cancel)
+        self.assertEqual(terminal.state, 'aborting')
+
+        # a late success is reversed rather than acknowledged and forgotten
+        terminal.state_change('aborting', 'success')
+        with self.assertLogs('payment_terminal', 'WARNING'):
+            s.on_req_local_mode('success')
+        self.assertEqual(terminal.state, 'reversing')
+
+    def test_reversal_timeout(self):
+        class TerminalMock(TerminalMockBase):
+            def request_transfer_amount(self, amount):
+                return fulfilled_future()
+
+            def request_reversal(self, amount):
+                return fulfilled_future()
+
+        s = BBSPaymentSession(
+            TerminalMock(self), 10, before_commit=lambda payment: False,
+            timers=self.make_wheel(), cancel_timeout=0.02,
+        )
+        with self.assertLogs('payment_terminal', 'WARNING'):
+            s.on_req_local_mode('success')
+            self.assertRaises(CancelFailedError, s.result, 5)
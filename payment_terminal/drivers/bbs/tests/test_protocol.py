@@ -0,0 +1,173 @@
+import unittest
+
+from payment_terminal.drivers.bbs.protocol import (
+    BBSProtocol, RequestReceived, ResponseReceived, ProtocolError,
+    TruncatedHeaderError, TruncatedBodyError, OutOfSyncError,
+    transfer_amount_request, abort_request,
+)
+import payment_terminal.drivers.bbs.messages as m
+from payment_terminal.drivers.bbs.tests.helpers import frame
+
+
+class TestBBSProtocol(unittest.TestCase):
+    def test_request_response(self):
+        protocol = BBSProtocol()
+
+        request = object()
+        self.assertIs(
+            protocol.send_request(transfer_amount_request(100), request),
+            request
+        )
+        protocol.send_request(abort_request(), 'abort')
+        self.assertEqual(
+            protocol.data_to_send(),
+            frame(transfer_amount_request(100)) + frame(abort_request())
+        )
+        self.assertEqual(protocol.data_to_send(), b'')
+
+        # responses are paired with requests in the order they were sent
+        events = protocol.receive_data(
+            frame(b'\x5b00\x5d') + frame(b'\x5b03\x5d')
+        )
+        self.assertEqual(len(events), 2)
+        self.assertIsInstance(events[0], ResponseReceived)
+        self.assertIs(events[0].request, request)
+        self.assertEqual(events[0].message.code, 'success')
+        self.assertEqual(events[1].request, 'abort')
+        self.assertEqual(events[1].message.code, 'failure')
+
+        self.assertRaises(
+            ProtocolError, protocol.receive_data, frame(b'\x5b00\x5d')
+        )
+
+    def test_receive_partial(self):
+        protocol = BBSProtocol()
+        data = frame(b'\x41100Insert card') + frame(b'\x43060')
+
+        events = []
+        for i in range(len(data)):
+            events += protocol.receive_data(data[i:i + 1])
+
+        self.assertEqual(len(events), 2)
+        self.assertIsInstance(events[0], RequestReceived)
+        self.assertEqual(events[0].message.text, "Insert card")
+        self.assertEqual(events[1].message.seconds, 60)
+
+    def test_respond(self):
+        protocol = BBSProtocol()
+        self.assertRaises(ProtocolError, protocol.send_response)
+
+        event, = protocol.receive_data(frame(b'\x43060'))
+
+        class Session(object):
+            def on_req_reset_timer(self, seconds):
+                self.seconds = seconds
+
+        session = Session()
+        self.assertIsNone(event.dispatch(session))
+        self.assertEqual(session.seconds, 60)
+
+        protocol.send_response()
+        self.assertEqual(protocol.data_to_send(), frame(b'\x5b00\x5d'))
+        self.assertRaises(ProtocolError, protocol.send_failure)
+
+    def test_print_text(self):
+        protocol = BBSProtocol()
+        event, = protocol.receive_data(
+            frame(b'\x42\x20\x22\x2aFirst\x0eSecond\x0c')
+        )
+
+        class Session(object):
+            def on_req_print_text(self, commands):
+                self.first = next(commands)
+                self.rest = list(commands)
+
+        session = Session()
+        event.dispatch(session)
+        self.assertEqual(session.first, ('write', "First"))
+        self.assertEqual(len(session.rest), 3)
+
+    def test_unsupported_request(self):
+        protocol = BBSProtocol()
+        event, = protocol.receive_data(frame(b'\x60'))
+        self.assertIsInstance(event.message, m.DeviceAttributeRequestMessage)
+        self.assertRaises(NotImplementedError, event.dispatch, object())
+
+    def test_unsupported_send_data(self):
+        protocol = BBSProtocol()
+        event, = protocol.receive_data(frame(
+            b'\x49012000100012345600120160229130509'
+        ))
+        self.assertIsInstance(event.message, m.SendReportsDataHeaderMessage)
+        self.assertRaises(NotImplementedError, event.dispatch, object())
+
+    def test_decode_error(self):
+        protocol = BBSProtocol()
+        protocol.send_request(abort_request(), 'abort')
+
+        self.assertRaises(
+            m.UnknownMessageError, protocol.receive_data,
+            frame(b'\x5b00\x5d') + frame(b'\x99junk')
+        )
+        # the response was never delivered, so the request must still fail
+        self.assertEqual(protocol.close(), ['abort'])
+
+    def test_close(self):
+        protocol = BBSProtocol()
+        protocol.send_request(abort_request(), 'first')
+        protocol.send_request(abort_request(), 'second')
+        protocol.receive_data(frame(b'\x5b00\x5d'))
+
+        self.assertEqual(protocol.close(), ['second'])
+        self.assertTrue(protocol.closed)
+        self.assertRaises(ProtocolError, protocol.send_request, b'')
+
+    def test_end_of_stream(self):
+        protocol = BBSProtocol()
+        self.assertEqual(protocol.receive_data(b''), [])
+        self.assertTrue(protocol.closed)
+
+        protocol = BBSProtocol()
+        protocol.receive_data(b'\x00')
+        self.assertRaises(TruncatedHeaderError, protocol.receive_data, b'')
+
+        protocol = BBSProtocol()
+        protocol.receive_data(b'\x00\x05123')
+        self.assertRaises(TruncatedBodyError, protocol.receive_data, b'')
+
+    def test_deadlines(self):
+        protocol = BBSProtocol()
+        self.assertIsNone(protocol.next_deadline())
+
+        protocol.send_request(abort_request(), 'first', deadline=20)
+        protocol.send_request(abort_request(), 'second', deadline=10)
+        self.assertEqual(protocol.next_deadline(), 10)
+
+        # answered requests no longer count
+        protocol.receive_data(frame(b'\x5b00\x5d'))
+        protocol.receive_data(frame(b'\x5b00\x5d'))
+        self.assertIsNone(protocol.next_deadline())
+        self.assertEqual(protocol.expire(100), ([], []))
+        self.assertFalse(protocol.out_of_sync)
+
+    def test_expire(self):
+        protocol = BBSProtocol()
+        protocol.send_request(abort_request(), 'first', deadline=10)
+        protocol.send_request(abort_request(), 'second', deadline=30)
+        protocol.send_request(abort_request(), 'third')
+
+        self.assertEqual(protocol.expire(5), ([], []))
+        self.assertEqual(
+            protocol.expire(10), (['first'], ['second', 'third'])
+        )
+        self.assertTrue(protocol.out_of_sync)
+        self.assertIsNone(protocol.next_deadline())
+
+        # late responses are dropped rather than paired with new requests
+        self.assertEqual(protocol.receive_data(frame(b'\x5b00\x5d')), [])
+        self.assertRaises(OutOfSyncError, protocol.send_request, b'')
+
+        # requests from the ITU can still be answered
+        event, = protocol.receive_data(frame(b'\x43060'))
+        self.assertIsInstance(event, RequestReceived)
+        protocol.send_response()
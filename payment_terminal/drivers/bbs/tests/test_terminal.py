@@ -1,7 +1,23 @@
+import socket
 import threading
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 
-from payment_terminal.drivers.bbs import BBSMsgRouterTerminal
+from payment_terminal import open_terminal
+from payment_terminal.base import Payment
+from payment_terminal.drivers.bbs import (
+    BBSMsgRouterTerminal, _parse_tcp_options, _connect_tcp,
+)
+from payment_terminal.drivers.bbs.protocol import (
+    abort_request, transfer_amount_request,
+)
+from payment_terminal.exceptions import (
+    SessionCancelledError, ConnectionError,
+)
+from payment_terminal.drivers.bbs.tests.helpers import (
+    frame, ACK, LOCAL_MODE_SUCCESS, read_frame,
+)
 
 
 class TestBBSTerminal(unittest.TestCase):
@@ -19,3 +35,219 @@ class TestBBSTerminal(unittest.TestCase):
 
         terminal = BBSMsgRouterTerminal(CloseableFile())
         terminal.shutdown()
+
+    def test_tcp_options(self):
+        self.assertEqual(_parse_tcp_options(''), {
+            'connect_timeout': None, 'read_timeout': None,
+            'request_timeout': None, 'nodelay': False, 'keepalive': False,
+        })
+        self.assertEqual(
+            _parse_tcp_options(
+                'connect_timeout=2.5&read_timeout=none&nodelay=1'
+                '&keepalive=false'
+            ), {
+                'connect_timeout': 2.5, 'read_timeout': None,
+                'request_timeout': None, 'nodelay': True, 'keepalive': False,
+            }
+        )
+        self.assertRaises(ValueError, _parse_tcp_options, 'nodelay=maybe')
+        self.assertRaises(ValueError, _parse_tcp_options, 'read_timeout=0')
+        self.assertRaises(ValueError, _parse_tcp_options, 'timeout=1')
+
+    def test_connect_tcp(self):
+        server = socket.socket()
+        self.addCleanup(server.close)
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        host, port = server.getsockname()
+
+        s, options = _connect_tcp(
+            'bbs+tcp://%s:%i?connect_timeout=5&read_timeout=30'
+            '&request_timeout=10&nodelay=yes&keepalive=yes' % (host, port)
+        )
+        self.addCleanup(s.close)
+
+        self.assertEqual(options['request_timeout'], 10)
+        self.assertEqual(s.gettimeout(), 30)
+        self.assertTrue(
+            s.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        )
+        self.assertTrue(s.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE))
+
+    def test_open_tcp(self):
+        server = socket.socket()
+        self.addCleanup(server.close)
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        host, port = server.getsockname()
+
+        terminal = open_terminal(
+            'bbs+tcp://%s:%i?connect_timeout=5&nodelay=1' % (host, port)
+        )
+        itu, _ = server.accept()
+        itu.settimeout(5)
+        self.addCleanup(itu.close)
+
+        executor = ThreadPoolExecutor(1)
+        self.addCleanup(executor.shutdown)
+
+        session = executor.submit(terminal.start_payment, 10)
+        self.assertEqual(read_frame(itu), frame(transfer_amount_request(1000)))
+        itu.sendall(ACK)
+        session = session.result(5)
+
+        itu.sendall(LOCAL_MODE_SUCCESS)
+        self.assertEqual(read_frame(itu), ACK)
+        self.assertIsInstance(session.result(timeout=5), Payment)
+
+        # must not wait for the ITU to close its end
+        shutdown = executor.submit(terminal.shutdown)
+        shutdown.result(5)
+        self.assertEqual(itu.recv(1), b'')
+
+    def test_slow_callbacks(self):
+        local, itu = socket.socketpair()
+        itu.settimeout(5)
+        self.addCleanup(itu.close)
+
+        terminal = BBSMsgRouterTerminal(local)
+        self.addCleanup(terminal.shutdown)
+
+        unblock = threading.Event()
+        calls = []
+
+        def on_display(text, **kwargs):
+            unblock.wait(5)
+            calls.append(text)
+
+        def before_commit(payment):
+            calls.append('commit')
+            return True
+
+        executor = ThreadPoolExecutor(1)
+        self.addCleanup(executor.shutdown)
+
+        session = executor.submit(
+            terminal.start_payment, 10,
+            on_display=on_display, before_commit=before_commit,
+        )
+        read_frame(itu)
+        itu.sendall(ACK)
+        session = session.result(5)
+
+        # the ITU is answered while the display callback is still running
+        itu.sendall(frame(b'\x41100Insert card'))
+        self.assertEqual(read_frame(itu), ACK)
+        itu.sendall(LOCAL_MODE_SUCCESS)
+        self.assertEqual(read_frame(itu), ACK)
+        self.assertEqual(calls, [])
+
+        # but callbacks still run in order
+        unblock.set()
+        self.assertIsInstance(session.result(timeout=5), Payment)
+        self.assertEqual(calls, ['Insert card', 'commit'])
+        self.assertEqual(terminal.callback_stats()['calls'], 2)
+
+    def test_coalesce_display(self):
+        local, itu = socket.socketpair()
+        itu.settimeout(5)
+        self.addCleanup(itu.close)
+
+        terminal = BBSMsgRouterTerminal(local)
+        self.addCleanup(terminal.shutdown)
+
+        started = threading.Event()
+        unblock = threading.Event()
+        shown = []
+
+        def on_display(text, *, prompt_customer, expects_input):
+            started.set()
+            unblock.wait(5)
+            shown.append((text, expects_input))
+
+        executor = ThreadPoolExecutor(1)
+        self.addCleanup(executor.shutdown)
+
+        session = executor.submit(
+            terminal.start_payment, 10,
+            on_display=on_display, coalesce_display=True,
+        )
+        read_frame(itu)
+        itu.sendall(ACK)
+        session = session.result(5)
+
+        def display(text, expects_input=False):
+            itu.sendall(frame(
+                b'\x411' + (b'1' if expects_input else b'0') + b'0' + text
+            ))
+            self.assertEqual(read_frame(itu), ACK)
+
+        display(b'1')
+        self.assertTrue(started.wait(5))
+
+        # everything is acknowledged while the consumer is stuck
+        display(b'2')
+        display(b'3')
+        display(b'4', expects_input=True)
+        display(b'5')
+        display(b'6')
+
+        unblock.set()
+        for _ in range(500):
+            if len(shown) == 4:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(shown, [
+            ('1', False), ('3', False), ('4', True), ('6', False),
+        ])
+        self.assertEqual(session.display_updates_merged, 2)
+        self.assertEqual(terminal.callback_stats()['merged'], 2)
+
+    def test_cancel(self):
+        local, itu = socket.socketpair()
+        itu.settimeout(5)
+        self.addCleanup(itu.close)
+
+        terminal = BBSMsgRouterTerminal(local)
+        self.addCleanup(terminal.shutdown)
+
+        executor = ThreadPoolExecutor(1)
+        self.addCleanup(executor.shutdown)
+
+        session = executor.submit(terminal.start_payment, 10)
+        read_frame(itu)
+        itu.sendall(ACK)
+        session = session.result(5)
+
+        cancel = executor.submit(session.cancel)
+        self.assertEqual(read_frame(itu), frame(abort_request()))
+        itu.sendall(ACK)
+
+        # the ITU confirms that the payment was abandoned
+        itu.sendall(frame(
+            b'\x44\x21\x2003;20160229130509;0;123;000000012345;0042;;'
+        ))
+        self.assertEqual(read_frame(itu), ACK)
+        self.assertIsNone(cancel.result(5))
+        self.assertRaises(SessionCancelledError, session.result)
+
+    def test_shutdown_during_payment(self):
+        local, itu = socket.socketpair()
+        itu.settimeout(5)
+        self.addCleanup(itu.close)
+
+        terminal = BBSMsgRouterTerminal(local)
+
+        executor = ThreadPoolExecutor(1)
+        self.addCleanup(executor.shutdown)
+
+        session = executor.submit(terminal.start_payment, 10)
+        read_frame(itu)
+        itu.sendall(ACK)
+        session = session.result(5)
+
+        # nothing more will be heard from the ITU, so shutdown mustn't wait
+        # for it to confirm a cancellation
+        executor.submit(terminal.shutdown).result(5)
+        self.assertRaises(ConnectionError, session.result, 5)
@@ -1,6 +1,7 @@
 from threading import Thread, Lock, Event
 
 from payment_terminal.base import Terminal, PaymentSession, Payment
+from payment_terminal.callbacks import CallbackExecutor
 from payment_terminal.exceptions import (
     SessionCancelledError, SessionCompletedError,
 )
@@ -10,10 +11,18 @@ log = logging.getLogger('payment_terminal')
 
 
 class DummyPaymentSession(PaymentSession):
+    """ Pretends to take a payment.
+
+    Callbacks are run on ``callbacks``, a
+    :py:class:`~payment_terminal.callbacks.CallbackQueue`, if it is set, in
+    the same way as real drivers.  Otherwise they are called directly from the
+    session's own thread.  Display updates are coalesced if
+    ``coalesce_display`` is set.
+    """
     def __init__(
             self, amount, *, before_commit=None,
-            on_print=lambda *args, **kwargs: None,
-            on_display=lambda *args, **kwargs: None):
+            on_print=None, on_display=None, callbacks=None,
+            coalesce_display=False):
         self._lock = Lock()
         self._cancel = Event()
 
@@ -22,6 +31,8 @@ class DummyPaymentSession(PaymentSession):
         self._before_commit = before_commit
         self._on_display = on_display
         self._on_print = on_print
+        self._callbacks = callbacks
+        self._coalesce_display = coalesce_display
 
         self._result = None
         self._exception = None
@@ -33,26 +44,45 @@ class DummyPaymentSession(PaymentSession):
         if self._cancel.wait(timeout):
             raise SessionCancelledError()
 
+    def _display(self, text):
+        if self._on_display is None:
+            return
+        if self._callbacks is None:
+            self._on_display(text)
+        elif self._coalesce_display:
+            self._callbacks.coalesce('display', self._on_display, text)
+        else:
+            self._callbacks.submit(self._on_display, text)
+
+    def _commit(self, result):
+        if self._before_commit is None:
+            return True
+        # TODO result
+        try:
+            return self._before_commit(result)
+        except Exception:
+            log.exception("error in commit callback")
+            return False
+
     def _sequence(self):
         try:
-            self._on_display("Insert card")
+            self._display("Insert card")
 
             self._sleep(1)
 
-            self._on_display("Enter pin")
+            self._display("Enter pin")
 
             self._sleep(3)
 
             self._result = Payment(self.amount)
 
-            commit = True
-            if self._before_commit is not None:
-                # TODO result
-                try:
-                    commit = self._before_commit(self._result)
-                except Exception:
-                    log.exception("error in commit callback")
-                    commit = False
+            if self._callbacks is None:
+                commit = self._commit(self._result)
+            else:
+                # runs after any display callbacks that are still queued
+                commit = self._callbacks.submit(
+                    self._commit, self._result
+                ).result()
 
             if not commit:
                 self._exception = SessionCancelledError()
@@ -95,13 +125,14 @@ class DummyPaymentSession(PaymentSession):
 
 
 class DummyTerminal(Terminal):
-    def __init__(self):
+    def __init__(self, *, callback_executor=None):
         self._lock = Lock()
         self._current_session = None
+        self._callback_executor = CallbackExecutor(callback_executor)
 
     def start_payment(
             self, amount, *, before_commit=None,
-            on_print=None, on_display=None):
+            on_print=None, on_display=None, coalesce_display=False):
         with self._lock:
             if self._current_session is not None:
                 try:
@@ -111,12 +142,17 @@ class DummyTerminal(Terminal):
                     pass
             self._current_session = DummyPaymentSession(
                 amount, before_commit=before_commit,
-                on_print=on_print, on_display=on_display
+                on_print=on_print, on_display=on_display,
+                callbacks=self._callback_executor.serial(),
+                coalesce_display=coalesce_display,
             )
         return self._current_session
 
+    def callback_stats(self):
+        return self._callback_executor.stats()
+
     def shutdown(self):
-        pass
+        self._callback_executor.shutdown()
 
 
 def open_dummy(uri):
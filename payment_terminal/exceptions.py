@@ -20,6 +20,13 @@ class SessionCancelledError(SessionCompletedError):
     pass
 
 
+class SessionTimeoutError(Exception):
+    """ The terminal stopped responding before the session finished.  The
+    outcome of the payment is unknown
+    """
+    pass
+
+
 class CancelFailedError(Exception):
     """ Really bad
     """
@@ -0,0 +1,260 @@
+import time
+from concurrent import futures
+from contextlib import contextmanager
+from threading import Thread, Condition, Event
+
+import payment_terminal
+
+import logging
+log = logging.getLogger('payment_terminal')
+
+
+class _Entry(object):
+    def __init__(self, uri):
+        self.uri = uri
+        self.terminal = None
+        # future for a connection attempt that is in progress
+        self.opening = None
+        self.leased = False
+
+
+class TerminalPool(object):
+    """ Keeps connections to a fleet of terminals open, so that a live
+    terminal can be handed out without waiting to connect.
+
+    Terminals are keyed by uri and opened through
+    :py:func:`payment_terminal.open_terminal`, so any registered driver can be
+    pooled.  Each terminal is leased to one caller at a time.  Idle terminals
+    are checked in the background, and broken ones are shut down and
+    reconnected.
+
+    :param int max_concurrent_opens:
+        The maximum number of terminals that will be connecting at once.
+    :param float health_check_interval:
+        Seconds between checks of idle terminals.  ``None`` disables
+        background checks.  Terminals are always checked before being leased.
+    """
+    def __init__(
+            self, uris=(), *, max_concurrent_opens=4,
+            health_check_interval=30):
+        super(TerminalPool, self).__init__()
+
+        self._executor = futures.ThreadPoolExecutor(max_concurrent_opens)
+
+        self._condition = Condition()
+        self._entries = {}
+        self._closed = False
+
+        self._stopped = Event()
+        self._health_check_interval = health_check_interval
+        self._health_check_thread = None
+        if health_check_interval is not None:
+            self._health_check_thread = Thread(
+                target=self._health_check_loop, daemon=True
+            )
+            self._health_check_thread.start()
+
+        self.warm(uris)
+
+    def _check_open(self):
+        # should be called with `_condition` held
+        if self._closed:
+            raise RuntimeError("pool has been shut down")
+
+    def _get_entry(self, uri):
+        # should be called with `_condition` held
+        try:
+            return self._entries[uri]
+        except KeyError:
+            entry = self._entries[uri] = _Entry(uri)
+            return entry
+
+    def _start_open(self, entry):
+        # should be called with `_condition` held
+        if entry.opening is None:
+            entry.opening = self._executor.submit(self._open, entry)
+        return entry.opening
+
+    def _open(self, entry):
+        """ Runs on the executor.
+        """
+        try:
+            terminal = payment_terminal.open_terminal(entry.uri)
+        except BaseException:
+            with self._condition:
+                entry.opening = None
+                self._condition.notify_all()
+            raise
+
+        with self._condition:
+            entry.opening = None
+            # the pool may have been shut down, or the uri evicted, while
+            # connecting
+            discard = self._entries.get(entry.uri) is not entry
+            if not discard:
+                entry.terminal = terminal
+            self._condition.notify_all()
+
+        if discard:
+            self._shutdown_terminal(terminal)
+        return terminal
+
+    def _shutdown_terminal(self, terminal):
+        try:
+            terminal.shutdown()
+        except Exception:
+            log.exception("error shutting down terminal")
+
+    def _is_healthy(self, terminal):
+        try:
+            return terminal.is_connected()
+        except Exception:
+            log.exception("error checking terminal")
+            return False
+
+    def warm(self, uris):
+        """ Starts connecting to each of ``uris`` in the background, without
+        waiting for the connections to be established.
+        """
+        with self._condition:
+            self._check_open()
+            for uri in uris:
+                entry = self._get_entry(uri)
+                if entry.terminal is None:
+                    self._start_open(entry)
+
+    def acquire(self, uri, *, timeout=None):
+        """ Leases the terminal for ``uri``, connecting to it first if there
+        is no live connection.  Waits if the terminal is already leased.
+
+        :raises TimeoutError:
+            If the terminal could not be leased within ``timeout`` seconds
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+
+        def remaining():
+            if deadline is None:
+                return None
+            return max(deadline - time.monotonic(), 0)
+
+        while True:
+            broken = None
+            with self._condition:
+                self._check_open()
+                entry = self._get_entry(uri)
+
+                while entry.leased:
+                    if not self._condition.wait(remaining()):
+                        raise TimeoutError()
+                    self._check_open()
+                    # the uri may have been evicted while waiting
+                    entry = self._get_entry(uri)
+
+                if entry.terminal is not None:
+                    if self._is_healthy(entry.terminal):
+                        entry.leased = True
+                        return entry.terminal
+                    broken, entry.terminal = entry.terminal, None
+
+                opening = self._start_open(entry)
+
+            if broken is not None:
+                log.warning("evicting broken terminal: %s", uri)
+                self._shutdown_terminal(broken)
+
+            try:
+                opening.result(remaining())
+            except futures.TimeoutError as e:
+                raise TimeoutError() from e
+
+    def release(self, terminal):
+        """ Returns a leased terminal to the pool.
+        """
+        with self._condition:
+            for entry in self._entries.values():
+                if entry.terminal is terminal:
+                    entry.leased = False
+                    self._condition.notify_all()
+                    return
+        # the pool was shut down while the terminal was leased
+        log.debug("released terminal that is no longer pooled")
+
+    @contextmanager
+    def lease(self, uri, *, timeout=None):
+        """ Context manager that leases the terminal for ``uri`` for the
+        duration of the ``with`` block.
+        """
+        terminal = self.acquire(uri, timeout=timeout)
+        try:
+            yield terminal
+        finally:
+            self.release(terminal)
+
+    def evict(self, uri):
+        """ Shuts down the terminal for ``uri``, even if it is currently
+        leased, and removes it from the pool.
+        """
+        with self._condition:
+            entry = self._entries.pop(uri, None)
+            self._condition.notify_all()
+        if entry is not None and entry.terminal is not None:
+            self._shutdown_terminal(entry.terminal)
+
+    def check(self):
+        """ Checks every idle terminal, reconnecting any that are broken.
+        Called periodically from a background thread.
+        """
+        with self._condition:
+            idle = [
+                (entry, entry.terminal)
+                for entry in self._entries.values()
+                if entry.terminal is not None and not entry.leased
+            ]
+
+        for entry, terminal in idle:
+            if self._is_healthy(terminal):
+                continue
+
+            with self._condition:
+                if self._closed:
+                    return
+                if entry.terminal is not terminal or entry.leased:
+                    continue
+                entry.terminal = None
+                self._start_open(entry)
+
+            log.warning("reconnecting broken terminal: %s", entry.uri)
+            self._shutdown_terminal(terminal)
+
+    def _health_check_loop(self):
+        while not self._stopped.wait(self._health_check_interval):
+            try:
+                self.check()
+            except Exception:
+                log.exception("error checking terminals")
+
+    def shutdown(self):
+        """ Shuts down every terminal in the pool, including leased ones, and
+        waits for connection attempts in progress to finish.
+        """
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            entries = list(self._entries.values())
+            self._entries.clear()
+            self._condition.notify_all()
+
+        self._stopped.set()
+        if self._health_check_thread is not None:
+            self._health_check_thread.join()
+
+        for entry in entries:
+            if entry.terminal is not None:
+                self._shutdown_terminal(entry.terminal)
+
+        # terminals that finish connecting from now on are shut down by
+        # `_open`
+        self._executor.shutdown()
@@ -1,6 +1,8 @@
 import unittest
 
-from payment_terminal.tests import test_loader
+from payment_terminal.tests import (
+    test_callbacks, test_loader, test_pool, test_timers,
+)
 import payment_terminal.drivers.bbs.tests as test_bbs
 
 
@@ -8,6 +10,9 @@ def suite():
     loader = unittest.TestLoader()
     suite = unittest.TestSuite((
         loader.loadTestsFromModule(test_bbs),
+        loader.loadTestsFromModule(test_callbacks),
         loader.loadTestsFromModule(test_loader),
+        loader.loadTestsFromModule(test_pool),
+        loader.loadTestsFromModule(test_timers),
     ))
     return suite
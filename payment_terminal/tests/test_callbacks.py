@@ -0,0 +1,90 @@
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+
+from payment_terminal import CallbackExecutor
+
+
+class TestCallbackExecutor(unittest.TestCase):
+    def make_executor(self, *args, **kwargs):
+        executor = CallbackExecutor(*args, **kwargs)
+        self.addCleanup(executor.shutdown)
+        return executor
+
+    def test_ordering(self):
+        executor = self.make_executor(max_workers=4)
+        queue = executor.serial()
+
+        calls = []
+
+        def callback(i):
+            # give later callbacks every chance to overtake
+            time.sleep(0.001)
+            calls.append(i)
+            return i
+
+        futures = [queue.submit(callback, i) for i in range(20)]
+        self.assertEqual([f.result(5) for f in futures], list(range(20)))
+        self.assertEqual(calls, list(range(20)))
+
+    def test_independent_queues(self):
+        executor = self.make_executor(max_workers=2)
+        unblock = Event()
+
+        blocked = executor.serial().submit(unblock.wait, 5)
+        # a slow callback only holds up its own queue
+        self.assertEqual(executor.serial().submit(len, 'abc').result(5), 3)
+        self.assertFalse(blocked.done())
+        unblock.set()
+        self.assertTrue(blocked.result(5))
+
+    def test_error(self):
+        executor = self.make_executor()
+        queue = executor.serial()
+
+        def callback():
+            raise ValueError()
+
+        with self.assertLogs('payment_terminal', 'ERROR'):
+            failed = queue.submit(callback)
+            self.assertRaises(ValueError, failed.result, 5)
+        # later callbacks still run
+        self.assertEqual(queue.submit(len, 'ab').result(5), 2)
+
+    def test_external_executor(self):
+        pool = ThreadPoolExecutor(1)
+        self.addCleanup(pool.shutdown)
+        executor = self.make_executor(pool, slow_callback_duration=0.01)
+
+        with self.assertLogs('payment_terminal', 'WARNING'):
+            executor.serial().submit(time.sleep, 0.02).result(5)
+
+        stats = executor.stats()
+        self.assertEqual(stats['calls'], 1)
+        self.assertGreaterEqual(stats['max_time'], 0.02)
+
+        # the executor belongs to the caller, so is left running
+        executor.shutdown()
+        self.assertEqual(pool.submit(len, 'a').result(5), 1)
+
+    def test_coalesce(self):
+        executor = self.make_executor()
+        queue = executor.serial()
+        unblock = Event()
+        calls = []
+
+        queue.submit(unblock.wait, 5)
+        first = queue.coalesce('a', calls.append, 1)
+        self.assertIs(queue.coalesce('a', calls.append, 2), first)
+        queue.coalesce('b', calls.append, 3)
+        # plain callbacks are never merged, or merged across
+        queue.submit(calls.append, 4)
+        queue.coalesce('b', calls.append, 5)
+        last = queue.coalesce('b', calls.append, 6)
+
+        unblock.set()
+        last.result(5)
+        self.assertEqual(calls, [2, 3, 4, 6])
+        self.assertEqual(queue.merged, 2)
+        self.assertEqual(executor.stats()['merged'], 2)
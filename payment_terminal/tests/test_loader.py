@@ -1,7 +1,10 @@
+import asyncio
 import unittest
+from threading import Event
 
 from payment_terminal.exceptions import NotSupportedError
-from payment_terminal import open_terminal, register_driver
+from payment_terminal import open_terminal, open_terminals, register_driver
+import payment_terminal.aio
 
 
 class TestLoader(unittest.TestCase):
@@ -20,3 +23,62 @@ class TestLoader(unittest.TestCase):
 
     def test_not_supported(self):
         self.assertRaises(NotSupportedError, open_terminal, 'ftp://')
+
+    def test_open_terminals(self):
+        release = Event()
+        shut_down = Event()
+
+        class BulkTestTerminal(object):
+            def __init__(self, uri):
+                self.uri = uri
+
+            def shutdown(self):
+                shut_down.set()
+
+        def test_driver(uri):
+            if uri.endswith('slow'):
+                release.wait(5)
+            if uri.endswith('broken'):
+                raise OSError("connection refused")
+            return BulkTestTerminal(uri)
+
+        register_driver('bulktestdriver', test_driver)
+
+        uris = [
+            'bulktestdriver://a', 'bulktestdriver://b',
+            'bulktestdriver://broken', 'bulktestdriver://slow', 'ftp://',
+        ]
+        results = open_terminals(uris, timeout=0.1)
+
+        self.assertEqual(set(results), set(uris))
+        self.assertEqual(results['bulktestdriver://a'].uri, uris[0])
+        self.assertEqual(results['bulktestdriver://b'].uri, uris[1])
+        self.assertIsInstance(results['bulktestdriver://broken'], OSError)
+        self.assertIsInstance(results['bulktestdriver://slow'], TimeoutError)
+        self.assertIsInstance(results['ftp://'], NotSupportedError)
+
+        # terminals that finish opening after the deadline are not leaked
+        release.set()
+        self.assertTrue(shut_down.wait(5))
+
+    def test_open_async(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        handle = object()
+
+        async def test_driver(uri):
+            return handle
+
+        payment_terminal.aio.register_driver('asynctestdriver', test_driver)
+
+        open_terminal = payment_terminal.aio.open_terminal
+        self.assertIs(
+            loop.run_until_complete(open_terminal('asynctestdriver://')),
+            handle
+        )
+        self.assertRaises(
+            ValueError, loop.run_until_complete, open_terminal('example.com')
+        )
+        self.assertRaises(
+            NotSupportedError, loop.run_until_complete, open_terminal('ftp://')
+        )
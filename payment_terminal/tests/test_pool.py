@@ -0,0 +1,135 @@
+import time
+import unittest
+from threading import Event, Lock
+
+from payment_terminal import TerminalPool, register_driver
+from payment_terminal.base import Terminal
+
+
+class PoolTestTerminal(Terminal):
+    def __init__(self, uri):
+        self.uri = uri
+        self.connected = True
+        self.shut_down = False
+
+    def is_connected(self):
+        return self.connected
+
+    def shutdown(self):
+        self.shut_down = True
+
+
+class TestTerminalPool(unittest.TestCase):
+    def setUp(self):
+        self.opened = []
+        self.gate = None
+        self.lock = Lock()
+        self.concurrent = 0
+        self.max_concurrent = 0
+
+        def driver(uri):
+            with self.lock:
+                self.concurrent += 1
+                self.max_concurrent = max(self.concurrent, self.max_concurrent)
+            try:
+                if self.gate is not None:
+                    self.gate.wait(5)
+                if uri.endswith('broken'):
+                    raise OSError("connection refused")
+                terminal = PoolTestTerminal(uri)
+                self.opened.append(terminal)
+                return terminal
+            finally:
+                with self.lock:
+                    self.concurrent -= 1
+
+        register_driver('pooltest', driver)
+
+    def make_pool(self, *args, **kwargs):
+        kwargs.setdefault('health_check_interval', None)
+        pool = TerminalPool(*args, **kwargs)
+        self.addCleanup(pool.shutdown)
+        return pool
+
+    def test_reuse(self):
+        pool = self.make_pool()
+
+        with pool.lease('pooltest://a') as terminal:
+            self.assertIsInstance(terminal, PoolTestTerminal)
+        with pool.lease('pooltest://a') as second:
+            self.assertIs(second, terminal)
+        with pool.lease('pooltest://b') as other:
+            self.assertIsNot(other, terminal)
+
+        self.assertEqual(len(self.opened), 2)
+
+    def test_warm(self):
+        pool = self.make_pool(['pooltest://a', 'pooltest://b'])
+
+        with pool.lease('pooltest://b', timeout=5):
+            pass
+        with pool.lease('pooltest://a', timeout=5):
+            pass
+        self.assertEqual(len(self.opened), 2)
+
+    def test_exclusive_lease(self):
+        pool = self.make_pool()
+
+        terminal = pool.acquire('pooltest://a')
+        self.assertRaises(
+            TimeoutError, pool.acquire, 'pooltest://a', timeout=0.01
+        )
+        pool.release(terminal)
+        self.assertIs(pool.acquire('pooltest://a', timeout=1), terminal)
+
+    def test_evict_broken(self):
+        pool = self.make_pool()
+
+        with pool.lease('pooltest://a') as terminal:
+            pass
+        terminal.connected = False
+
+        with pool.lease('pooltest://a') as replacement:
+            self.assertIsNot(replacement, terminal)
+        self.assertTrue(terminal.shut_down)
+
+    def test_health_check(self):
+        pool = self.make_pool()
+
+        with pool.lease('pooltest://a') as terminal:
+            pass
+        terminal.connected = False
+
+        pool.check()
+        self.assertTrue(terminal.shut_down)
+        with pool.lease('pooltest://a', timeout=5) as replacement:
+            self.assertIsNot(replacement, terminal)
+        self.assertEqual(len(self.opened), 2)
+
+    def test_open_error(self):
+        pool = self.make_pool()
+        self.assertRaises(OSError, pool.acquire, 'pooltest://broken')
+
+    def test_max_concurrent_opens(self):
+        self.gate = Event()
+        pool = self.make_pool(max_concurrent_opens=2)
+        pool.warm(['pooltest://%i' % i for i in range(6)])
+        for _ in range(500):
+            if self.concurrent == 2:
+                break
+            time.sleep(0.01)
+        self.gate.set()
+
+        with pool.lease('pooltest://5', timeout=5):
+            pass
+        self.assertEqual(self.max_concurrent, 2)
+
+    def test_shutdown(self):
+        pool = TerminalPool(health_check_interval=0.01)
+        terminal = pool.acquire('pooltest://a')
+        pool.shutdown()
+
+        self.assertTrue(terminal.shut_down)
+        self.assertRaises(RuntimeError, pool.acquire, 'pooltest://a')
+        # releasing a terminal after shutdown is harmless
+        pool.release(terminal)
@@ -0,0 +1,70 @@
+import time
+import unittest
+from threading import Event
+
+from payment_terminal.timers import TimerWheel
+
+
+class TestTimerWheel(unittest.TestCase):
+    def make_wheel(self, *args, **kwargs):
+        wheel = TimerWheel(*args, **kwargs)
+        self.addCleanup(wheel.shutdown)
+        return wheel
+
+    def test_fire(self):
+        wheel = self.make_wheel(0.01)
+        fired = Event()
+
+        start = time.monotonic()
+        timer = wheel.schedule(0.05, fired.set)
+        self.assertTrue(timer.armed())
+        self.assertTrue(fired.wait(5))
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+        self.assertFalse(timer.armed())
+
+    def test_cancel(self):
+        wheel = self.make_wheel(0.01)
+        fired = Event()
+
+        timer = wheel.schedule(0.02, fired.set)
+        timer.cancel()
+        self.assertFalse(timer.armed())
+        self.assertFalse(fired.wait(0.1))
+
+    def test_restart(self):
+        wheel = self.make_wheel(0.01)
+        fired = Event()
+
+        start = time.monotonic()
+        timer = wheel.schedule(0.02, fired.set)
+        timer.restart(0.1)
+        self.assertTrue(fired.wait(5))
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+
+        # timers can be re-armed after firing
+        fired.clear()
+        timer.restart(0.01)
+        self.assertTrue(fired.wait(5))
+
+    def test_order(self):
+        # small wheel so that timers cascade through every level, and some
+        # are further away than the wheel can hold
+        wheel = self.make_wheel(0.005, slots=2, levels=3)
+        fired = []
+        done = Event()
+
+        delays = [0.09, 0.01, 0.05, 0.03, 0.07, 0.002]
+        for delay in delays:
+            wheel.schedule(delay, lambda delay=delay: fired.append(delay))
+        wheel.schedule(0.1, done.set)
+
+        self.assertTrue(done.wait(5))
+        self.assertEqual(fired, sorted(delays))
+
+    def test_shutdown(self):
+        wheel = TimerWheel(0.01)
+        fired = Event()
+        wheel.schedule(0.01, fired.set)
+        wheel.shutdown()
+        self.assertFalse(fired.wait(0.05))
+        self.assertRaises(RuntimeError, wheel.schedule, 1, fired.set)
@@ -0,0 +1,214 @@
+import math
+import time
+from threading import Thread, Condition, Lock
+
+import logging
+log = logging.getLogger('payment_terminal')
+
+
+class Timer(object):
+    """ A timeout scheduled on a :py:class:`TimerWheel`.  Created by
+    :py:meth:`TimerWheel.schedule`.
+    """
+    __slots__ = ('_wheel', '_callback', '_expires', '_slot')
+
+    def __init__(self, wheel, callback):
+        self._wheel = wheel
+        self._callback = callback
+        # tick at which the timer fires
+        self._expires = None
+        # set containing the timer, or ``None`` if it isn't armed
+        self._slot = None
+
+    def restart(self, delay):
+        """ Re-arms the timer to fire ``delay`` seconds from now, whether or
+        not it has already fired or been cancelled.
+        """
+        self._wheel._restart(self, delay)
+
+    def cancel(self):
+        """ Stops the timer from firing.  The callback may still be called if
+        the timer is already firing.
+        """
+        self._wheel._cancel(self)
+
+    def armed(self):
+        return self._slot is not None
+
+
+class TimerWheel(object):
+    """ Runs timeouts for any number of sessions from a single thread.
+
+    Timers are kept in a hierarchical timing wheel.  The first level has
+    ``slots`` slots, each ``resolution`` seconds wide, and every slot of each
+    following level covers a full turn of the level below.  Arming,
+    re-arming and cancelling a timer only move it between slots, so take
+    constant time however many timers there are.  As the wheel turns, timers
+    in higher levels are moved down until they reach the first level and
+    fire.  Timers fire up to ``resolution`` seconds late.
+
+    Callbacks are called from the wheel's thread, which is started when the
+    first timer is armed.  They should not block.
+    """
+    def __init__(self, resolution=0.1, *, slots=64, levels=4):
+        super(TimerWheel, self).__init__()
+
+        self._resolution = resolution
+        self._slots = slots
+        # width of the slots in each level, in ticks
+        self._spans = [slots ** level for level in range(levels)]
+        self._wheels = [
+            [set() for _ in range(slots)] for _ in range(levels)
+        ]
+
+        self._condition = Condition()
+        self._start = time.monotonic()
+        # last tick that has been processed
+        self._tick = 0
+        self._count = 0
+        self._thread = None
+        self._shutdown = False
+
+    def _now(self):
+        return int((time.monotonic() - self._start) / self._resolution)
+
+    def _insert(self, timer):
+        # should be called with `_condition` held.  Timers moved down on the
+        # tick that they expire go in the slot that is about to fire
+        expires = max(timer._expires, self._tick)
+        delta = expires - self._tick
+        for span, wheel in zip(self._spans, self._wheels):
+            if delta < span * self._slots:
+                break
+        else:
+            # further away than the wheel can represent.  Park the timer in
+            # the furthest slot of the top level, it will be re-inserted when
+            # that slot comes round
+            expires = self._tick + span * (self._slots - 1)
+        slot = wheel[(expires // span) % self._slots]
+        slot.add(timer)
+        timer._slot = slot
+
+    def _remove(self, timer):
+        # should be called with `_condition` held
+        if timer._slot is not None:
+            timer._slot.discard(timer)
+            timer._slot = None
+            self._count -= 1
+
+    def schedule(self, delay, callback):
+        """ Arms a new timer that will call ``callback`` with no arguments
+        after ``delay`` seconds.
+
+        :returns: A :py:class:`Timer` that can be re-armed or cancelled
+        """
+        timer = Timer(self, callback)
+        self._restart(timer, delay)
+        return timer
+
+    def _restart(self, timer, delay):
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("timer wheel has been shut down")
+            self._remove(timer)
+            if self._count == 0:
+                # nothing has been turning the wheel
+                self._tick = self._now()
+            # never fire early
+            timer._expires = max(
+                math.ceil(
+                    (time.monotonic() - self._start + delay) /
+                    self._resolution
+                ),
+                self._tick + 1,
+            )
+            self._insert(timer)
+            self._count += 1
+
+            if self._thread is None:
+                self._thread = Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _cancel(self, timer):
+        with self._condition:
+            self._remove(timer)
+
+    def _advance(self, now):
+        """ Turns the wheel up to tick ``now`` and returns the timers that
+        have expired.  Should be called with `_condition` held.
+        """
+        expired = []
+        while self._tick < now and self._count:
+            self._tick += 1
+            tick = self._tick
+
+            # move timers down from every level that has completed a turn,
+            # starting from the top so that they can cascade all the way
+            for level in range(len(self._spans) - 1, 0, -1):
+                span = self._spans[level]
+                if tick % span:
+                    continue
+                slot = self._wheels[level][(tick // span) % self._slots]
+                timers = list(slot)
+                slot.clear()
+                for timer in timers:
+                    self._insert(timer)
+
+            slot = self._wheels[0][tick % self._slots]
+            for timer in slot:
+                timer._slot = None
+            self._count -= len(slot)
+            expired.extend(slot)
+            slot.clear()
+
+        if not self._count:
+            self._tick = now
+        return expired
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._count and not self._shutdown:
+                    self._condition.wait()
+                if self._shutdown:
+                    return
+
+                next_tick = self._start + (self._tick + 1) * self._resolution
+                timeout = next_tick - time.monotonic()
+                if timeout > 0:
+                    self._condition.wait(timeout)
+                    continue
+
+                expired = self._advance(self._now())
+
+            for timer in expired:
+                try:
+                    timer._callback()
+                except Exception:
+                    log.exception("error in timer callback")
+
+    def shutdown(self):
+        """ Stops the wheel's thread.  Armed timers will never fire.
+        """
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+
+_default_wheel = None
+_default_wheel_lock = Lock()
+
+
+def default_timer_wheel():
+    """ Returns the :py:class:`TimerWheel` shared by every session in the
+    process that isn't given one of its own.
+    """
+    global _default_wheel
+    with _default_wheel_lock:
+        if _default_wheel is None:
+            _default_wheel = TimerWheel()
+        return _default_wheel